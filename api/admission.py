@@ -0,0 +1,366 @@
+"""
+Admission control and scheduling in front of PDFTableProcessor.
+
+At most ADMISSION_MAX_RUNNING extractions run at once, and at most
+ADMISSION_MAX_RUNNING_PER_USER per user. Further requests wait in a queue.
+Requests are turned away instead of piling up:
+
+- 429 when the user already has ADMISSION_MAX_PENDING_PER_USER extractions running or waiting
+- 503 when ADMISSION_MAX_QUEUED requests are waiting, or after ADMISSION_QUEUE_TIMEOUT seconds in the queue
+
+Both carry Retry-After: the time the work ahead of the request needs at the
+observed throughput (moving average of extraction durations over the slots).
+
+Waiting requests are served by plan. Every user is in a lane: pro, standard or free,
+from their active Subscription.plan_type. An active UserPromotion lifts the user to
+at least standard. Free slots go to the waiter with the smallest weighted-fair-queueing
+finish tag. The tag is the user's virtual start plus the request's pages divided by
+the lane weight (SCHEDULER_WEIGHTS). A pro user's 2-page invoice therefore goes
+ahead of a free user's 300-page upload, and a user sending many documents only
+delays themselves. SCHEDULER_RESERVED_SLOTS slots are never given to the free
+lane, so free work can't occupy every slot while paid work waits.
+
+Background jobs go through the same slots but wait instead of being rejected;
+their own queue is bounded by jobs.MAX_QUEUED_JOBS.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+# Defaults to the size of the extraction thread pool (jobs.MAX_RUNNING_JOBS) that runs admitted work
+MAX_RUNNING = int(os.getenv("ADMISSION_MAX_RUNNING", os.getenv("EXTRACTION_JOB_WORKERS", "2")))
+MAX_RUNNING_PER_USER = int(os.getenv("ADMISSION_MAX_RUNNING_PER_USER", "2"))
+MAX_PENDING_PER_USER = int(os.getenv("ADMISSION_MAX_PENDING_PER_USER", "4"))
+MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "32"))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))
+# Used for Retry-After until the first extraction has finished
+DEFAULT_EXTRACTION_SECONDS = 30.0
+# Weight of the latest extraction in the moving average
+DURATION_SMOOTHING = 0.2
+
+LANES = ("pro", "standard", "free")
+LANE_WEIGHTS = {
+    lane: float(weight)
+    for lane, weight in (item.split(":") for item in os.getenv("SCHEDULER_WEIGHTS", "pro:8,standard:3,free:1").split(","))
+}
+RESERVED_SLOTS = int(os.getenv("SCHEDULER_RESERVED_SLOTS", "1"))
+# Cost (pages) assumed when a request doesn't say how many pages it will process
+DEFAULT_COST = 30
+MAX_COST = 1000
+# How long a user's lane is remembered before the database is asked again
+LANE_CACHE_SECONDS = 60
+
+
+def _clamp_cost(cost):
+    return min(max(cost, 1), MAX_COST)
+
+
+class Ticket:
+    __slots__ = ("user_id", "lane", "cost", "started", "released")
+
+    def __init__(self, user_id, lane, cost):
+        self.user_id = user_id
+        self.lane = lane
+        self.cost = cost
+        self.started = time.monotonic()
+        self.released = False
+
+
+class Waiter:
+    __slots__ = ("user_id", "lane", "cost", "start_tag", "finish_tag", "future", "queued_at")
+
+    def __init__(self, user_id, lane, cost, start_tag, finish_tag, future):
+        self.user_id = user_id
+        self.lane = lane
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(self, max_running=MAX_RUNNING, max_running_per_user=MAX_RUNNING_PER_USER,
+                 max_pending_per_user=MAX_PENDING_PER_USER, max_queued=MAX_QUEUED, queue_timeout=QUEUE_TIMEOUT,
+                 weights=None, reserved_slots=RESERVED_SLOTS):
+        self.max_running = max_running
+        self.max_running_per_user = max_running_per_user
+        self.max_pending_per_user = max_pending_per_user
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.weights = weights or LANE_WEIGHTS
+        # The free lane gets whatever is left after the reserved slots, but always at least one
+        self.free_lane_slots = max(1, max_running - reserved_slots)
+        self.running = 0
+        self._running_by_user = defaultdict(int)
+        self._running_by_lane = defaultdict(int)
+        self._pending_by_user = defaultdict(int)  # running + waiting
+        self._waiters = []
+        # Weighted fair queueing state: virtual time and each user's last finish tag
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self.avg_seconds = None
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _eligible(self, user_id, lane):
+        if self.running >= self.max_running:
+            return False
+        if self._running_by_user.get(user_id, 0) >= self.max_running_per_user:
+            return False
+        return lane != "free" or self._running_by_lane.get("free", 0) < self.free_lane_slots
+
+    def _tags(self, user_id, lane, cost):
+        start = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        finish = start + _clamp_cost(cost) / self.weights.get(lane, 1.0)
+        self._last_finish[user_id] = finish
+        return start, finish
+
+    def _start(self, user_id, lane, start_tag, cost):
+        self.running += 1
+        self._running_by_user[user_id] += 1
+        self._running_by_lane[lane] += 1
+        self._virtual_time = max(self._virtual_time, start_tag)
+        return Ticket(user_id, lane, cost)
+
+    def retry_after(self, ahead=None, slots=None):
+        """Seconds until `ahead` extractions (default: the whole queue plus one) get through `slots` slots."""
+        ahead = self.queued + 1 if ahead is None else ahead
+        per_extraction = self.avg_seconds or DEFAULT_EXTRACTION_SECONDS
+        return max(1, math.ceil(ahead * per_extraction / (slots or self.max_running)))
+
+    def _reject(self, status_code, reason, retry_after, detail):
+        ADMISSION_REJECTED.labels(reason).inc()
+        raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    def _set_queue_depth(self):
+        for lane in LANES:
+            ADMISSION_QUEUE_DEPTH.labels(lane).set(sum(1 for w in self._waiters if w.lane == lane))
+
+    async def acquire(self, user_id, bounded=True, lane="free", cost=DEFAULT_COST):
+        """
+        Wait for an extraction slot and return its Ticket. cost is the number of pages the
+        request will process (its share of the fair queue). bounded=False (background jobs)
+        skips the queue and per-user pending limits and waits as long as it takes.
+        """
+        if bounded:
+            self._check_user_limit(user_id)
+        # _dispatch leaves no waiter that could start, so an eligible request never jumps ahead of one
+        if self._eligible(user_id, lane):
+            start_tag, _ = self._tags(user_id, lane, cost)
+            self._pending_by_user[user_id] += 1
+            ADMISSION_WAIT_SECONDS.labels(lane).observe(0)
+            return self._start(user_id, lane, start_tag, cost)
+        if bounded and self.queued >= self.max_queued:
+            self._reject(503, "queue_full", self.retry_after(), "Extraction queue is full, try again later")
+
+        waiter = Waiter(user_id, lane, cost, *self._tags(user_id, lane, cost), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._pending_by_user[user_id] += 1
+        self._set_queue_depth()
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout if bounded else None)
+        except asyncio.CancelledError:
+            # Client went away while waiting; hand back a slot granted meanwhile
+            if waiter.future.done():
+                self.release(waiter.future.result())
+            else:
+                self._drop(waiter)
+            raise
+        if not waiter.future.done():
+            self._drop(waiter)
+            self._reject(503, "timeout", self.retry_after(), "Timed out waiting for an extraction slot")
+        ADMISSION_WAIT_SECONDS.labels(lane).observe(time.monotonic() - waiter.queued_at)
+        return waiter.future.result()
+
+    def _check_user_limit(self, user_id):
+        if self._pending_by_user.get(user_id, 0) >= self.max_pending_per_user:
+            self._reject(
+                429, "user_limit",
+                self.retry_after(self._pending_by_user[user_id], self.max_running_per_user),
+                f"Too many extractions in progress for this user (limit {self.max_pending_per_user})",
+            )
+
+    def hold(self, user_id):
+        """
+        Count work that will ask for slots later (a batch) as one pending extraction of the
+        user; 429 if the user is at ADMISSION_MAX_PENDING_PER_USER. Undo with unhold().
+        """
+        self._check_user_limit(user_id)
+        self._pending_by_user[user_id] += 1
+
+    def unhold(self, user_id):
+        self._release_pending(user_id)
+
+    def adjust_cost(self, ticket, cost):
+        """
+        Replace a running request's estimated cost with the real one (known once its PDF
+        is read). Moves the user's later requests in the fair queue accordingly.
+        """
+        if not ticket.released and ticket.user_id in self._last_finish:
+            self._last_finish[ticket.user_id] += (
+                (_clamp_cost(cost) - _clamp_cost(ticket.cost)) / self.weights.get(ticket.lane, 1.0)
+            )
+        ticket.cost = cost
+
+    def _drop(self, waiter):
+        self._waiters.remove(waiter)
+        self._release_pending(waiter.user_id)
+        self._dispatch()  # the dropped waiter may have been holding up eligible ones
+
+    def _release_pending(self, user_id):
+        self._pending_by_user[user_id] -= 1
+        if self._pending_by_user[user_id] <= 0:
+            del self._pending_by_user[user_id]
+
+    def release(self, ticket):
+        """Give a slot back; releasing the same ticket again does nothing."""
+        if ticket.released:
+            return
+        ticket.released = True
+        duration = time.monotonic() - ticket.started
+        self.avg_seconds = duration if self.avg_seconds is None else (
+            DURATION_SMOOTHING * duration + (1 - DURATION_SMOOTHING) * self.avg_seconds
+        )
+        self.running -= 1
+        for counts, key in ((self._running_by_user, ticket.user_id), (self._running_by_lane, ticket.lane)):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+        self._release_pending(ticket.user_id)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to eligible waiters, smallest finish tag first."""
+        while self._waiters and self.running < self.max_running:
+            eligible = [w for w in self._waiters if self._eligible(w.user_id, w.lane)]
+            if not eligible:
+                break
+            waiter = min(eligible, key=lambda w: (w.finish_tag, w.queued_at))
+            self._waiters.remove(waiter)
+            waiter.future.set_result(self._start(waiter.user_id, waiter.lane, waiter.start_tag, waiter.cost))
+        # A user with nothing running or waiting starts over at the virtual time
+        self._last_finish = {
+            user_id: tag for user_id, tag in self._last_finish.items() if user_id in self._pending_by_user
+        }
+        self._set_queue_depth()
+
+    @asynccontextmanager
+    async def slot(self, user_id, bounded=True, lane="free", cost=DEFAULT_COST):
+        ticket = await self.acquire(user_id, bounded, lane, cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def status(self):
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_running": self.max_running,
+            "running_by_lane": dict(self._running_by_lane),
+            "queued_by_lane": {lane: sum(1 for w in self._waiters if w.lane == lane) for lane in LANES},
+            "avg_extraction_seconds": None if self.avg_seconds is None else round(self.avg_seconds, 2),
+        }
+
+
+controller = AdmissionController()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse holding an admission ticket. The ticket is released, and on_close
+    (a coroutine function) awaited, once the response is over, even if the client went away
+    before the body was iterated (the body's own finally never runs then).
+    """
+
+    def __init__(self, content, ticket, on_close=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            controller.release(self.ticket)
+            if self.on_close is not None:
+                await self.on_close()
+
+
+_lane_cache = {}
+
+
+async def user_lane(user_id):
+    """Scheduling lane of a user from their subscription and promotions (cached briefly)."""
+    cached = _lane_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[1] < LANE_CACHE_SECONDS:
+        return cached[0]
+
+    from sqlalchemy.future import select
+
+    from database import AsyncSessionLocal
+    from models import Subscription
+    from quota import has_active_promotion
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Subscription).where(Subscription.user_id == user_id))
+        subscription = result.scalars().first()
+        lane = "free"
+        if subscription is not None and subscription.status == "active" and subscription.plan_type in LANES:
+            lane = subscription.plan_type
+        if lane == "free" and await has_active_promotion(db, user_id):
+            lane = "standard"
+    _lane_cache[user_id] = (lane, time.monotonic())
+    return lane
+
+
+def requested_pages(pages=None, pages_limit=None):
+    """
+    Cost estimate for the fair queue from the request's page selection or limit, at most
+    MAX_COST. The PDF hasn't been read yet, so open ranges ("5-") count as MAX_COST pages.
+    """
+    if pages:
+        count = 0
+        try:
+            for part in pages.split(','):
+                first, dash, last = part.strip().partition('-')
+                first = int(first)
+                if not dash:
+                    last = first
+                else:
+                    last = int(last) if last.strip() else first + MAX_COST
+                count += max(last - first + 1, 0)
+        except ValueError:
+            return DEFAULT_COST  # the endpoint rejects it
+        return _clamp_cost(count)
+    return _clamp_cost(pages_limit or DEFAULT_COST)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def session_user_slot(request: Request):
+    """FastAPI dependency: hold an extraction slot for the session user while the endpoint runs."""
+    user_id = request.session.get('user_id')
+    if user_id is None:
+        yield  # the endpoint answers 401
+        return
+    cost = requested_pages(request.query_params.get('pages'), _int_or_none(request.query_params.get('pages_limit')))
+    async with controller.slot(user_id, lane=await user_lane(user_id), cost=cost):
+        yield
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from auth import verify_api_key
 from models import User, APIKey
@@ -8,15 +8,115 @@ import os
 import tempfile
 from typing import List, Optional
 import asyncio
+import time
+import continuation
+from upload_pipeline import save_upload, MAX_UPLOAD_BYTES
+from pdf_utils import parse_page_ranges
+from stage_timings import emit as emit_timings
+from metrics import EXTRACTIONS_IN_FLIGHT
+from admission import controller as admission, requested_pages, user_lane
 
 router = APIRouter()
 
+# Pages a single /api/v1/extract request processes at most
+MAX_PAGES_PER_REQUEST = 999
+
+
+async def api_user_slot(
+    pages_limit: Optional[int] = None,
+    pages: Optional[str] = None,
+    auth_data: dict = Depends(verify_api_key)
+):
+    """Hold an admission control slot for the API key's user while the endpoint runs; yields its Ticket."""
+    user_id = auth_data["user"].id
+    async with admission.slot(user_id, lane=await user_lane(user_id), cost=requested_pages(pages, pages_limit)) as ticket:
+        yield ticket
+
+
+def table_entry(page_num, table_idx, extracted_data, output_format):
+    """One table of an /api/v1/extract response: its rows, as JSON and/or CSV."""
+    import csv
+    import io
+
+    table_data = {
+        "page": page_num + 1,
+        "table_index": table_idx,
+        "data": extracted_data
+    }
+
+    # Add format-specific data
+    if output_format in ['json', 'both']:
+        table_data["json_data"] = extracted_data
+
+    if output_format in ['csv', 'both']:
+        # Convert to CSV format
+        output = io.StringIO()
+        if extracted_data:
+            writer = csv.writer(output)
+            writer.writerows(extracted_data)
+            table_data["csv_data"] = output.getvalue()
+    return table_data
+
+
+def extract_pages(processor, page_numbers, output_format, budget=None, skip_tables=0, cancel=None):
+    """
+    Detect and format the tables of page_numbers in memory (blocking; run it in a worker thread).
+    Returns (tables, pages_processed, stopped_at). stopped_at is None unless the budget
+    (continuation.Budget) or cancel (cancellation.CancelToken) ended the work early. In that
+    case it is (pages left, tables of the first one already returned).
+    skip_tables tables of the first page are left out (a continuation already returned them).
+    """
+    budget = budget or continuation.Budget()
+    tables_data = []
+    pages_processed = 0
+    EXTRACTIONS_IN_FLIGHT.inc()
+    try:
+        for position, page_num in enumerate(page_numbers):
+            skip = skip_tables if position == 0 else 0
+            if not budget.fits("page", "table") or (cancel is not None and cancel.cancelled):
+                return tables_data, pages_processed, (list(page_numbers[position:]), skip)
+            # Tables are detected only for the pages we actually process
+            budget.start()
+            page_tables = processor.get_page_tables(page_num)
+            budget.done("page")
+
+            for table_idx, table in enumerate(page_tables):
+                if table_idx < skip:
+                    continue  # returned by the request this one continues
+                if not budget.fits("table") or (cancel is not None and cancel.cancelled):
+                    return tables_data, pages_processed, (list(page_numbers[position:]), table_idx)
+                budget.start()
+                try:
+                    # Extract table data
+                    extracted_data = processor.format_single_table(table)
+                    tables_data.append(table_entry(page_num, table_idx, extracted_data, output_format))
+                    processor.timings.count("tables")
+
+                except Exception as e:
+                    print(f"Error processing table {table_idx} on page {page_num + 1}: {e}")
+                    continue
+                finally:
+                    budget.done("table")
+
+            pages_processed += 1
+            processor.timings.count("pages")
+    finally:
+        EXTRACTIONS_IN_FLIGHT.dec()
+        emit_timings(processor.timings.summary())
+    return tables_data, pages_processed, None
+
+
 @router.post("/v1/extract")
 async def api_extract_tables(
     file: UploadFile = File(...),
     output_format: str = "both",  # json, csv, both
     pages_limit: Optional[int] = None,
-    auth_data: dict = Depends(verify_api_key)
+    pages: Optional[str] = None,  # e.g. "12-15,180"
+    deadline_ms: Optional[int] = None,  # return partial results before this budget runs out
+    continuation_token: Optional[str] = Query(None, alias="continuation"),  # resume a cut-short extraction
+    request: Request = None,
+    auth_data: dict = Depends(verify_api_key),
+    slot=Depends(api_user_slot)  # 429/503 with Retry-After when too busy
 ):
     """
     Public API endpoint for PDF table extraction
@@ -25,6 +125,11 @@ async def api_extract_tables(
     - file: PDF file to process
     - output_format: "json", "csv", or "both"
     - pages_limit: Maximum pages to process (optional)
+    - pages: 1-based pages and ranges to process instead, e.g. "12-15,180" (optional)
+    - deadline_ms: Time budget from the request's arrival; when it is nearly spent the
+      tables found so far are returned with a continuation token (optional)
+    - continuation: Token from a previous response; send the same PDF again to resume
+      from where that request stopped (optional, replaces pages)
     
     Returns:
     - JSON response with extraction results
@@ -37,19 +142,44 @@ async def api_extract_tables(
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Sadece PDF dosyaları desteklenir")
     
-    if file.size > 50 * 1024 * 1024:  # 50MB limit
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:  # 50MB limit
         raise HTTPException(status_code=400, detail="Dosya boyutu 50MB'dan küçük olmalı")
+
+    if deadline_ms is not None and deadline_ms < 1:
+        raise HTTPException(status_code=400, detail="deadline_ms must be positive")
+    received_at = getattr(request.state, "received_at", None) or time.monotonic()
+    budget = continuation.Budget(None if deadline_ms is None else received_at + deadline_ms / 1000)
     
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Stream the upload to a temporary file (size limit and hash checked on the fly)
+        temp_fd, temp_file_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(temp_fd)
+        processor = None
         
         try:
-            # Initialize PDF processor
-            processor = PDFTableProcessor(temp_file_path)
+            saved = await save_upload(file, temp_file_path)
+
+            # Initialize PDF processor; the upload hash keys the extraction cache
+            processor = PDFTableProcessor(temp_file_path, content_hash=saved.sha256, user_id=user.id)
+
+            # Explicit page selection replaces the first pages_limit pages; a continuation
+            # token selects the pages a previous request didn't get to
+            page_indices = None
+            skip_tables = 0
+            if continuation_token:
+                try:
+                    page_indices, skip_tables = continuation.decode(
+                        continuation_token, user.id, saved.sha256, processor.total_pages
+                    )
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                pages_limit = len(page_indices)
+            elif pages:
+                try:
+                    page_indices = parse_page_ranges(pages, processor.total_pages)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                pages_limit = len(page_indices)
             
             # Check for active promotion
             from models import UserPromotion
@@ -71,52 +201,34 @@ async def api_extract_tables(
                         has_active_promo = True
                         break
                 
-                # Process with page limit - unlimited if promo active
-                if has_active_promo:
-                    pages_to_process = pages_limit or 999  # Unlimited with promotion
+                # Get PDF info (page count comes from metadata, no detection yet)
+                total_pages = processor.total_pages
+
+                # Pages the request asked for: the selection or token, else the first pages_limit
+                if page_indices is not None:
+                    selected = page_indices
                 else:
-                    pages_to_process = min(pages_limit or 999, user.monthly_page_limit)
-                
-                tables_data = []
-                pages_processed = 0
-                
-                # Get PDF info
-                total_pages = processor.page_count
-                
-                for page_num in range(min(pages_to_process, total_pages)):
-                    page_tables = processor.per_page_tables.get(page_num, [])
-                    pages_processed = page_num + 1
-                    
-                    for table_idx, table in enumerate(page_tables):
-                        try:
-                            # Extract table data
-                            extracted_data = processor.format_single_table(table)
-                            
-                            table_data = {
-                                "page": page_num + 1,
-                                "table_index": table_idx,
-                                "data": extracted_data
-                            }
-                            
-                            # Add format-specific data
-                            if output_format in ['json', 'both']:
-                                table_data["json_data"] = extracted_data
-                            
-                            if output_format in ['csv', 'both']:
-                                # Convert to CSV format
-                                import csv
-                                import io
-                                output = io.StringIO()
-                                if extracted_data:
-                                    writer = csv.writer(output)
-                                    writer.writerows(extracted_data)
-                                    table_data["csv_data"] = output.getvalue()
-                            
-                            tables_data.append(table_data)
-                            
-                        except Exception as e:
-                            print(f"Error processing table {table_idx} on page {page_num + 1}: {e}")
-                            continue
+                    selected = list(range(min(pages_limit or total_pages, total_pages)))
+                # One request processes at most MAX_PAGES_PER_REQUEST pages, and without a
+                # promotion at most monthly_page_limit; the rest are reported, not dropped silently
+                page_cap = MAX_PAGES_PER_REQUEST if has_active_promo else min(MAX_PAGES_PER_REQUEST, user.monthly_page_limit)
+                page_numbers = selected[:page_cap]
+                over_limit = selected[len(page_numbers):]
+                # The slot was taken before the PDF was read; charge the fair queue the real page count
+                admission.adjust_cost(slot, len(page_numbers))
+                # Detection and formatting are blocking; they run in a worker thread
+                tables_data, pages_processed, stopped_at = await asyncio.to_thread(
+                    extract_pages, processor, page_numbers, output_format, budget, skip_tables
+                )
+
+                # Every selected page not processed goes into the token: the ones the budget
+                # didn't reach and the ones over the page limit
+                remaining, skip_next = stopped_at if stopped_at is not None else ([], 0)
+                remaining = list(remaining) + over_limit
+                pages_remaining = len(remaining)
+                next_token = None
+                if remaining and continuation.ENABLED:
+                    next_token = continuation.encode(user.id, saved.sha256, remaining, skip_next)
                 
                 # Return structured response
                 return {
@@ -124,8 +236,17 @@ async def api_extract_tables(
                     "filename": file.filename,
                     "pages_total": total_pages,
                     "pages_processed": pages_processed,
+                    "pages": [p + 1 for p in page_numbers] if page_indices is not None else None,
                     "tables_found": len(tables_data),
                     "tables": tables_data,
+                    "complete": pages_remaining == 0,
+                    "continuation": next_token,
+                    "pages_remaining": pages_remaining,
+                    "warning": (
+                        f"{len(over_limit)} selected pages are over this request's limit of {page_cap} pages; "
+                        "send the continuation token to process them"
+                        if over_limit else None
+                    ),
                     "promotion_active": has_active_promo,
                     "api_usage": {
                         "requests_made_this_month": api_key.requests_made_this_month,
@@ -135,10 +256,15 @@ async def api_extract_tables(
                 }
             
         finally:
+            # Close the document before its temporary file goes
+            if processor is not None:
+                processor.doc.close()
             # Clean up temporary file
             if os.path.exists(temp_file_path):
                 os.unlink(temp_file_path)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"API extraction error: {e}")
         raise HTTPException(status_code=500, detail=f"İşlem hatası: {str(e)}")
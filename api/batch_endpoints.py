@@ -0,0 +1,399 @@
+"""
+Multi-document extraction for the public API: POST /api/v2/extract/batch.
+
+One request carries many PDFs, either as several `files` parts or as a single zip
+`archive`. The API key is checked and the request counted once. The documents are
+then extracted in parallel, at most ADMISSION_MAX_RUNNING_PER_USER of them at a time:
+page by page on the ExtractionPool processes when EXTRACTION_WORKERS > 1, otherwise
+on the extraction threads. Each document holds its own admission slot, so a big batch
+takes its fair share and doesn't block other users. The batch as a whole counts as
+one of the user's pending extractions (ADMISSION_MAX_PENDING_PER_USER).
+
+The quota is worked out once for the whole batch. The remaining monthly pages are
+handed out to the documents in upload order. They are reserved up front, and the pages
+not processed are refunded in one go once every document is done, whether or not the
+client is still there. Each document gets the same tables as /api/v1/extract, or its own
+error; one broken PDF doesn't fail the batch. With stream=true every document is sent
+as a line of NDJSON as soon as it is done, otherwise one JSON response lists them all
+in upload order.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import List, Optional
+
+import aiofiles
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+
+from admission import MAX_RUNNING_PER_USER, controller as admission, user_lane
+from api_endpoints import extract_pages, table_entry
+from auth import verify_api_key
+from cancellation import CancelToken, watch_disconnect
+from extraction_pool import get_default_pool
+from jobs import job_manager
+from metrics import EXTRACTIONS_IN_FLIGHT
+from pdf_utils import pdfium_page_count
+from stage_timings import StageTimings, emit as emit_timings
+from upload_pipeline import CHUNK_SIZE, MAX_UPLOAD_BYTES, save_upload
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "200"))
+# Total size of the PDFs in a batch (uncompressed, for archives)
+MAX_BATCH_BYTES = int(os.getenv("BATCH_MAX_MB", "500")) * 1024 * 1024
+
+# Batches still running, so their tasks aren't garbage collected mid-flight
+_batches = set()
+
+
+class BatchDocument:
+    def __init__(self, index, filename):
+        self.index = index
+        self.filename = filename
+        self.path = None
+        self.sha256 = None
+        self.total_pages = 0
+        self.pages_limit = 0
+        self.error = None
+        self.result = None
+        self.started = False  # extraction handed to a thread or worker; only the CancelToken stops it
+
+    def response(self):
+        if self.error is not None:
+            return {"index": self.index, "filename": self.filename, "success": False, "error": self.error}
+        return {"index": self.index, "filename": self.filename, "success": True, **self.result}
+
+
+def _extract_archive(archive_path, workdir):
+    """[(filename, path or None, error or None)] for the PDFs in a zip archive (blocking)."""
+    try:
+        zf = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Archive is not a valid zip file")
+    entries = []
+    total = 0
+    with zf:
+        members = [m for m in zf.infolist() if not m.is_dir() and m.filename.lower().endswith('.pdf')]
+        if len(members) > MAX_DOCUMENTS:
+            raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_DOCUMENTS} documents")
+        for member in members:
+            filename = os.path.basename(member.filename)
+            if member.file_size > MAX_UPLOAD_BYTES:
+                entries.append((filename, None, f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)}MB"))
+                continue
+            # Entries are written under their position, never under their (untrusted) names
+            path = os.path.join(workdir, f"{len(entries)}.pdf")
+            size = 0
+            with zf.open(member) as src, open(path, 'wb') as dst:
+                # Sizes in the zip directory can lie; count what is actually inflated
+                while chunk := src.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    total += len(chunk)
+                    if size > MAX_UPLOAD_BYTES or total > MAX_BATCH_BYTES:
+                        break
+                    dst.write(chunk)
+            if total > MAX_BATCH_BYTES:
+                raise HTTPException(status_code=413, detail=f"Batch is larger than {MAX_BATCH_BYTES // (1024 * 1024)}MB")
+            if size > MAX_UPLOAD_BYTES:
+                entries.append((filename, None, f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)}MB"))
+                continue
+            with open(path, 'rb') as f:
+                if f.read(4) != b'%PDF':
+                    entries.append((filename, None, "File is not a valid PDF"))
+                    continue
+            entries.append((filename, path, None))
+    return entries
+
+
+async def _save_documents(files, archive, workdir):
+    """Write the batch to workdir and return its BatchDocuments, upload order kept."""
+    documents = []
+    if archive is not None:
+        archive_path = os.path.join(workdir, "archive.zip")
+        async with aiofiles.open(archive_path, 'wb') as f:
+            while chunk := await archive.read(CHUNK_SIZE):
+                await f.write(chunk)
+        entries = await asyncio.to_thread(_extract_archive, archive_path, workdir)
+        os.remove(archive_path)
+        for filename, path, error in entries:
+            document = BatchDocument(len(documents), filename)
+            document.path, document.error = path, error
+            documents.append(document)
+    else:
+        total = 0
+        for upload in files:
+            document = BatchDocument(len(documents), upload.filename)
+            documents.append(document)
+            if not (upload.filename or '').lower().endswith('.pdf'):
+                document.error = "Only PDF files are supported"
+                continue
+            try:
+                saved = await save_upload(upload, os.path.join(workdir, f"{document.index}.pdf"))
+            except HTTPException as e:
+                document.error = e.detail
+                continue
+            document.path, document.sha256 = saved.path, saved.sha256
+            total += saved.size
+            if total > MAX_BATCH_BYTES:
+                raise HTTPException(status_code=413, detail=f"Batch is larger than {MAX_BATCH_BYTES // (1024 * 1024)}MB")
+
+    for document in documents:
+        if document.error is None:
+            try:
+                document.total_pages = await asyncio.to_thread(pdfium_page_count, document.path)
+            except Exception as e:
+                document.error = f"File is not a valid PDF: {e}"
+    return documents
+
+
+async def _allocate_pages(user, documents, pages_limit):
+    """
+    Reserve the user's remaining quota for the batch and share it among the documents in
+    upload order. Returns (pages_reserved, has_active_promo); unprocessed pages are refunded at the end.
+    """
+    from database import AsyncSessionLocal
+    from quota import has_active_promotion, reserve_pages
+
+    wanted = {
+        document.index: min(pages_limit or document.total_pages, document.total_pages)
+        for document in documents if document.error is None
+    }
+    total = sum(wanted.values())
+    async with AsyncSessionLocal() as db:
+        if not total:
+            return 0, await has_active_promotion(db, user.id)
+        pages_left, has_active_promo = await reserve_pages(db, user, total, total)
+    pages_reserved = pages_left
+    for document in documents:
+        if document.error is not None:
+            continue
+        if pages_left <= 0:
+            document.error = "Monthly quota used up by earlier documents of this batch"
+            continue
+        document.pages_limit = min(wanted[document.index], pages_left)
+        pages_left -= document.pages_limit
+    return pages_reserved, has_active_promo
+
+
+def _extract_document(document, output_format, user_id, cancel):
+    """In-process extraction; runs in an extraction thread."""
+    from table_format import PDFTableProcessor
+
+    processor = PDFTableProcessor(document.path, content_hash=document.sha256, user_id=user_id)
+    try:
+        tables, pages_processed, stopped_at = extract_pages(
+            processor, range(document.pages_limit), output_format, cancel=cancel
+        )
+    finally:
+        processor.doc.close()
+    return {
+        "pages_total": document.total_pages,
+        "pages_processed": pages_processed,
+        "tables_found": len(tables),
+        "tables": tables,
+        "complete": stopped_at is None,
+    }
+
+
+async def _extract_document_in_pool(pool, document, output_format, cancel):
+    """Extraction on the ExtractionPool worker processes; results are taken in page order."""
+    futures = [pool.submit_page(document.path, page_idx, document.sha256) for page_idx in range(document.pages_limit)]
+    timings = StageTimings()
+    tables = []
+    pages_processed = 0
+    EXTRACTIONS_IN_FLIGHT.inc()
+    try:
+        for future in futures:
+            if cancel.cancelled:
+                break
+            page_idx, page_tables, page_timings = await asyncio.wrap_future(future)
+            timings.merge(page_timings)
+            tables += [table_entry(page_idx, tbl_idx, rows, output_format) for tbl_idx, rows in page_tables]
+            pages_processed += 1
+    finally:
+        # Pages no worker has started yet are dropped; the ones running are waited for,
+        # since they still read the document's file
+        for future in futures:
+            future.cancel()
+        await asyncio.gather(
+            *(asyncio.wrap_future(f) for f in futures if not f.cancelled()), return_exceptions=True
+        )
+        EXTRACTIONS_IN_FLIGHT.dec()
+        emit_timings(timings.summary())
+    return {
+        "pages_total": document.total_pages,
+        "pages_processed": pages_processed,
+        "tables_found": len(tables),
+        "tables": tables,
+        "complete": pages_processed == len(futures),
+    }
+
+
+class _BatchStreamingResponse(StreamingResponse):
+    """Calls on_close when the response is over, even if the body was never iterated."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+@router.post("/v2/extract/batch")
+async def api_extract_batch(
+    request: Request,
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    output_format: str = "both",  # json, csv, both
+    pages_limit: Optional[int] = None,  # per document
+    stream: bool = False,
+    auth_data: dict = Depends(verify_api_key)
+):
+    """
+    Extract tables from many PDFs in one request
+
+    Parameters:
+    - files: PDF files to process (repeat the multipart field), or
+    - archive: a zip file containing the PDFs
+    - output_format: "json", "csv", or "both"
+    - pages_limit: Maximum pages to process per document (optional)
+    - stream: send each document as an NDJSON line as soon as it is done
+
+    Returns:
+    - Per-document results (tables as in /api/v1/extract, or an error) and batch totals
+    """
+    api_key = auth_data["api_key"]
+    user = auth_data["user"]
+
+    if output_format not in ["json", "csv", "both"]:
+        raise HTTPException(status_code=400, detail="Invalid output format")
+    if pages_limit is not None and pages_limit < 1:
+        raise HTTPException(status_code=400, detail="Pages limit must be positive")
+    if (archive is None) == (not files):
+        raise HTTPException(status_code=400, detail="Send either PDF files or one zip archive")
+    if files and len(files) > MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_DOCUMENTS} documents")
+
+    # The whole batch counts as one pending extraction of the user (429 past the limit)
+    admission.hold(user.id)
+    workdir = tempfile.mkdtemp(prefix="batch-")
+    try:
+        documents = await _save_documents(files, archive, workdir)
+        if not documents:
+            raise HTTPException(status_code=400, detail="The archive contains no PDF files")
+        lane = await user_lane(user.id)
+        pages_reserved, has_active_promo = await _allocate_pages(user, documents, pages_limit)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        admission.unhold(user.id)
+        raise
+
+    cancel = CancelToken()
+    # No more of the user's documents in flight than they may run at once
+    parallel = asyncio.Semaphore(MAX_RUNNING_PER_USER)
+    pool = get_default_pool()
+
+    async def run(document):
+        if document.error is not None:
+            return document
+        try:
+            async with parallel:
+                if cancel.cancelled:
+                    document.error = "Batch cancelled"
+                    return document
+                async with admission.slot(user.id, bounded=False, lane=lane, cost=document.pages_limit):
+                    if cancel.cancelled:
+                        document.error = "Batch cancelled"
+                        return document
+                    # From here on the task is never cancelled: it ends when its thread or
+                    # workers do, so settle() doesn't pull the files from under them
+                    document.started = True
+                    if pool is not None:
+                        document.result = await _extract_document_in_pool(pool, document, output_format, cancel)
+                    else:
+                        document.result = await asyncio.get_running_loop().run_in_executor(
+                            job_manager.executor, _extract_document, document, output_format, user.id, cancel
+                        )
+        except asyncio.CancelledError:
+            # Skipped while waiting for its turn (stop())
+            document.error = "Batch cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Batch document {document.filename} failed: {e}", exc_info=True)
+            document.error = f"İşlem hatası: {e}"
+        return document
+
+    def summary():
+        return {
+            "documents": len(documents),
+            "succeeded": sum(1 for d in documents if d.error is None),
+            "failed": sum(1 for d in documents if d.error is not None),
+            "pages_processed": sum(d.result["pages_processed"] for d in documents if d.result),
+            "tables_found": sum(d.result["tables_found"] for d in documents if d.result),
+            "promotion_active": has_active_promo,
+            "api_usage": {
+                "requests_made_this_month": api_key.requests_made_this_month,
+                "monthly_request_limit": api_key.monthly_request_limit,
+                "remaining_requests": api_key.monthly_request_limit - api_key.requests_made_this_month
+            }
+        }
+
+    tasks = [asyncio.ensure_future(run(document)) for document in documents]
+
+    async def settle():
+        """
+        Once every document is done, and with it every extraction thread and worker page:
+        refund the pages no document got to and remove the files.
+        """
+        from quota import refund_pages
+
+        try:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            admission.unhold(user.id)
+            if not has_active_promo:
+                await refund_pages(user.id, pages_reserved - sum(d.result["pages_processed"] for d in documents if d.result))
+
+    # Tied to the document tasks, not to the response: runs however the request ends
+    settled = asyncio.ensure_future(settle())
+    _batches.add(settled)
+    settled.add_done_callback(_batches.discard)
+
+    def stop():
+        """Skip documents still waiting and stop running ones before their next page or table."""
+        if not all(task.done() for task in tasks):
+            cancel.cancel("client_disconnected")
+            # Running documents see the token; cancelling their task wouldn't stop the thread
+            for task, document in zip(tasks, documents):
+                if not document.started:
+                    task.cancel()
+
+    if not stream:
+        # Documents still waiting are skipped, and running ones stop, if the client goes away
+        async with watch_disconnect(request, cancel):
+            await asyncio.shield(settled)
+        return {"success": True, **summary(), "results": [d.response() for d in documents]}
+
+    async def body():
+        for task in asyncio.as_completed(tasks):
+            document = await task
+            yield json.dumps({"event": "document", **document.response()}, ensure_ascii=False) + "\n"
+        await asyncio.shield(settled)
+        yield json.dumps({"event": "done", "success": True, **summary()}, ensure_ascii=False) + "\n"
+
+    return _BatchStreamingResponse(
+        body(), stop, media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"}
+    )
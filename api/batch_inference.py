@@ -0,0 +1,142 @@
+"""
+Batched TATR inference for the gmft detector and formatter.
+
+gmft's detector.extract(page) and formatter.extract(table) push one image at a time
+through the transformer. These helpers reproduce the same pre/post-processing but run
+up to batch_size images per forward pass.
+
+Images are only batched together when their preprocessed tensors have the same shape.
+That way no extra padding is introduced and every image gets exactly the input the
+single-image path would give it, so the detections are the same as the per-item path.
+With batch_size <= 1 they call gmft's own extract() per item, timed as a whole
+(rendering included); only the batched path records "render" separately.
+"""
+
+from contextlib import nullcontext
+
+# torch and gmft are imported inside the functions so importing this module stays cheap
+
+
+def _stage(timings, name, table=None):
+    return nullcontext() if timings is None else timings.stage(name, table)
+
+
+def supports_batching(model_owner, model_attr):
+    """True if a gmft detector/formatter exposes the HF image processor and model we need."""
+    return hasattr(model_owner, 'image_processor') and hasattr(model_owner, model_attr)
+
+
+def _forward_batched(image_processor, model, images, batch_size, threshold, timings=None, stage=None, keys=None):
+    """
+    Run images through a TATR model batch_size at a time and return post-processed results per image.
+    With timings, each forward pass is recorded under `stage`, split evenly over the images
+    of the batch and attributed to keys[i] (a (page, table) tuple) when given.
+    """
+    import time
+    import torch
+
+    # HF models and onnx_backend.OnnxModel both expose .device
+    device = model.device
+    with _stage(timings, f"{stage}_preprocess"):
+        encodings = [image_processor(img, return_tensors="pt") for img in images]
+
+    # Group images by input shape so batching never adds padding
+    groups = {}
+    for i, encoding in enumerate(encodings):
+        groups.setdefault(tuple(encoding["pixel_values"].shape), []).append(i)
+
+    results = [None] * len(images)
+    for indices in groups.values():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            started = time.perf_counter()
+            inputs = {
+                key: torch.cat([encodings[i][key] for i in chunk]).to(device)
+                for key in encodings[chunk[0]].keys()
+            }
+            with torch.no_grad():
+                outputs = model(**inputs)
+            target_sizes = torch.tensor([images[i].size[::-1] for i in chunk])
+            processed = image_processor.post_process_object_detection(
+                outputs, threshold=threshold, target_sizes=target_sizes
+            )
+            for i, result in zip(chunk, processed):
+                results[i] = result
+            if timings is not None:
+                share = (time.perf_counter() - started) / len(chunk)
+                for i in chunk:
+                    timings.add(stage, share, keys[i] if keys is not None else None)
+    return results
+
+
+def detect_pages(detector, pages, batch_size, timings=None):
+    """Batched equivalent of [detector.extract(page) for page in pages]."""
+    if batch_size <= 1 or not supports_batching(detector, 'detector'):
+        with _stage(timings, "detection"):
+            return [detector.extract(page) for page in pages]
+
+    from gmft.detectors.base import CroppedTable, RotatedCroppedTable
+
+    # Same dpi as TATRDetector.extract, so bboxes are already in pdf units
+    with _stage(timings, "render"):
+        images = [page.get_image(72) for page in pages]
+    results = _forward_batched(
+        detector.image_processor, detector.detector, images, batch_size,
+        detector.config.detector_base_threshold, timings, "detection",
+    )
+
+    per_page = []
+    for page, result in zip(pages, results):
+        tables = []
+        for i in range(len(result["boxes"])):
+            bbox = result["boxes"][i].tolist()
+            confidence_score = result["scores"][i].item()
+            label = result["labels"][i].item()
+            if label == 1:
+                tables.append(RotatedCroppedTable(page, bbox, confidence_score, 90, label))
+            else:
+                tables.append(CroppedTable(page, bbox, confidence_score, label))
+        per_page.append(tables)
+    return per_page
+
+
+def format_tables(formatter, tables, batch_size, dpi=144, padding=None, margin='auto', timings=None, keys=None):
+    """
+    Batched equivalent of [formatter.extract(t, dpi=dpi, padding=padding, margin=margin) for t in tables].
+    keys, if given, are the (page, table) indices used to attribute timings per table.
+    """
+    if batch_size <= 1 or not supports_batching(formatter, 'structor'):
+        formatted = []
+        for i, table in enumerate(tables):
+            with _stage(timings, "structure", keys[i] if keys is not None else None):
+                formatted.append(formatter.extract(table, dpi=dpi, padding=padding, margin=margin))
+        return formatted
+
+    from gmft.formatters.base import _normalize_bbox
+    from gmft.formatters.tatr import TATRFormattedTable
+
+    images = []
+    for i, table in enumerate(tables):
+        with _stage(timings, "render", keys[i] if keys is not None else None):
+            images.append(table.image(dpi=dpi, padding=padding, margin=margin))
+    results = _forward_batched(
+        formatter.image_processor, formatter.structor, images, batch_size,
+        formatter.config.formatter_base_threshold, timings, "structure", keys,
+    )
+
+    scale_factor = dpi / 72
+    formatted = []
+    for table, result in zip(tables, results):
+        result = {k: v.tolist() for k, v in result.items()}
+        # normalize results w.r.t. padding and scale factor, as TATRFormatter.extract does
+        result["boxes"] = [
+            _normalize_bbox(
+                bbox,
+                used_scale_factor=scale_factor,
+                used_padding=table._img_padding,
+                used_margin=table._img_margin,
+            )
+            for bbox in result["boxes"]
+        ]
+        formatted.append(TATRFormattedTable(table, result, config=formatter.config))
+    return formatted
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark: startup cost of the API modules.
+
+Each module is imported in a fresh interpreter, so the numbers are what a new
+uvicorn worker (or a --reload) pays before it can serve /health. Model loading is
+timed separately, since it now happens lazily or in the lifespan warm-up instead
+of at import time.
+
+    python bench_import.py --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPETS = {
+    "import table_format": "import table_format",
+    "import api_endpoints": "import api_endpoints",
+    "import main": "import main",
+    "registry.load()": "from model_registry import registry; registry.load()",
+}
+
+
+def time_snippet(code):
+    """Wall time of `code` inside a fresh interpreter, measured from inside that interpreter."""
+    timed = (
+        "import time; _t = time.perf_counter()\n"
+        f"{code}\n"
+        "print(time.perf_counter() - _t)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", timed],
+        cwd=API_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API import-time benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per snippet")
+    args = parser.parse_args()
+
+    print(f"{'snippet':<24} {'median s':>10} {'min s':>10}")
+    for name, code in SNIPPETS.items():
+        try:
+            times = [time_snippet(code) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<24} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{name:<24} {statistics.median(times):>10.3f} {min(times):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-page latency of TATR inference with PyTorch vs ONNX Runtime.
+
+Each page is detected and all its tables are structure-recognised through
+batch_inference, once with the PyTorch models and once with their ONNX exports
+(exported on first use, see onnx_backend.py). Rendering is included, as in
+production; model loading and export are not.
+
+    python bench_onnx.py report.pdf --pages 20 --threads 4
+"""
+
+import argparse
+import statistics
+import time
+
+import batch_inference
+import onnx_backend
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def time_pages(detector, formatter, pages):
+    latencies = []
+    tables = 0
+    for page in pages:
+        start = time.perf_counter()
+        page_tables = batch_inference.detect_pages(detector, [page], 1)[0]
+        batch_inference.format_tables(formatter, page_tables, 1)
+        latencies.append(time.perf_counter() - start)
+        tables += len(page_tables)
+    return latencies, tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTorch vs ONNX Runtime latency benchmark")
+    parser.add_argument('pdf', help="PDF file to extract")
+    parser.add_argument('--pages', type=int, default=20, help="Number of pages to time")
+    parser.add_argument('--threads', type=int, default=0, help="Threads for both backends (0: library default)")
+    args = parser.parse_args()
+
+    import torch
+    from gmft.auto import AutoTableDetector, AutoTableFormatter
+    from gmft.pdf_bindings import PyPDFium2Document
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    detector, formatter = AutoTableDetector(), AutoTableFormatter()
+    # Export if needed, then open the sessions with the requested thread count
+    onnx_backend.load_model(detector.detector, detector.image_processor, "detection")
+    onnx_backend.load_model(formatter.structor, formatter.image_processor, "structure")
+    backends = {
+        "torch": (detector.detector, formatter.structor),
+        "onnx": (
+            onnx_backend.OnnxModel(onnx_backend.model_path(detector.detector, "detection"), args.threads),
+            onnx_backend.OnnxModel(onnx_backend.model_path(formatter.structor, "structure"), args.threads),
+        ),
+    }
+
+    doc = PyPDFium2Document(args.pdf)
+    try:
+        pages = [doc.get_page(i) for i in range(min(args.pages, len(doc)))]
+        print(f"{'backend':>8} {'pages':>6} {'tables':>7} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        means = {}
+        for name, (detection_model, structure_model) in backends.items():
+            detector.detector, formatter.structor = detection_model, structure_model
+            time_pages(detector, formatter, pages[:1])  # warm-up
+            latencies, tables = time_pages(detector, formatter, pages)
+            means[name] = statistics.mean(latencies)
+            print(
+                f"{name:>8} {len(pages):>6} {tables:>7} {1000 * means[name]:>9.1f} "
+                f"{1000 * percentile(latencies, 0.5):>8.1f} {1000 * percentile(latencies, 0.95):>8.1f}"
+            )
+        print(f"ONNX speedup: {means['torch'] / means['onnx']:.2f}x")
+    finally:
+        doc.close()
+
+
+if __name__ == "__main__":
+    main()
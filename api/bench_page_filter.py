@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark: tune the page pre-filter threshold against the gmft detector.
+
+Every page is scored by page_filter and run through the detector; pages where the
+detector finds a table are the ground truth. For each threshold the report shows
+the recall on those pages and the share of pages that would be skipped, then
+suggests the highest threshold that still reaches --target-recall.
+
+    python bench_page_filter.py report1.pdf report2.pdf --target-recall 0.99
+"""
+
+import argparse
+import statistics
+import time
+
+import page_filter
+
+THRESHOLDS = [0.0, 0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0]
+
+
+def score_pages(pdf_path, pages):
+    """(score, has_table, filter_seconds, detector_seconds) per page."""
+    from gmft.pdf_bindings import PyPDFium2Document
+    from model_registry import registry
+
+    registry.load()
+    doc = PyPDFium2Document(pdf_path)
+    rows = []
+    try:
+        for page_idx in range(len(doc) if pages is None else min(pages, len(doc))):
+            page = doc.get_page(page_idx)
+            start = time.perf_counter()
+            score = page_filter.table_score(page_filter.page_features(page.page, page.get_positions_and_text()))
+            filter_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            has_table = bool(registry.detector.extract(page))
+            rows.append((score, has_table, filter_seconds, time.perf_counter() - start))
+    finally:
+        doc.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Page pre-filter recall / skip-rate benchmark")
+    parser.add_argument('pdf', nargs='+', help="PDF files to score")
+    parser.add_argument('--pages', type=int, default=None, help="Pages per PDF (default: all)")
+    parser.add_argument('--target-recall', type=float, default=0.99)
+    args = parser.parse_args()
+
+    rows = [row for pdf in args.pdf for row in score_pages(pdf, args.pages)]
+    positives = sum(1 for _, has_table, _, _ in rows if has_table)
+    print(f"{len(rows)} pages, {positives} with tables; "
+          f"filter {1000 * statistics.mean(r[2] for r in rows):.2f} ms/page, "
+          f"detector {1000 * statistics.mean(r[3] for r in rows):.2f} ms/page")
+
+    print(f"{'threshold':>10} {'recall':>8} {'skipped':>8}")
+    best = None
+    for threshold in THRESHOLDS:
+        kept = [has_table for score, has_table, _, _ in rows if score >= threshold]
+        recall = sum(kept) / positives if positives else 1.0
+        skipped = 1 - len(kept) / len(rows)
+        print(f"{threshold:>10.2f} {recall:>8.3f} {skipped:>8.1%}")
+        if recall >= args.target_recall:
+            best = threshold
+    print(f"Suggested PAGE_FILTER_THRESHOLD for recall >= {args.target_recall}: {best}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pages/sec of table extraction with 1..N worker processes.
+
+    python bench_parallel.py report.pdf --max-workers 32 --pages 100
+"""
+
+import argparse
+import os
+import time
+
+from extraction_pool import ExtractionPool
+
+
+def worker_counts(max_workers):
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def run(pdf_path, workers, pages, output_format):
+    with ExtractionPool(workers) as pool:
+        # Warm up every worker so model loading is not counted
+        list(pool.iter_pages(pdf_path, [0] * workers, output_format))
+
+        start = time.perf_counter()
+        tables = sum(1 for _ in pool.process_tables(pdf_path, output_format, pages_limit=pages))
+        elapsed = time.perf_counter() - start
+    return tables, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel extraction scaling benchmark")
+    parser.add_argument('pdf', help="PDF file to extract")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help="Largest worker count to try")
+    parser.add_argument('--pages', type=int, default=None, help="Number of pages to process (default: all)")
+    parser.add_argument('--format', default='json', choices=['json', 'csv', 'both'])
+    args = parser.parse_args()
+
+    from table_format import PDFTableProcessor
+    processor = PDFTableProcessor(args.pdf)
+    pages = processor.total_pages if args.pages is None else min(args.pages, processor.total_pages)
+    processor.doc.close()
+
+    print(f"{'workers':>8} {'tables':>8} {'seconds':>10} {'pages/sec':>10} {'speedup':>8}")
+    baseline = None
+    for workers in worker_counts(args.max_workers):
+        tables, elapsed = run(args.pdf, workers, pages, args.format)
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {tables:>8} {elapsed:>10.2f} {pages / elapsed:>10.2f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
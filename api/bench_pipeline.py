@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end PDFTableProcessor throughput on generated PDFs.
+
+A deterministic corpus is generated locally (reportlab), one set of documents per
+scenario:
+
+- prose:         text only, what the page pre-filter should skip
+- sparse:        a ruled table every few pages between paragraphs
+- dense:         two or three tables per page, ruled and borderless
+- multi_header:  tables with a spanned two-row header
+- scanned:       dense pages rasterised, skewed and noised into image-only PDFs
+
+Every document goes through process_tables() exactly like /process (extraction
+cache disabled unless --cache). Per scenario the report has pages/sec, tables/sec,
+p50/p95 per-table latency (seconds StageTimings attributes to the table: structure
+recognition, dataframe, rendering, writes), the stage totals and the peak RSS of
+this process plus any pool workers. The JSON artifact records the commit and the
+extraction settings, so runs can be compared across commits:
+
+    python bench_pipeline.py --output before.json
+    python bench_pipeline.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+
+SCENARIOS = ("prose", "sparse", "dense", "multi_header", "scanned")
+# Page counts of the documents generated per scenario (scaled by --scale)
+DOCUMENT_PAGES = (2, 10, 40)
+
+WORDS = (
+    "revenue operating margin quarter fiscal growth segment net income assets liabilities "
+    "equity cash flow capital expenditure guidance outlook customers region market share "
+    "forecast consolidated statement adjusted total interest tax depreciation inventory"
+).split()
+
+
+def _sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def _paragraph(rng, styles, sentences=5):
+    from reportlab.platypus import Paragraph
+
+    return Paragraph(" ".join(_sentence(rng, rng.randint(8, 16)) for _ in range(sentences)), styles["BodyText"])
+
+
+def _table(rng, ruled=True, multi_header=False, max_rows=10):
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+
+    n_cols = rng.randint(3, 6)
+    header = [rng.choice(WORDS).title() for _ in range(n_cols)]
+    rows = [[rng.choice(WORDS)] + [f"{rng.uniform(-5000, 50000):,.1f}" for _ in range(n_cols - 1)]
+            for _ in range(rng.randint(4, max_rows))]
+    style = [("FONTSIZE", (0, 0), (-1, -1), 8), ("ALIGN", (1, 0), (-1, -1), "RIGHT")]
+    data = [header] + rows
+    if multi_header:
+        # Group header spanning the value columns above the per-column header
+        data = [["", f"FY{rng.randint(2015, 2024)}"] + [""] * (n_cols - 2)] + data
+        style += [("SPAN", (1, 0), (-1, 0)), ("ALIGN", (1, 0), (-1, 0), "CENTER")]
+    if ruled:
+        style.append(("GRID", (0, 0), (-1, -1), 0.5, colors.black))
+    else:
+        style.append(("LINEBELOW", (0, len(data) - len(rows) - 1), (-1, len(data) - len(rows) - 1), 0.5, colors.black))
+    return Table(data, style=TableStyle(style))
+
+
+def _page_flowables(rng, styles, scenario, page_no):
+    from reportlab.platypus import Spacer
+
+    if scenario == "prose":
+        return [_paragraph(rng, styles) for _ in range(4)]
+    if scenario == "sparse":
+        flowables = [_paragraph(rng, styles) for _ in range(2)]
+        if page_no % 3 == 0:
+            flowables.append(_table(rng, max_rows=8))
+        return flowables
+    flowables = []
+    for i in range(rng.randint(2, 3) if scenario != "multi_header" else 2):
+        flowables.append(_paragraph(rng, styles, sentences=1))
+        flowables.append(_table(rng, ruled=(i % 2 == 0), multi_header=scenario == "multi_header", max_rows=7))
+        flowables.append(Spacer(1, 8))
+    return flowables
+
+
+def _scan(pdf_path, rng, dpi=150):
+    """Replace a PDF by skewed, noisy page images with no text layer."""
+    import pypdfium2 as pdfium
+    from PIL import Image, ImageChops
+
+    doc = pdfium.PdfDocument(pdf_path)
+    try:
+        pages = []
+        for page in doc:
+            image = page.render(scale=dpi / 72).to_pil().convert("L")
+            image = image.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, expand=False, fillcolor=255)
+            noise = Image.effect_noise(image.size, 40).point(lambda v: 255 if v > 90 else 235)
+            pages.append(ImageChops.darker(image, noise))
+    finally:
+        doc.close()
+    pages[0].save(pdf_path, save_all=True, append_images=pages[1:], resolution=dpi)
+
+
+def generate_document(path, scenario, pages, seed):
+    """Write one synthetic PDF with the given number of pages."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import KeepInFrame, PageBreak, SimpleDocTemplate
+
+    rng = random.Random(f"{scenario}-{pages}-{seed}")
+    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(path, pagesize=A4)
+    story = []
+    for page_no in range(pages):
+        # Shrink rather than overflow, so every document has exactly `pages` pages
+        story.append(KeepInFrame(doc.width, doc.height, _page_flowables(
+            rng, styles, "dense" if scenario == "scanned" else scenario, page_no), mode="shrink"))
+        if page_no < pages - 1:
+            story.append(PageBreak())
+    doc.build(story)
+    if scenario == "scanned":
+        _scan(path, rng)
+
+
+def generate_corpus(root, scenarios=SCENARIOS, scale=1.0, seed=0):
+    """{scenario: [pdf paths]}; the same seed and scale always give the same documents."""
+    corpus = {}
+    for scenario in scenarios:
+        os.makedirs(os.path.join(root, scenario), exist_ok=True)
+        corpus[scenario] = []
+        for pages in DOCUMENT_PAGES:
+            pages = max(1, round(pages * scale))
+            path = os.path.join(root, scenario, f"{scenario}-{pages}p.pdf")
+            if not os.path.exists(path):
+                generate_document(path, scenario, pages, seed)
+            corpus[scenario].append(path)
+    return corpus
+
+
+class PeakRSS:
+    """Background sampler of the resident memory of this process and its children (pool workers)."""
+
+    def __init__(self, interval=0.05):
+        import psutil
+
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        import psutil
+
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_document(pdf_path, output_dir, output_format, images, use_cache):
+    """(pages, per-table latencies, timings summary) of one end-to-end extraction."""
+    from table_format import PDFTableProcessor
+
+    processor = PDFTableProcessor(pdf_path, output_dir=output_dir)
+    if not use_cache:
+        processor.cache = None
+    try:
+        for _ in processor.process_tables(output_format, images=images):
+            pass
+        latencies = [sum(stages.values()) for stages in processor.timings.tables.values()]
+        return processor.total_pages, latencies, processor.timings.summary()
+    finally:
+        processor.doc.close()
+
+
+def run_scenario(paths, output_root, output_format, images, use_cache):
+    pages = 0
+    latencies = []
+    stages = {}
+    events = {}
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for i, path in enumerate(paths):
+            doc_pages, doc_latencies, summary = run_document(
+                path, os.path.join(output_root, f"{os.path.basename(path)}-{i}"), output_format, images, use_cache,
+            )
+            pages += doc_pages
+            latencies += doc_latencies
+            for name, values in summary["stages"].items():
+                stages[name] = stages.get(name, 0.0) + values["seconds"]
+            for name, n in summary["events"].items():
+                events[name] = events.get(name, 0) + n
+        seconds = time.perf_counter() - start
+    tables = events.get("tables", 0)
+    return {
+        "documents": len(paths),
+        "pages": pages,
+        "tables": tables,
+        "seconds": round(seconds, 3),
+        "pages_per_sec": round(pages / seconds, 3),
+        "tables_per_sec": round(tables / seconds, 3),
+        "table_latency_ms": {
+            "p50": None if not latencies else round(1000 * percentile(latencies, 0.5), 2),
+            "p95": None if not latencies else round(1000 * percentile(latencies, 0.95), 2),
+        },
+        "peak_rss_mb": round(rss.peak / (1024 * 1024), 1),
+        "stages": {name: round(value, 4) for name, value in sorted(stages.items(), key=lambda item: -item[1])},
+        "events": events,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _settings():
+    import extraction_pool
+    import onnx_backend
+    import page_filter
+    import quantization
+    import ruled_tables
+    import table_format
+
+    return {
+        "batch_size": table_format.DEFAULT_BATCH_SIZE,
+        "workers": extraction_pool.DEFAULT_WORKERS,
+        **onnx_backend.settings(),
+        **quantization.settings(),
+        **ruled_tables.settings(),
+        **page_filter.settings(),
+    }
+
+
+def compare(report, baseline):
+    """Print throughput / latency / memory ratios against a previous report."""
+    print(f"\nvs {baseline.get('commit') or 'baseline'}:")
+    print(f"{'scenario':>14} {'pages/s':>9} {'tables/s':>9} {'p95 ms':>9} {'rss':>9}")
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+
+        def ratio(value, old):
+            return f"{value / old:>8.2f}x" if value and old else f"{'-':>9}"
+
+        print(
+            f"{name:>14} {ratio(current['pages_per_sec'], previous['pages_per_sec'])} "
+            f"{ratio(current['tables_per_sec'], previous['tables_per_sec'])} "
+            f"{ratio(current['table_latency_ms']['p95'], previous['table_latency_ms']['p95'])} "
+            f"{ratio(current['peak_rss_mb'], previous['peak_rss_mb'])}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end extraction benchmark on generated PDFs")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for the generated page counts")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus-dir', default=None, help="Keep/reuse the generated PDFs here (default: temp dir)")
+    parser.add_argument('--format', default='json', choices=['json', 'csv'])
+    parser.add_argument('--images', default=None, help="Image mode (eager, lazy, none); default EXTRACTION_IMAGES")
+    parser.add_argument('--cache', action='store_true', help="Use the extraction cache (default: cold runs)")
+    parser.add_argument('--output', default='bench_pipeline.json', help="Where to write the JSON report")
+    parser.add_argument('--compare', default=None, help="Previous report to compare against")
+    args = parser.parse_args()
+
+    if not args.cache:
+        # Before anything imports extraction_cache; spawned pool workers inherit the environment
+        os.environ["EXTRACTION_CACHE_MAX_MB"] = "0"
+
+    from model_registry import registry
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = args.corpus_dir or os.path.join(tmp, "corpus")
+        start = time.perf_counter()
+        corpus = generate_corpus(corpus_dir, args.scenarios, args.scale, args.seed)
+        generate_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        registry.load()  # model loading is reported, not timed per scenario
+        load_seconds = time.perf_counter() - start
+
+        report = {
+            "commit": _commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": _settings(),
+            "args": {"scale": args.scale, "seed": args.seed, "format": args.format,
+                     "images": args.images, "cache": args.cache},
+            "corpus_generate_seconds": round(generate_seconds, 3),
+            "model_load_seconds": round(load_seconds, 3),
+            "scenarios": {},
+        }
+        print(f"{'scenario':>14} {'pages':>6} {'tables':>7} {'pages/s':>8} {'tables/s':>9} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'rss MB':>8}")
+        for scenario, paths in corpus.items():
+            result = run_scenario(paths, os.path.join(tmp, "outputs", scenario), args.format, args.images, args.cache)
+            report["scenarios"][scenario] = result
+            latency = result["table_latency_ms"]
+            print(
+                f"{scenario:>14} {result['pages']:>6} {result['tables']:>7} {result['pages_per_sec']:>8.2f} "
+                f"{result['tables_per_sec']:>9.2f} {latency['p50'] or 0:>8.1f} {latency['p95'] or 0:>8.1f} "
+                f"{result['peak_rss_mb']:>8.1f}"
+            )
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ruled-table fast path vs gmft (TATR) on the same pages.
+
+Both extractors run on every page. Speed is reported for all pages; agreement
+(table count, bbox IoU, cell text) is measured on the pages the fast path would
+accept at --min-confidence, since the others fall back to gmft anyway.
+
+    python bench_ruled.py statements.pdf --pages 50
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import ruled_tables
+
+
+def iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def rows_of(df):
+    normalize = lambda value: " ".join(str(value).split())
+    return [[normalize(c) for c in df.columns]] + [[normalize(c) for c in row] for row in df.values.tolist()]
+
+
+def cell_agreement(fast_rows, model_rows):
+    """Share of equal cells; 0 when the two grids have different shapes."""
+    if len(fast_rows) != len(model_rows) or any(len(a) != len(b) for a, b in zip(fast_rows, model_rows)):
+        return 0.0
+    cells = [a == b for fa, mo in zip(fast_rows, model_rows) for a, b in zip(fa, mo)]
+    return sum(cells) / len(cells) if cells else 1.0
+
+
+def compare_page(fast, model):
+    """Match every fast-path table to the gmft table it overlaps most."""
+    ious, cells = [], []
+    for table, rows in fast:
+        best = max(model, key=lambda m: iou(table.bbox, m[0]), default=None)
+        overlap = iou(table.bbox, best[0]) if best else 0.0
+        ious.append(overlap)
+        cells.append(cell_agreement(rows, best[1]) if overlap >= 0.5 else 0.0)
+    return ious, cells
+
+
+def run(pdf_path, pages, min_confidence):
+    from gmft.pdf_bindings import PyPDFium2Document
+    from model_registry import registry
+
+    registry.load()
+    doc = PyPDFium2Document(pdf_path)
+    n_pages = len(doc) if pages is None else min(pages, len(doc))
+    fast_times, model_times = [], []
+    accepted = count_matches = 0
+    ious, cells = [], []
+    try:
+        for page_idx in range(n_pages):
+            page = doc.get_page(page_idx)
+
+            start = time.perf_counter()
+            ruled = ruled_tables.detect(page)
+            fast = [(t, rows_of(t.df())) for t in ruled]
+            fast_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            model = []
+            for table in registry.detector.extract(page):
+                ft = registry.formatter.extract(table, margin='auto', padding=None)
+                model.append((table.rect.bbox, rows_of(ft.df(config_overrides=registry.format_config).fillna(""))))
+            model_times.append(time.perf_counter() - start)
+
+            if not ruled or min(t.confidence_score for t in ruled) < min_confidence:
+                continue
+            accepted += 1
+            count_matches += len(ruled) == len(model)
+            page_ious, page_cells = compare_page(fast, model)
+            ious += page_ious
+            cells += page_cells
+    finally:
+        doc.close()
+
+    return {
+        "pdf": pdf_path,
+        "pages": n_pages,
+        "accepted_pages": accepted,
+        "fast_ms_per_page": round(1000 * statistics.mean(fast_times), 2) if fast_times else None,
+        "model_ms_per_page": round(1000 * statistics.mean(model_times), 2) if model_times else None,
+        "speedup": round(sum(model_times) / sum(fast_times), 1) if fast_times and sum(fast_times) else None,
+        "table_count_agreement": round(count_matches / accepted, 3) if accepted else None,
+        "mean_bbox_iou": round(statistics.mean(ious), 3) if ious else None,
+        "cell_agreement": round(statistics.mean(cells), 3) if cells else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ruled-table fast path vs gmft benchmark")
+    parser.add_argument('pdf', nargs='+', help="PDF files to compare on")
+    parser.add_argument('--pages', type=int, default=None, help="Pages per PDF (default: all)")
+    parser.add_argument('--min-confidence', type=float, default=ruled_tables.MIN_CONFIDENCE)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = [run(pdf, args.pages, args.min_confidence) for pdf in args.pdf]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'pdf':<30} {'pages':>6} {'fast':>6} {'fast ms':>8} {'gmft ms':>8} {'speedup':>8} {'count':>6} {'iou':>6} {'cells':>6}")
+    for r in results:
+        print(
+            f"{r['pdf'][-30:]:<30} {r['pages']:>6} {r['accepted_pages']:>6} {r['fast_ms_per_page']:>8} "
+            f"{r['model_ms_per_page']:>8} {str(r['speedup']) + 'x':>8} {str(r['table_count_agreement']):>6} "
+            f"{str(r['mean_bbox_iou']):>6} {str(r['cell_agreement']):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
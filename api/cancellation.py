@@ -0,0 +1,69 @@
+"""
+Cooperative cancellation of extractions.
+
+PDFTableProcessor.process_tables checks a CancelToken before every page and every
+table and stops early once it is cancelled, so an extraction nobody waits for any
+more doesn't keep detecting and writing files. Tokens are cancelled by:
+
+- a client disconnect (watch_disconnect, for /process and /process/{filename}/stream)
+- DELETE /jobs/{id}
+- a deadline (a job's EXTRACTION_JOB_DEADLINE or the deadline given with it)
+
+Whatever was extracted before the cancellation is kept, and only pages that were
+finished are charged to the user's quota.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from metrics import EXTRACTIONS_CANCELLED
+
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 1.0
+
+
+class CancelToken:
+    """Cancelled from the event loop, checked from the extraction thread."""
+
+    def __init__(self, deadline=None):
+        self._event = threading.Event()
+        self.deadline = deadline  # time.monotonic() value, or None
+        self.reason = None
+
+    def cancel(self, reason="cancelled"):
+        if self._event.is_set():
+            return
+        self.reason = reason
+        self._event.set()
+        EXTRACTIONS_CANCELLED.labels(reason).inc()
+
+    def set_timeout(self, seconds):
+        """Cancel `seconds` from now (keeps an earlier deadline)."""
+        deadline = time.monotonic() + seconds
+        self.deadline = deadline if self.deadline is None else min(self.deadline, deadline)
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self._event.is_set()
+
+
+async def _poll_disconnect(request, token, interval):
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("client_disconnected")
+            return
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def watch_disconnect(request, token, interval=DISCONNECT_POLL_SECONDS):
+    """Cancel token if the client of request goes away while the block runs."""
+    task = asyncio.create_task(_poll_disconnect(request, token, interval))
+    try:
+        yield token
+    finally:
+        task.cancel()
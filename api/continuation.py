@@ -0,0 +1,107 @@
+"""
+Deadlines and continuation tokens for /api/v1/extract.
+
+With deadline_ms the endpoint works page by page and table by table, and stops when
+the next step is not expected to finish within the budget. The budget is counted from
+when the request arrived. It returns the tables it has, plus a continuation token. The
+client sends the same PDF again with continuation=<token> and the extraction picks up
+where it stopped. Detections are cached by the PDF's content hash, so the page that was
+cut short is not detected again.
+
+Tokens are signed (HMAC-SHA256 with CONTINUATION_SECRET, by default SESSION_SECRET).
+A token is only valid for the same user and the same file, and only until it expires.
+Without either secret no tokens are issued or accepted (ENABLED is False); a cut-short
+response then only reports its pages_remaining.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+from pdf_utils import format_page_ranges, parse_page_ranges
+
+logger = logging.getLogger(__name__)
+
+SECRET = (os.getenv("CONTINUATION_SECRET") or os.getenv("SESSION_SECRET") or "").encode()
+# Never sign with an empty key: anyone could mint tokens for any user, file and pages
+ENABLED = bool(SECRET)
+if not ENABLED:
+    logger.warning("Neither CONTINUATION_SECRET nor SESSION_SECRET is set; continuation tokens are disabled")
+TOKEN_TTL_SECONDS = int(os.getenv("CONTINUATION_TTL_SECONDS", "86400"))
+# Held back from deadline_ms for building and sending the response
+DEADLINE_MARGIN_SECONDS = int(os.getenv("EXTRACT_DEADLINE_MARGIN_MS", "1000")) / 1000
+# Weight of the latest step in the moving averages of page and table durations
+DURATION_SMOOTHING = 0.3
+
+
+class Budget:
+    """Time left until a deadline (time.monotonic(), None: no deadline), with per-step duration estimates."""
+
+    def __init__(self, deadline=None):
+        self.deadline = None if deadline is None else deadline - DEADLINE_MARGIN_SECONDS
+        self._estimates = {}
+        self._started = None
+        self.progressed = False
+
+    def fits(self, *steps):
+        """Whether steps ("page", "table") are expected to finish in time; always true before any progress."""
+        if self.deadline is None or not self.progressed:
+            return True
+        return time.monotonic() + sum(self._estimates.get(step, 0.0) for step in steps) <= self.deadline
+
+    def start(self):
+        self._started = time.monotonic()
+
+    def done(self, step):
+        duration = time.monotonic() - self._started
+        previous = self._estimates.get(step)
+        self._estimates[step] = duration if previous is None else (
+            DURATION_SMOOTHING * duration + (1 - DURATION_SMOOTHING) * previous
+        )
+        self.progressed = True
+
+
+def _sign(payload):
+    if not ENABLED:
+        raise RuntimeError("Continuation tokens are disabled: set CONTINUATION_SECRET or SESSION_SECRET")
+    return hmac.new(SECRET, payload, hashlib.sha256).digest()
+
+
+def encode(user_id, content_hash, page_indices, skip_tables=0):
+    """Token for the remaining page_indices; skip_tables tables of the first one were already returned."""
+    payload = json.dumps({
+        "user": user_id,
+        "sha256": content_hash,
+        "pages": format_page_ranges(page_indices),
+        "skip": skip_tables,
+        "expires": int(time.time()) + TOKEN_TTL_SECONDS,
+    }, separators=(",", ":")).encode()
+    return ".".join(base64.urlsafe_b64encode(part).decode().rstrip("=") for part in (payload, _sign(payload)))
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def decode(token, user_id, content_hash, total_pages):
+    """(page_indices, skip_tables) of a token; raises ValueError if it is not valid for this user and file."""
+    if not ENABLED:
+        raise ValueError("Continuation tokens are disabled on this server")
+    try:
+        payload, signature = (_b64decode(part) for part in token.split("."))
+    except ValueError:
+        raise ValueError("Malformed continuation token") from None
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise ValueError("Invalid continuation token")
+    data = json.loads(payload)
+    if data["expires"] < time.time():
+        raise ValueError("Continuation token has expired")
+    if data["user"] != user_id:
+        raise ValueError("Continuation token belongs to another user")
+    if data["sha256"] != content_hash:
+        raise ValueError("Continuation token is for a different file")
+    return parse_page_ranges(data["pages"], total_pages), data["skip"]
@@ -66,11 +66,32 @@ async def check_db_connection() -> bool:
         logger.error(f"Database connection failed: {e}")
         return False
 
+def _add_missing_columns(sync_conn):
+    """
+    create_all does not alter existing tables; add nullable columns that were
+    introduced after a table was first created.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"Added column {table.name}.{column.name}")
+
+
 async def create_all_tables():
     """Create all database tables if they don't exist"""
     try:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(_add_missing_columns)
         logger.info("Database tables created/verified")
     except Exception as e:
         logger.error(f"Error creating database tables: {e}")
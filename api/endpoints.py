@@ -3,9 +3,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import User, PDF
 from database import get_db
-from pdf_utils import get_pdf_page_count
+from pdf_utils import probe_pdf
+from extraction_cache import file_sha256
+import asyncio
 import os
-import shutil
+from upload_pipeline import save_upload
 from datetime import datetime
 
 router = APIRouter()
@@ -26,6 +28,42 @@ async def get_current_user(request: Request, db: AsyncSession = Depends(get_db))
         raise HTTPException(status_code=401, detail='User not found')
     return user
 
+async def get_latest_pdf(db: AsyncSession, user_id: int, filename: str):
+    """Most recent upload record of this file by the user, with its probed metadata."""
+    result = await db.execute(
+        select(PDF)
+        .where(PDF.user_id == user_id, PDF.pdf_filename == filename)
+        .order_by(PDF.uploaded_at.desc(), PDF.id.desc())
+    )
+    return result.scalars().first()
+
+# file path -> (inode, size, mtime_ns, sha256) of the last hash computed for it
+_file_hashes = {}
+
+
+def file_hash(file_path: str) -> str:
+    """SHA-256 of a file, re-read only when it was replaced or changed since the last call (blocking)."""
+    st = os.stat(file_path)
+    identity = (st.st_ino, st.st_size, st.st_mtime_ns)
+    cached = _file_hashes.get(file_path)
+    if cached is not None and cached[:3] == identity:
+        return cached[3]
+    content_hash = file_sha256(file_path)
+    _file_hashes[file_path] = (*identity, content_hash)
+    return content_hash
+
+
+async def get_current_pdf(db: AsyncSession, user_id: int, filename: str, file_path: str):
+    """
+    (record, content_hash) for the file now at file_path. uploads/ is shared by all users and
+    files get replaced, so the upload record is only returned if its hash matches the file on disk.
+    """
+    content_hash = await asyncio.to_thread(file_hash, file_path)
+    pdf_record = await get_latest_pdf(db, user_id, filename)
+    if pdf_record is not None and pdf_record.content_hash != content_hash:
+        pdf_record = None
+    return pdf_record, content_hash
+
 @router.post('/upload_pdf')
 @router.post('/upload')  # İki URL'ye aynı endpoint hizmet veriyor
 async def upload_pdf(
@@ -36,17 +74,21 @@ async def upload_pdf(
     # Dosyayı kaydet
     file_path = os.path.join(UPLOAD_DIR, file.filename)
     try:
-        with open(file_path, 'wb') as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        print(f"File saved successfully at: {file_path}")
-        print(f"File exists: {os.path.exists(file_path)}")
-        print(f"File size: {os.path.getsize(file_path)} bytes")
+        saved = await save_upload(file, file_path)
+        print(f"File saved successfully at: {file_path} ({saved.size} bytes)")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error saving file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
 
-    # PDF sayfa sayısını bul
-    pages_total = await get_pdf_page_count(file_path)
+    # PDF'i tek geçişte incele (sayfa sayısı, boyutlar, metin katmanı, şifreleme, hash)
+    try:
+        probe = await asyncio.to_thread(probe_pdf, file_path, saved.sha256)
+    except Exception as e:
+        os.remove(file_path)
+        raise HTTPException(status_code=400, detail=f"File is not a valid PDF: {str(e)}")
+    pages_total = probe["pages_total"]
 
     # PDF kaydı oluştur (kota henüz harcanmıyor)
     pdf = PDF(
@@ -54,7 +96,11 @@ async def upload_pdf(
         pdf_filename=file.filename,
         pages_total=pages_total,
         pages_processed=0,  # Henüz işlenmedi
-        uploaded_at=datetime.utcnow()
+        uploaded_at=datetime.utcnow(),
+        content_hash=probe["content_hash"],
+        is_encrypted=probe["is_encrypted"],
+        page_sizes=probe["page_sizes"],
+        text_pages=probe["text_pages"]
     )
     db.add(pdf)
     await db.commit()
@@ -80,6 +126,7 @@ async def upload_pdf(
     if active_promo:
         return {
             'pdf_id': pdf.id,
+            'content_hash': saved.sha256,
             'pages_total': pages_total,
             'pages_processed': 0,
             'limit_left': 9999,  # Sınırsız limit göster
@@ -89,6 +136,7 @@ async def upload_pdf(
         # Normal kota
         return {
             'pdf_id': pdf.id,
+            'content_hash': saved.sha256,
             'pages_total': pages_total,
             'pages_processed': 0,
             'limit_left': user.monthly_page_limit - user.pages_processed_this_month,
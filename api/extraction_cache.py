@@ -0,0 +1,207 @@
+"""
+Content-addressed, on-disk cache for extraction results.
+
+Entries are keyed by the SHA-256 of the PDF bytes, a fingerprint of the detector and
+formatter configuration, and the page (and table) index, so the same report uploaded
+under a different filename hits the same entries. Each entry is one JSON file; reads
+touch its mtime and the least recently used files are evicted once the cache grows
+past its size limit.
+
+Every process (API, extraction workers) only sees its own writes. After every tenth of
+the limit it has written, or when those take it over the limit, it locks the cache (a
+thread lock and an flock on ROOT/.lock) and re-reads the size on disk; if the cache is
+over the limit, the oldest entries go until it is under 90% of it. So N processes
+overshoot by at most N tenths rather than N times the limit. The same pass removes
+.tmp files left behind by writers that died.
+"""
+
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file lock, processes may evict at the same time
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Relative paths are relative to this directory (api/), not to the working directory
+CACHE_DIR = os.path.join(os.path.dirname(__file__), os.getenv("EXTRACTION_CACHE_DIR", os.path.join('..', 'cache')))
+# 0 disables the cache
+CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "1024"))
+
+# Bump when the layout of cached entries changes
+CACHE_VERSION = 2
+
+# .tmp files older than this belong to a writer that died
+STALE_TMP_SECONDS = 3600
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _config_dict(config):
+    if isinstance(config, dict):
+        return config
+    if dataclasses.is_dataclass(config):
+        return dataclasses.asdict(config)
+    return dict(vars(config))
+
+
+def config_fingerprint(*configs):
+    """Stable hash of the settings that influence extraction output (enable_multi_header, semantic_spanning_cells, ...)."""
+    payload = json.dumps(
+        [CACHE_VERSION] + [_config_dict(c) for c in configs],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class ExtractionCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, _, size in self._entries())
+        self._unsynced = 0  # bytes written since the size was last read from disk
+
+    @staticmethod
+    def detections_key(content_hash, fingerprint, page_index):
+        return f"{content_hash}-{fingerprint}-p{page_index}"
+
+    @staticmethod
+    def table_key(content_hash, fingerprint, page_index, table_index):
+        return f"{content_hash}-{fingerprint}-p{page_index}-t{table_index}"
+
+    def _path(self, key):
+        # Shard by hash prefix to keep directories small
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self):
+        """(path, mtime, size) for every cached entry."""
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                yield path, stat.st_mtime, stat.st_size
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        # Write atomically so concurrent readers (other workers) never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data) - replaced
+            self._unsynced += len(data)
+            check = self._size > self.max_bytes or self._unsynced > self.max_bytes * 0.1
+        if check:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _locked(self):
+        """Held while the cache's size is read from disk and entries are evicted, across processes."""
+        with self._lock, open(os.path.join(self.root, ".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield  # closing the file releases the lock
+
+    def _remove_stale_tmp(self):
+        cutoff = time.time() - STALE_TMP_SECONDS
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        """If the cache, as it is on disk, is over its limit, delete least recently used entries down to 90% of it."""
+        with self._locked():
+            self._remove_stale_tmp()
+            # Other processes write to the same directory; our own count is only a hint
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            size = sum(e[2] for e in entries)
+            if size > self.max_bytes:
+                target = self.max_bytes * 0.9
+                for path, _, entry_size in entries:
+                    if size <= target:
+                        break
+                    self._remove(path)
+                    size -= entry_size
+            self._size = size
+            self._unsynced = 0
+
+    def clear(self):
+        with self._locked():
+            for path, _, _ in list(self._entries()):
+                self._remove(path)
+            self._size = 0
+            self._unsynced = 0
+
+
+_cache = None
+
+
+def get_cache():
+    """Process-wide cache instance, or None if caching is disabled."""
+    global _cache
+    if CACHE_MAX_MB <= 0:
+        return None
+    if _cache is None:
+        _cache = ExtractionCache()
+    return _cache
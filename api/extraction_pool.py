@@ -0,0 +1,176 @@
+"""
+Process-pool engine that spreads PDFTableProcessor work over several CPU cores.
+
+Each worker process loads the gmft detector and formatter once (model_registry),
+then handles whole pages: detection plus formatting of every table on
+the page. Results are yielded back in page order.
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of worker processes used by PDFTableProcessor.process_tables by default.
+# 1 keeps the old in-process serial behaviour.
+DEFAULT_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "1"))
+
+# Per-worker state, filled by _init_worker
+_worker_processors = {}
+
+
+def _init_worker(torch_threads):
+    """Load the models once per worker and keep torch from oversubscribing the cores."""
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    from model_registry import registry
+    registry.load()
+
+
+def _get_worker_processor(pdf_path, content_hash=None, text_pages=None):
+    """
+    This worker's PDFTableProcessor for pdf_path. Uploads are replaced in place under the
+    same name, so the processor is keyed by the file's content hash (or, when the parent
+    didn't pass one, its inode and mtime) as well as its path, never by the path alone.
+    """
+    from table_format import PDFTableProcessor
+
+    if content_hash is not None:
+        key = (pdf_path, content_hash)
+    else:
+        st = os.stat(pdf_path)
+        key = (pdf_path, st.st_ino, st.st_mtime_ns, st.st_size)
+    processor = _worker_processors.get(key)
+    if processor is None:
+        # Keep only the document currently being worked on open in this worker
+        for old in _worker_processors.values():
+            old.doc.close()
+        _worker_processors.clear()
+        processor = PDFTableProcessor(pdf_path, content_hash=content_hash, text_pages=text_pages)
+        _worker_processors[key] = processor
+    return processor
+
+
+def _process_page(pdf_path, page_idx, output_format, images=None, output_dir=None, content_hash=None, text_pages=None):
+    """Detect and format every table of one page inside a worker process."""
+    from stage_timings import StageTimings
+
+    processor = _get_worker_processor(pdf_path, content_hash, text_pages)
+    # Fresh timers per page; the parent merges them into its own document totals
+    processor.timings = StageTimings()
+    if output_dir is not None:
+        processor.output_dir = output_dir  # write into the parent's namespace
+    tables_on_page = processor.get_page_tables(page_idx)
+    detections = [table.to_dict() for table in tables_on_page]
+    results = [
+        processor.process_single_table(page_idx, tbl_idx, output_format, images)
+        for tbl_idx in range(len(tables_on_page))
+    ]
+    return page_idx, detections, results, processor.timings.to_dict()
+
+
+def _extract_page(pdf_path, page_idx, content_hash=None):
+    """
+    Detect and format every table of one page in memory inside a worker process.
+    Returns (page_idx, [(table_idx, rows)], timings); rows are header first, as
+    PDFTableProcessor.format_single_table returns them. Tables that fail to format are left out.
+    """
+    from stage_timings import StageTimings
+
+    processor = _get_worker_processor(pdf_path, content_hash)
+    processor.timings = StageTimings()
+    tables = []
+    for tbl_idx, table in enumerate(processor.get_page_tables(page_idx)):
+        try:
+            tables.append((tbl_idx, processor.format_single_table(table)))
+        except Exception as e:
+            print(f"Error processing table {tbl_idx} on page {page_idx + 1}: {e}")
+    return page_idx, tables, processor.timings.to_dict()
+
+
+class ExtractionPool:
+    """
+    A pool of worker processes that each hold their own detector and formatter.
+
+    Usage:
+        with ExtractionPool(workers=8) as pool:
+            for result in pool.process_tables(pdf_path, 'json', pages_limit=30):
+                ...
+    """
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or os.cpu_count() or 1
+        # Split the cores between workers so torch intra-op threads don't fight each other
+        torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # spawn: forking a process that already holds torch/pdfium state is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(torch_threads,),
+        )
+
+    def iter_pages(self, pdf_path, page_indices, output_format='json', images=None, output_dir=None,
+                   content_hash=None, text_pages=None):
+        """
+        Yield (page_idx, detections, results, timings) for each page, in the order of page_indices.
+        detections are CroppedTable.to_dict() dicts, results are the process_single_table tuples
+        and timings is the worker's StageTimings.to_dict() for that page. content_hash and
+        text_pages are the parent processor's, so workers don't re-hash or re-probe the file.
+        """
+        page_indices = list(page_indices)
+        yield from self._executor.map(
+            _process_page,
+            [pdf_path] * len(page_indices),
+            page_indices,
+            [output_format] * len(page_indices),
+            [images] * len(page_indices),
+            [output_dir] * len(page_indices),
+            [content_hash] * len(page_indices),
+            [text_pages] * len(page_indices),
+        )
+
+    def submit_page(self, pdf_path, page_idx, content_hash=None):
+        """Future of one page's in-memory tables (see _extract_page); for callers that interleave documents."""
+        return self._executor.submit(_extract_page, pdf_path, page_idx, content_hash)
+
+    def process_tables(self, pdf_path, output_format='json', pages_limit: int | None = None, images=None):
+        """Parallel counterpart of PDFTableProcessor.process_tables."""
+        from table_format import PDFTableProcessor
+
+        processor = PDFTableProcessor(pdf_path)
+        try:
+            yield from processor.process_tables(output_format, pages_limit=pages_limit, pool=self, images=images)
+        finally:
+            processor.doc.close()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+_default_pool = None
+
+
+def get_default_pool():
+    """Shared pool sized by EXTRACTION_WORKERS, or None when extraction should stay in-process."""
+    global _default_pool
+    if DEFAULT_WORKERS <= 1:
+        return None
+    if _default_pool is None:
+        _default_pool = ExtractionPool(DEFAULT_WORKERS)
+    return _default_pool
+
+
+def shutdown_default_pool():
+    global _default_pool
+    if _default_pool is not None:
+        _default_pool.shutdown()
+        _default_pool = None
@@ -0,0 +1,118 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from typing import Optional
+import asyncio
+import os
+import logging
+
+from database import get_db
+from endpoints import get_current_user, get_current_pdf, UPLOAD_DIR
+from models import User
+from jobs import ExtractionJob, job_manager
+from pdf_utils import pdfium_page_count
+from quota import refund_pages, reserve_pages
+from table_render import IMAGE_MODES
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+class CreateJobRequest(BaseModel):
+    filename: str
+    output_format: str = "json"
+    pages_limit: Optional[int] = 30
+    images: Optional[str] = None  # eager, lazy or none; see table_render
+    deadline_seconds: Optional[int] = None  # cancel the job if it runs longer (capped by EXTRACTION_JOB_DEADLINE)
+
+
+def get_owned_job(job_id: str, user: User):
+    job = job_manager.get(job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("", status_code=202)
+async def create_job(
+    request: CreateJobRequest,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user)
+):
+    """Queue an extraction of an uploaded PDF and return its job id."""
+    filename = request.filename
+    if not filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail='Only PDF files are allowed')
+    if '..' in filename or '/' in filename or '\\' in filename:
+        raise HTTPException(status_code=400, detail='Invalid filename')
+    if request.output_format not in ["json", "csv", "both"]:
+        raise HTTPException(status_code=400, detail='Invalid output format')
+    if request.images is not None and request.images not in IMAGE_MODES:
+        raise HTTPException(status_code=400, detail='Invalid images mode')
+    if request.pages_limit is not None and request.pages_limit < 1:
+        raise HTTPException(status_code=400, detail='Pages limit must be positive')
+    if request.deadline_seconds is not None and request.deadline_seconds < 1:
+        raise HTTPException(status_code=400, detail='Deadline must be positive')
+
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Reuse the metadata probed at upload time when it is for this exact file
+    pdf_record, content_hash = await get_current_pdf(db, user.id, filename, file_path)
+    if pdf_record is not None:
+        total_pages = pdf_record.pages_total
+    else:
+        try:
+            total_pages = await asyncio.to_thread(pdfium_page_count, file_path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"File is not a valid PDF: {e}")
+
+    pages_limit, has_active_promo = await reserve_pages(db, user, request.pages_limit, total_pages)
+
+    job = ExtractionJob(
+        user_id=user.id,
+        filename=filename,
+        file_path=file_path,
+        output_format=request.output_format,
+        pages_limit=pages_limit,
+        has_active_promo=has_active_promo,
+        total_pages=total_pages,
+        content_hash=content_hash,
+        text_pages=pdf_record.text_pages if pdf_record is not None else None,
+        images=request.images,
+        deadline_seconds=request.deadline_seconds,
+    )
+    if not job_manager.submit(job):
+        if not has_active_promo:
+            await refund_pages(user.id, pages_limit)
+        raise HTTPException(status_code=503, detail="Too many extraction jobs queued, try again later")
+
+    logger.info(f"Queued job {job.id} for {filename} ({pages_limit} pages)")
+    return job.progress()
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, user: User = Depends(get_current_user)):
+    """Job status and progress (pages done, tables found)."""
+    return get_owned_job(job_id, user).progress()
+
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str, user: User = Depends(get_current_user)):
+    """Cancel a queued or running job; tables extracted so far remain available."""
+    job = get_owned_job(job_id, user)
+    job_manager.cancel(job)
+    return job.progress()
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, user: User = Depends(get_current_user)):
+    """Extraction result of a finished job, in the same shape as GET /process/{filename}."""
+    job = get_owned_job(job_id, user)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Error processing tables: {job.error}")
+    if job.status not in ("completed", "cancelled"):
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result()
@@ -0,0 +1,280 @@
+"""
+Background extraction jobs.
+
+POST /jobs queues an extraction and returns a job id right away. The CPU-bound gmft
+work runs in a bounded thread pool, outside the event loop, so the rest of the API
+(/health, /auth/me, downloads) stays responsive while PDFs are being processed.
+Progress and results are polled through GET /jobs/{id}. DELETE /jobs/{id} cancels a
+job, and a running job is cancelled once it exceeds its deadline; either way the tables
+extracted so far stay available and only the finished pages are charged.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import retention
+from cancellation import CancelToken
+from admission import controller as admission, user_lane
+
+logger = logging.getLogger(__name__)
+
+# How many extractions may run at the same time, and how many may wait for a slot
+MAX_RUNNING_JOBS = int(os.getenv("EXTRACTION_JOB_WORKERS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("EXTRACTION_JOB_QUEUE", "100"))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL_SECONDS = int(os.getenv("EXTRACTION_JOB_TTL", "3600"))
+# Longest a job may run once it has a slot; 0 disables the limit
+JOB_DEADLINE_SECONDS = int(os.getenv("EXTRACTION_JOB_DEADLINE", "1800"))
+
+
+def result_entry(output_format, result):
+    """Turn a process_tables tuple into the file names returned by /process and /jobs."""
+    from table_format import output_name
+
+    if output_format == "both":
+        json_file, csv_file, image_file = result
+        return {
+            "json_file": output_name(json_file),
+            "csv_file": output_name(csv_file),
+            "image_file": output_name(image_file) if image_file else None,
+        }
+    data_file, image_file = result
+    return {
+        "data_file": output_name(data_file),
+        "image_file": output_name(image_file) if image_file else None,
+    }
+
+
+class ExtractionJob:
+    def __init__(self, user_id, filename, file_path, output_format, pages_limit, has_active_promo, total_pages,
+                 content_hash=None, images=None, deadline_seconds=None, text_pages=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filename = filename
+        self.file_path = file_path
+        self.output_format = output_format
+        self.pages_limit = pages_limit
+        self.has_active_promo = has_active_promo
+        self.total_pages = total_pages
+        self.content_hash = content_hash
+        self.text_pages = text_pages
+        self.images = images
+        # Seconds the extraction may run; the job's own deadline can only be shorter than the server's
+        limits = [s for s in (deadline_seconds, JOB_DEADLINE_SECONDS) if s]
+        self.deadline_seconds = min(limits) if limits else None
+        self.cancel = CancelToken()
+        self.task = None
+        self.status = "queued"  # queued -> running -> completed | failed | cancelled
+        self.pages_done = 0
+        self.tables_found = 0
+        self.results = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def progress(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_limit,
+            "tables_found": self.tables_found,
+            "error": self.error,
+            "cancel_reason": self.cancel.reason,
+        }
+
+    def result(self):
+        """Same payload as GET /process/{filename}."""
+        response_data = {
+            "tables": self.results,
+            "total_tables": self.tables_found,
+            "total_pages": self.total_pages,
+            "processed_pages": self.pages_done,
+        }
+        if self.status == "cancelled":
+            response_data["cancelled"] = True
+            response_data["cancel_reason"] = self.cancel.reason
+        elif self.total_pages > self.pages_limit:
+            response_data["warning"] = f"PDF contains {self.total_pages} pages, but only the first {self.pages_limit} pages will be processed due to monthly quota limit."
+        return response_data
+
+
+class JobManager:
+    def __init__(self, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="extraction")
+        self._jobs = {}
+        self._tasks = set()
+
+    @property
+    def executor(self):
+        """The extraction thread pool; admission slots are sized for it (ADMISSION_MAX_RUNNING)."""
+        return self._executor
+
+    def pending_count(self):
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def submit(self, job: ExtractionJob):
+        """Queue a job; returns False if the queue is full."""
+        self._prune()
+        if self.pending_count() >= self.max_queued:
+            return False
+        self._jobs[job.id] = job
+        task = asyncio.create_task(self._run(job))
+        job.task = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def cancel(self, job: ExtractionJob, reason="user"):
+        """Stop a job: a queued one leaves the queue, a running one stops before its next page or table."""
+        if job.finished:
+            return
+        job.cancel.cancel(reason)
+        if job.status == "queued":
+            job.task.cancel()
+
+    async def _run(self, job: ExtractionJob):
+        from quota import refund_pages
+
+        loop = asyncio.get_running_loop()
+        # Keep the upload from being garbage collected while the job waits for a slot
+        pins = retention.pin(job.file_path)
+        try:
+            # Share the extraction slots with the synchronous endpoints; jobs wait rather than being rejected
+            lane = await user_lane(job.user_id)
+            async with admission.slot(job.user_id, bounded=False, lane=lane, cost=job.pages_limit):
+                # From here on cancel() leaves the task alone and the extraction stops itself
+                job.status = "running"
+                job.started_at = time.time()
+                if job.deadline_seconds:
+                    job.cancel.set_timeout(job.deadline_seconds)
+                await loop.run_in_executor(self._executor, self._extract, job)
+        except asyncio.CancelledError:
+            if not job.cancel.cancelled:
+                raise  # shutdown
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            logger.info(f"Job {job.id} cancelled while queued")
+            return
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = time.time()
+            return
+        finally:
+            retention.unpin(*pins)
+            # pages_limit was reserved at submit; failed jobs are not charged, others only for finished pages
+            if not job.has_active_promo:
+                await refund_pages(job.user_id, job.pages_limit - (0 if job.status == "failed" else job.pages_done))
+
+        job.status = "cancelled" if job.cancel.cancelled else "completed"
+        job.finished_at = time.time()
+        logger.info(f"Job {job.id} {job.status}: {job.tables_found} tables from {job.pages_done} pages")
+
+    def _extract(self, job: ExtractionJob):
+        """Runs in a pool thread."""
+        from table_format import PDFTableProcessor, OUTPUT_DIR
+
+        if job.cancel.cancelled:
+            return
+
+        def on_page_done(page_idx, tables_on_page):
+            job.pages_done += 1
+
+        processor = PDFTableProcessor(
+            job.file_path, content_hash=job.content_hash, output_dir=os.path.join(OUTPUT_DIR, job.id),
+            user_id=job.user_id, text_pages=job.text_pages,
+        )
+        try:
+            for result in processor.process_tables(job.output_format, pages_limit=job.pages_limit, on_page_done=on_page_done,
+                                                     images=job.images, cancel=job.cancel):
+                job.results.append(result_entry(job.output_format, result))
+                job.tables_found += 1
+        finally:
+            processor.doc.close()
+
+        if not job.results and not job.cancel.cancelled:
+            raise ValueError("No tables were successfully processed in the PDF")
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager()
+
+
+_DONE = object()
+
+
+async def iterate_in_executor(iterator_factory, executor=None):
+    """
+    Run a blocking iterator in the extraction thread pool and yield its items as soon
+    as they are produced. If the consumer stops early (e.g. the client went away) the
+    producer thread stops after its current item.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def post(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            stop.set()  # event loop is gone (shutdown)
+
+    def produce():
+        iterator = None
+        try:
+            # Inside the try, so a factory that fails (bad PDF, ...) reports to the consumer too
+            iterator = iterator_factory()
+            for item in iterator:
+                post(item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            post(_DONE, e)
+            return
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+        post(_DONE)
+
+    loop.run_in_executor(executor or job_manager.executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
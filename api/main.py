@@ -1,17 +1,25 @@
 from fastapi import FastAPI, UploadFile, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from typing import List, Union, Dict, Any
 import os
-import shutil
+import json
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from auth import router as auth_router
-from endpoints import router as endpoints_router, get_current_user
+from endpoints import router as endpoints_router, get_current_user, get_current_pdf
 import asyncio
+import time
 from tasks import weekly_reset
+import metrics
+import retention
+from admission import controller as admission, session_user_slot, user_lane, SlotStreamingResponse
+from cancellation import CancelToken, watch_disconnect
+from model_registry import registry, MODEL_WARMUP
+from upload_pipeline import MULTIPART_OVERHEAD_BYTES, BodySizeLimitMiddleware, save_upload
+from table_render import IMAGE_MODES, render_pending_image
 from starlette.middleware.sessions import SessionMiddleware
-from database import create_all_tables, get_db
+from database import create_all_tables, get_db, engine
 from models import User
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -47,6 +55,14 @@ async def lifespan(app: FastAPI):
         print("Starting background tasks...")
         weekly_reset_task = asyncio.create_task(weekly_reset())
 
+        # Delete expired / over-quota uploads and outputs
+        if retention.RETENTION_ENABLED:
+            retention_task = asyncio.create_task(retention.run_retention())
+
+        # Load the table models in the background so /health answers immediately
+        if MODEL_WARMUP == "background":
+            model_warmup_task = asyncio.create_task(registry.warm_up())
+
         print("Application startup completed!")
 
         yield  # Application is running
@@ -66,9 +82,21 @@ async def lifespan(app: FastAPI):
                 await weekly_reset_task
             except asyncio.CancelledError:
                 print("Background task cancelled successfully")
+        if 'model_warmup_task' in locals():
+            model_warmup_task.cancel()
+        if 'retention_task' in locals():
+            retention_task.cancel()
     except Exception as e:
         print(f"Error during shutdown: {e}")
 
+    # Stop queued/running extraction jobs
+    from jobs import job_manager
+    job_manager.shutdown()
+
+    # Stop extraction worker processes, if any were started
+    from extraction_pool import shutdown_default_pool
+    shutdown_default_pool()
+
     print("Application shutdown completed!")
 
 
@@ -125,10 +153,49 @@ app.add_middleware(
     same_site="lax",
     https_only=False
 )
+
+# Refuses an oversized upload before the endpoint's multipart parser spools it. Wraps CORS and
+# sessions; the latency middleware registered below wraps it, so refused uploads are still timed
+from batch_endpoints import MAX_BATCH_BYTES
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={"/api/v2/extract/batch": MAX_BATCH_BYTES + MULTIPART_OVERHEAD_BYTES},
+)
+metrics.instrument_engine(engine)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    # Request budgets (deadline_ms) are counted from here
+    request.state.received_at = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/process/{filename}) so file names don't explode cardinality
+        route = request.scope.get("route")
+        metrics.REQUEST_LATENCY.labels(
+            request.method,
+            route.path if route is not None else "unmatched",
+            str(status),
+        ).observe(time.perf_counter() - start)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "message": "API is running!"}
+    return {"status": "healthy", "message": "API is running!", "models": registry.status(),
+            "admission": admission.status()}
 
 
 @app.get("/test-session")
@@ -152,10 +219,11 @@ async def upload_pdf(file: UploadFile):
 
     file_path = os.path.join(UPLOAD_DIR, file.filename)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        saved = await save_upload(file, file_path)
 
-        return {"filename": file.filename, "status": "success"}
+        return {"filename": file.filename, "status": "success", "content_hash": saved.sha256}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -170,8 +238,12 @@ async def process_pdf(
     filename: str,
     output_format: str = "json",
     pages_limit: int = 30,  # Default 30
+    pages: str = None,  # 1-based pages/ranges, e.g. "12-15,180"; replaces the first pages_limit pages
+    debug: bool = False,  # Include per-stage timings in the response
+    images: str = None,  # eager, lazy (render on first download) or none; default EXTRACTION_IMAGES
     request: Request = None,  # Session için
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    _slot: None = Depends(session_user_slot)  # admission control: 429/503 when too busy
 ):
     logger.info(f"Processing request for file: {filename}")
     logger.debug(f"Output format: {output_format}, Pages limit: {pages_limit}")
@@ -194,6 +266,9 @@ async def process_pdf(
     if output_format not in ["json", "csv", "both"]:
         logger.error(f"Invalid output format: {output_format}")
         raise HTTPException(status_code=400, detail='Invalid output format')
+    if images is not None and images not in IMAGE_MODES:
+        logger.error(f"Invalid images mode: {images}")
+        raise HTTPException(status_code=400, detail='Invalid images mode')
         
     # Pages limit validation
     try:
@@ -216,43 +291,54 @@ async def process_pdf(
         logger.warning(f"No user found for user_id: {user_id}")
         raise HTTPException(status_code=401, detail='User not found')
 
-    if output_format not in ["json", "csv", "both"]:
-        raise HTTPException(status_code=400, detail="Invalid output format")
-
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-
     # Validate file exists
     file_path = os.path.join(UPLOAD_DIR, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
 
+    # Metadata probed at upload time (page count); saves re-parsing the file
+    pdf_record, content_hash = await get_current_pdf(db, user.id, filename, file_path)
+    text_pages = pdf_record.text_pages if pdf_record is not None else None
+
+    # Explicit page selection, validated before any work is done
+    page_indices = None
+    if pages:
+        from pdf_utils import parse_page_ranges, pdfium_page_count
+        if pdf_record is not None:
+            page_count = pdf_record.pages_total
+        else:
+            try:
+                page_count = await asyncio.to_thread(pdfium_page_count, file_path)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"File is not a valid PDF: {e}")
+        try:
+            page_indices = parse_page_ranges(pages, page_count)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        # 1. File checks
+        # 1. File checks (already done by the upload probe when there is a PDF record)
         logger.info(f"Starting to process PDF: {file_path}")
         try:
-            if not os.path.exists(file_path):
-                raise ValueError(f"File does not exist: {file_path}")
-                
-            file_size = os.path.getsize(file_path)
-            if file_size == 0:
-                raise ValueError("File is empty")
-            logger.debug(f"File size: {file_size} bytes")
+            if pdf_record is None:
+                file_size = os.path.getsize(file_path)
+                if file_size == 0:
+                    raise ValueError("File is empty")
+                logger.debug(f"File size: {file_size} bytes")
             
-            file_abs_path = os.path.abspath(file_path)
-            logger.debug(f"File absolute path: {file_abs_path}")
+                file_abs_path = os.path.abspath(file_path)
+                logger.debug(f"File absolute path: {file_abs_path}")
             
-            if not os.access(file_path, os.R_OK):
-                raise ValueError(f"No read permission for file")
-            if not os.access(os.path.dirname(file_path), os.W_OK):
-                raise ValueError(f"No write permission for output directory")
+                if not os.access(file_path, os.R_OK):
+                    raise ValueError(f"No read permission for file")
+                if not os.access(os.path.dirname(file_path), os.W_OK):
+                    raise ValueError(f"No write permission for output directory")
                 
-            # Check if it's actually a PDF
-            with open(file_path, 'rb') as f:
-                header = f.read(4)
-                if header != b'%PDF':
-                    raise ValueError("File is not a valid PDF")
+                # Check if it's actually a PDF
+                with open(file_path, 'rb') as f:
+                    header = f.read(4)
+                    if header != b'%PDF':
+                        raise ValueError("File is not a valid PDF")
                     
         except Exception as file_error:
             logger.error(f"File validation error: {str(file_error)}", exc_info=True)
@@ -260,7 +346,7 @@ async def process_pdf(
             
         # 2. Import and initialize PDFTableProcessor
         try:
-            from table_format import PDFTableProcessor
+            from table_format import PDFTableProcessor, output_name
             logger.info("PDFTableProcessor imported successfully")
         except ImportError as import_error:
             logger.error(f"Failed to import PDFTableProcessor: {str(import_error)}", exc_info=True)
@@ -271,55 +357,24 @@ async def process_pdf(
         
         # 3. Process PDF
         try:
-            # Aylık kota kontrolü - varsayılan 30 sayfa
-            if user.monthly_page_limit != 30:
-                user.monthly_page_limit = 30
-                logger.info(f"Setting default monthly page limit to 30 for user {user.id}")
-            
-            # Check for active promotion
-            from models import UserPromotion
-            from datetime import datetime
-            from sqlalchemy.orm import selectinload
-            
-            # Get user with promotion data
-            result = await db.execute(
-                select(User).options(selectinload(User.user_promotions)).where(User.id == user.id)
-            )
-            user_with_promos = result.scalars().first()
-            
-            # Check for active promotion
-            has_active_promo = False
-            for promo in user_with_promos.user_promotions:
-                if promo.is_active and promo.expires_at > datetime.utcnow():
-                    has_active_promo = True
-                    break
-            
-            # Promo aktifse sınırsız, değilse normal kota kontrolü
+            logger.debug("Initializing PDFTableProcessor...")
+            processor = PDFTableProcessor(file_path, content_hash=content_hash, user_id=user_id, text_pages=text_pages)
+            logger.info(f"PDF loaded successfully")
+
+            # Kota: the pages are counted as used now (403 when the quota is used up) and
+            # the ones not processed are refunded below; unlimited with an active promotion
+            from quota import refund_pages, reserve_pages
+            requested = len(page_indices) if page_indices is not None else pages_limit
+            try:
+                pages_limit, has_active_promo = await reserve_pages(db, user, requested, processor.total_pages)
+            except BaseException:
+                processor.doc.close()
+                raise
             if has_active_promo:
-                logger.info(f"User {user.id} has active promotion - unlimited processing")
-                # Sınırsız işleme için PDF'in toplam sayfa sayısını almalıyız
-                processor = PDFTableProcessor(file_path)
-                pages_limit = processor.total_pages  # Bu satır önemli - tüm PDF'i işleme
-                logger.info(f"Unlimited promo active - processing all {pages_limit} pages")
+                logger.info(f"Unlimited promo active - processing up to {pages_limit} pages")
             else:
-                # Normal kota kontrolü
-                pages_left = user.monthly_page_limit - user.pages_processed_this_month
-                if pages_left <= 0:
-                    raise HTTPException(
-                        status_code=403, 
-                        detail=f'Monthly quota exceeded. Monthly limit is 30 pages, you have processed {user.pages_processed_this_month} pages this month.'
-                    )
-                
-                # İstenen sayfa sayısını kota limitine göre ayarla
-                pages_limit = min(pages_limit, pages_left)
-                logger.info(f"User has {pages_left} pages left in quota, will process {pages_limit} pages")
-            
-            # PDF zaten yüklendiyse tekrar yükleme, aksi takdirde yükle
-            if not 'processor' in locals():
-                logger.debug("Initializing PDFTableProcessor...")
-                processor = PDFTableProcessor(file_path)
-            logger.info(f"PDF loaded successfully")
-                
+                logger.info(f"Reserved {pages_limit} pages from the quota of user {user.id}")
+
         except HTTPException:
             raise
         except Exception as processor_error:
@@ -329,103 +384,282 @@ async def process_pdf(
                 detail=f"Error processing PDF: {str(processor_error)}"
             )
         
-        results = []
+        pages_done = 0
+        try:
+            results = []
         
-        # Check total pages and set warning if needed
-        total_pages = processor.total_pages
-        warning_message = None
-        if total_pages > pages_limit:
-            warning_message = f"PDF contains {total_pages} pages, but only the first {pages_limit} pages will be processed due to monthly quota limit."
+            # Check total pages and set warning if needed
+            total_pages = processor.total_pages
+            warning_message = None
+            if page_indices is not None:
+                if len(page_indices) > pages_limit:
+                    warning_message = f"{len(page_indices)} pages were selected, but only the first {pages_limit} of them will be processed due to monthly quota limit."
+                    page_indices = page_indices[:pages_limit]
+            elif total_pages > pages_limit:
+                warning_message = f"PDF contains {total_pages} pages, but only the first {pages_limit} pages will be processed due to monthly quota limit."
             
-        # Pass pages_limit through to processor
-        try:
-            logger.debug(f"Starting to process tables with format: {output_format}, pages_limit: {pages_limit}")
-            processed_tables = 0
+            # Pass pages_limit through to processor
+            try:
+                logger.debug(f"Starting to process tables with format: {output_format}, pages_limit: {pages_limit}")
+                processed_tables = 0
             
-            for result in processor.process_tables(output_format, pages_limit=pages_limit):
-                try:
-                    if output_format == "both":
-                        if len(result) != 3:
-                            raise ValueError(f"Expected 3 files for 'both' format, got {len(result)}")
-                        json_file, csv_file, image_file = result
+                from jobs import iterate_in_executor
+
+                # Extraction runs in a worker thread so the event loop keeps serving other requests;
+                # it stops before the next page or table if the client goes away
+                cancel = CancelToken()
+
+                def on_page_done(page_idx, tables_on_page):
+                    nonlocal pages_done
+                    pages_done += 1
+
+                def extract():
+                    # The document is closed by the extraction thread, once it is done with it
+                    try:
+                        yield from processor.process_tables(
+                            output_format, pages_limit=pages_limit, images=images, page_indices=page_indices,
+                            on_page_done=on_page_done, cancel=cancel)
+                    finally:
+                        processor.doc.close()
+
+                async with watch_disconnect(request, cancel):
+                    async for result in iterate_in_executor(extract):
+                        try:
+                            if output_format == "both":
+                                if len(result) != 3:
+                                    raise ValueError(f"Expected 3 files for 'both' format, got {len(result)}")
+                                json_file, csv_file, image_file = result
                         
-                        # Validate all files exist
-                        for file_path in [json_file, csv_file, image_file]:
-                            if not os.path.exists(file_path):
-                                raise ValueError(f"Generated file does not exist: {file_path}")
+                                # Validate all files exist (lazy images are rendered on download)
+                                for file_path in [json_file, csv_file]:
+                                    if not os.path.exists(file_path):
+                                        raise ValueError(f"Generated file does not exist: {file_path}")
                                 
-                        results.append({
-                            "json_file": os.path.basename(json_file),
-                            "csv_file": os.path.basename(csv_file),
-                            "image_file": os.path.basename(image_file)
-                        })
-                    else:
-                        if len(result) != 2:
-                            raise ValueError(f"Expected 2 files for '{output_format}' format, got {len(result)}")
-                        data_file, image_file = result
+                                results.append({
+                                    "json_file": output_name(json_file),
+                                    "csv_file": output_name(csv_file),
+                                    "image_file": output_name(image_file) if image_file else None
+                                })
+                            else:
+                                if len(result) != 2:
+                                    raise ValueError(f"Expected 2 files for '{output_format}' format, got {len(result)}")
+                                data_file, image_file = result
                         
-                        # Validate files exist
-                        for file_path in [data_file, image_file]:
-                            if not os.path.exists(file_path):
-                                raise ValueError(f"Generated file does not exist: {file_path}")
+                                # Validate files exist (lazy images are rendered on download)
+                                for file_path in [data_file]:
+                                    if not os.path.exists(file_path):
+                                        raise ValueError(f"Generated file does not exist: {file_path}")
                                 
-                        results.append({
-                            "data_file": os.path.basename(data_file),
-                            "image_file": os.path.basename(image_file)
-                        })
+                                results.append({
+                                    "data_file": output_name(data_file),
+                                    "image_file": output_name(image_file) if image_file else None
+                                })
                     
-                    processed_tables += 1
-                    logger.debug(f"Successfully processed table {processed_tables}")
+                            processed_tables += 1
+                            logger.debug(f"Successfully processed table {processed_tables}")
                     
-                except Exception as table_error:
-                    logger.error(f"Error processing table {processed_tables + 1}: {str(table_error)}", exc_info=True)
+                        except Exception as table_error:
+                            logger.error(f"Error processing table {processed_tables + 1}: {str(table_error)}", exc_info=True)
+                            raise HTTPException(
+                                status_code=500,
+                                detail=f"Error processing table {processed_tables + 1}: {str(table_error)}"
+                            )
+
+                if cancel.cancelled:
+                    logger.info(f"Extraction of {filename} cancelled ({cancel.reason}) after {pages_done} pages")
+                elif not results:
                     raise HTTPException(
-                        status_code=500,
-                        detail=f"Error processing table {processed_tables + 1}: {str(table_error)}"
+                        status_code=400, 
+                        detail="No tables were successfully processed in the PDF"
                     )
-
-            if not results:
+                else:
+                    logger.info(f"Successfully processed {processed_tables} tables")
+            
+            except Exception as process_error:
+                logger.error(f"Error during table processing: {str(process_error)}", exc_info=True)
                 raise HTTPException(
-                    status_code=400, 
-                    detail="No tables were successfully processed in the PDF"
+                    status_code=500,
+                    detail=f"Error processing tables: {str(process_error)}"
                 )
-                
-            logger.info(f"Successfully processed {processed_tables} tables")
+
+            response_data = {
+                "tables": results,
+                "total_tables": processor.total_tables,
+                "total_pages": total_pages,
+                "processed_pages": pages_done
+            }
+            if page_indices is not None:
+                response_data["pages"] = [p + 1 for p in page_indices]
+            if warning_message:
+                response_data["warning"] = warning_message
+            if cancel.cancelled:
+                response_data["cancelled"] = True
+                response_data["cancel_reason"] = cancel.reason
+            if debug:
+                response_data["timings"] = processor.timings.summary()
             
-        except Exception as process_error:
-            logger.error(f"Error during table processing: {str(process_error)}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error processing tables: {str(process_error)}"
-            )
+            return response_data
+        finally:
+            # Only the pages finished (before a cancellation or error) count against the quota
+            if not has_active_promo:
+                await refund_pages(user_id, pages_limit - pages_done)
+                logger.info(f"Used {pages_done} pages from quota")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Kota harca - sadece promo yoksa
+
+def _table_event(output_format, result):
+    """Metadata and data of one extracted table, for the streaming endpoint."""
+    from jobs import result_entry
+
+    event = result_entry(output_format, result)
+    # process_single_table names its files output_page_{p}_table_{t}.*
+    stem = os.path.splitext(os.path.basename(result[0]))[0]
+    _, page_idx, _, table_idx = stem.rsplit('_', 3)
+    event["page"] = int(page_idx) + 1
+    event["table_index"] = int(table_idx)
+
+    data_file = result[0]
+    if data_file.endswith('.json'):
+        with open(data_file, 'r', encoding='utf-8') as f:
+            event["data"] = json.load(f)
+    else:
+        with open(data_file, 'r', encoding='utf-8-sig') as f:
+            event["csv_data"] = f.read()
+    return event
+
+
+@app.get("/process/{filename}/stream")
+async def process_pdf_stream(
+    filename: str,
+    output_format: str = "json",
+    pages_limit: int = 30,
+    stream_format: str = "sse",  # sse or ndjson
+    images: str = None,  # eager, lazy or none, as for /process
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user)
+):
+    """
+    Like /process, but streams every table (metadata and data) as soon as it is extracted,
+    as server-sent events or newline-delimited JSON.
+    """
+    if not filename.endswith('.pdf') or '..' in filename or '/' in filename or '\\' in filename:
+        raise HTTPException(status_code=400, detail='Invalid filename')
+    if output_format not in ["json", "csv", "both"]:
+        raise HTTPException(status_code=400, detail='Invalid output format')
+    if stream_format not in ["sse", "ndjson"]:
+        raise HTTPException(status_code=400, detail='Invalid stream format')
+    if images is not None and images not in IMAGE_MODES:
+        raise HTTPException(status_code=400, detail='Invalid images mode')
+    if pages_limit < 1:
+        raise HTTPException(status_code=400, detail='Pages limit must be positive')
+
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    from pdf_utils import pdfium_page_count
+    from quota import refund_pages, reserve_pages
+    from jobs import iterate_in_executor
+
+    pdf_record, content_hash = await get_current_pdf(db, user.id, filename, file_path)
+    text_pages = pdf_record.text_pages if pdf_record is not None else None
+    if pdf_record is not None:
+        total_pages = pdf_record.pages_total
+    else:
+        try:
+            total_pages = await asyncio.to_thread(pdfium_page_count, file_path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"File is not a valid PDF: {e}")
+    pages_limit, has_active_promo = await reserve_pages(db, user, pages_limit, total_pages)
+    user_id = user.id
+    # Admission control; the slot is held until the stream is finished
+    try:
+        ticket = await admission.acquire(user_id, lane=await user_lane(user_id), cost=pages_limit)
+    except BaseException:
         if not has_active_promo:
-            user.pages_processed_this_month += pages_limit
-            await db.commit()
-            logger.info(f"Used {pages_limit} pages from quota")
-        else:
-            logger.info(f"Unlimited promo active - no quota consumed")
+            await refund_pages(user_id, pages_limit)
+        raise
 
-        response_data = {
-            "tables": results,
-            "total_tables": processor.total_tables,
+    state = {"pages_done": 0, "tables": 0, "finished": False}
+    cancel = CancelToken()
+
+    def extraction_events():
+        from table_format import PDFTableProcessor
+
+        pending = []
+
+        def on_page_done(page_idx, tables_on_page):
+            state["pages_done"] += 1
+            pending.append(("progress", {
+                "pages_done": state["pages_done"],
+                "pages_total": pages_limit,
+                "tables_found": state["tables"],
+            }))
+
+        processor = PDFTableProcessor(file_path, content_hash=content_hash, user_id=user_id, text_pages=text_pages)
+        try:
+            for result in processor.process_tables(output_format, pages_limit=pages_limit, on_page_done=on_page_done,
+                                                     images=images, cancel=cancel):
+                # progress of pages finished before this table, then the table itself
+                while pending:
+                    yield pending.pop(0)
+                state["tables"] += 1
+                yield "table", _table_event(output_format, result)
+            while pending:
+                yield pending.pop(0)
+        finally:
+            processor.doc.close()
+
+    def encode(event, payload):
+        if stream_format == "sse":
+            return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n"
+
+    async def body():
+        yield encode("start", {"total_pages": total_pages, "pages_total": pages_limit})
+        try:
+            async for event, payload in iterate_in_executor(extraction_events):
+                yield encode(event, payload)
+        except Exception as e:
+            logger.error(f"Streaming extraction failed: {e}", exc_info=True)
+            state["finished"] = True
+            yield encode("error", {"detail": str(e)})
+        state["finished"] = True
+        admission.release(ticket)
+        yield encode("done", {
+            "total_tables": state["tables"],
             "total_pages": total_pages,
-            "processed_pages": min(total_pages, pages_limit)
-        }
-        if warning_message:
-            response_data["warning"] = warning_message
-            
-        return response_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            "processed_pages": state["pages_done"],
+        })
+
+    async def settle():
+        """Runs once the response is over, also when the client left before body() ever ran."""
+        if not state["finished"]:
+            # The client went away: stop the worker before its next page or table
+            cancel.cancel("client_disconnected")
+        # Charge only for pages that were actually processed
+        if not has_active_promo:
+            await refund_pages(user_id, pages_limit - state["pages_done"])
 
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return SlotStreamingResponse(body(), ticket, on_close=settle, media_type=media_type, headers={"Cache-Control": "no-cache"})
 
-@app.get("/download/{filename}")
+
+@app.get("/download/{filename:path}")
 async def download_file(filename: str):
-    file_path = os.path.join(OUTPUT_DIR, filename)
-    if not os.path.exists(file_path):
+    # Outputs live in per-extraction directories: <namespace>/output_page_0_table_0.json
+    output_root = os.path.realpath(OUTPUT_DIR)
+    file_path = os.path.realpath(os.path.join(output_root, filename))
+    if not file_path.startswith(output_root + os.sep):
         raise HTTPException(status_code=404, detail="File not found")
+    if not os.path.exists(file_path):
+        # Table images extracted with images=lazy are rendered on first request
+        with retention.in_use(os.path.dirname(file_path)):
+            if not (filename.endswith('.png') and await asyncio.to_thread(render_pending_image, file_path)):
+                raise HTTPException(status_code=404, detail="File not found")
+    # Least recently downloaded extractions are evicted first
+    retention.touch(file_path)
     return FileResponse(file_path)
 
 
@@ -454,6 +688,10 @@ app.include_router(endpoints_router)
 from api_endpoints import router as api_router
 app.include_router(api_router, prefix="/api")
 
+# Include batch extraction (API v2) router
+from batch_endpoints import router as batch_router
+app.include_router(batch_router, prefix="/api")
+
 # Include Stripe router
 from stripe_endpoints import router as stripe_router
 app.include_router(stripe_router, prefix="/stripe")
@@ -462,6 +700,10 @@ app.include_router(stripe_router, prefix="/stripe")
 from promo_endpoints import router as promo_router
 app.include_router(promo_router)
 
+# Include extraction jobs router
+from job_endpoints import router as jobs_router
+app.include_router(jobs_router)
+
 # Static routes temporarily disabled
 # Will be implemented later
 
@@ -0,0 +1,169 @@
+"""
+Prometheus metrics for the API, served in text exposition format at GET /metrics.
+
+- HTTP request latency per route template (middleware in main.py)
+- extractions in flight, pages and tables processed
+- seconds spent per extraction stage, including model inference (fed by the
+  stage_timings sink below, so pool workers are counted too)
+- pages skipped by the pre-filter and pages kept by the ruled-table fast path
+- extraction cache hits and misses
+- database query latency (SQLAlchemy cursor events)
+- files deleted and disk usage of uploads/ and outputs/ (retention.py)
+- admission control queue depth, wait time and rejections (admission.py)
+"""
+
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+import stage_timings
+
+REQUEST_LATENCY = Histogram(
+    "pdfx_http_request_duration_seconds",
+    "HTTP request latency by route template (streaming responses: time to first byte)",
+    ["method", "route", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+EXTRACTIONS_IN_FLIGHT = Gauge(
+    "pdfx_extractions_in_flight",
+    "Documents currently being extracted",
+)
+PAGES_PROCESSED = Counter(
+    "pdfx_pages_processed_total",
+    "Pages run through table extraction",
+)
+TABLES_PROCESSED = Counter(
+    "pdfx_tables_processed_total",
+    "Tables extracted",
+)
+EXTRACTION_DURATION = Histogram(
+    "pdfx_extraction_duration_seconds",
+    "Wall time of one document extraction",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+STAGE_SECONDS = Counter(
+    "pdfx_extraction_stage_seconds_total",
+    "Seconds spent per extraction stage",
+    ["stage"],
+)
+MODEL_INFERENCE_SECONDS = Counter(
+    "pdfx_model_inference_seconds_total",
+    "Seconds spent in table model forward passes",
+    ["model"],
+)
+PREFILTER_PAGES = Counter(
+    "pdfx_prefilter_pages_total",
+    "Pages seen by the table pre-filter, by decision",
+    ["decision"],
+)
+FAST_PATH_PAGES = Counter(
+    "pdfx_ruled_fast_path_pages_total",
+    "Pages tried on the ruled-table fast path, by outcome",
+    ["outcome"],
+)
+CACHE_REQUESTS = Counter(
+    "pdfx_cache_requests_total",
+    "Extraction cache lookups",
+    ["kind", "result"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "pdfx_db_query_duration_seconds",
+    "Database statement latency",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+RETENTION_DELETED = Counter(
+    "pdfx_retention_deleted_total",
+    "Uploads / extraction directories deleted by the retention sweep",
+    ["directory", "reason"],
+)
+RETENTION_BYTES = Counter(
+    "pdfx_retention_freed_bytes_total",
+    "Bytes freed by the retention sweep",
+    ["directory", "reason"],
+)
+RETENTION_DISK_BYTES = Gauge(
+    "pdfx_retention_disk_bytes",
+    "Bytes in uploads/ and outputs/ after the last retention sweep",
+    ["directory"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "pdfx_admission_queue_depth",
+    "Extraction requests waiting for a slot",
+    ["lane"],
+)
+ADMISSION_REJECTED = Counter(
+    "pdfx_admission_rejected_total",
+    "Extraction requests turned away by admission control",
+    ["reason"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "pdfx_admission_wait_seconds",
+    "Time extraction requests waited for a slot",
+    ["lane"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+EXTRACTIONS_CANCELLED = Counter(
+    "pdfx_extractions_cancelled_total",
+    "Extractions stopped early",
+    ["reason"],
+)
+
+# Stage names recorded by batch_inference for the detector / formatter forward passes
+_MODEL_STAGES = {"detection": "detection", "structure": "structure"}
+
+
+def record_extraction(summary):
+    """stage_timings sink: turn a finished document summary into metrics."""
+    EXTRACTION_DURATION.observe(summary["wall_seconds"])
+    for stage, values in summary["stages"].items():
+        STAGE_SECONDS.labels(stage).inc(values["seconds"])
+        if stage in _MODEL_STAGES:
+            MODEL_INFERENCE_SECONDS.labels(_MODEL_STAGES[stage]).inc(values["seconds"])
+    events = summary.get("events", {})
+    PAGES_PROCESSED.inc(events.get("pages", 0))
+    TABLES_PROCESSED.inc(events.get("tables", 0))
+    PREFILTER_PAGES.labels("skipped").inc(events.get("prefilter_skipped", 0))
+    PREFILTER_PAGES.labels("inspected").inc(events.get("prefilter_inspected", 0))
+    FAST_PATH_PAGES.labels("accepted").inc(events.get("ruled_pages", 0))
+    FAST_PATH_PAGES.labels("fallback").inc(events.get("ruled_fallback_pages", 0))
+    FAST_PATH_PAGES.labels("merged").inc(events.get("ruled_partial_pages", 0))
+    for kind in ("detections", "tables"):
+        for result in ("hit", "miss"):
+            count = events.get(f"cache_{result}_{kind}", 0)
+            if count:
+                CACHE_REQUESTS.labels(kind, result).inc(count)
+
+
+stage_timings.add_sink(record_extraction)
+
+
+def instrument_engine(engine):
+    """Record the latency of every statement run through an (async) SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        if operation not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            operation = "OTHER"
+        DB_QUERY_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # Keep the start-time stack balanced when a statement fails
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+def render():
+    """(body, content type) for the /metrics response."""
+    return generate_latest(), CONTENT_TYPE_LATEST
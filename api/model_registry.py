@@ -0,0 +1,134 @@
+"""
+Lazily loaded gmft detector and formatter shared by the extraction code.
+
+Nothing heavy (torch, transformers, model weights) is imported until the models are
+first needed, so importing table_format/api_endpoints is cheap and the API can answer
+/health right away. main.py's lifespan starts a background warm-up so the first
+extraction usually finds the models already loaded.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import onnx_backend
+import quantization
+
+logger = logging.getLogger(__name__)
+
+# "background": load in a thread at startup, "lazy": load on the first extraction
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "background")
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "not_loaded"  # not_loaded -> loading -> ready | failed
+        self.error = None
+        self.load_seconds = None
+        self._detector = None
+        self._formatter = None
+        self._format_config = None
+        self._fingerprint = None
+
+    @property
+    def format_config(self):
+        """AutoFormatConfig used for every table (no model weights needed)."""
+        if self._format_config is None:
+            from gmft.auto import AutoFormatConfig
+
+            config_hdr = AutoFormatConfig(enable_multi_header=True)  # config may be passed like so
+            config_hdr.verbosity = 3
+            config_hdr.enable_multi_header = True
+            config_hdr.semantic_spanning_cells = True
+            self._format_config = config_hdr
+        return self._format_config
+
+    @property
+    def config_fingerprint(self):
+        """Fingerprint of detector + formatter settings, used as part of cache keys."""
+        if self._fingerprint is None:
+            from gmft.auto import TATRDetectorConfig
+            from extraction_cache import config_fingerprint
+            import page_filter
+            import ruled_tables
+
+            detector_config = self._detector.config if self._detector is not None else TATRDetectorConfig()
+            self._fingerprint = config_fingerprint(
+                detector_config, self.format_config,
+                ruled_tables.settings(), page_filter.settings(), onnx_backend.settings(),
+                quantization.settings(),
+            )
+        return self._fingerprint
+
+    def load(self):
+        """Load the detector and formatter if needed. Blocking; safe to call from several threads."""
+        if self.state == "ready":
+            return
+        with self._lock:
+            if self.state == "ready":
+                return
+            self.state = "loading"
+            self.error = None
+            start = time.perf_counter()
+            try:
+                from gmft.auto import AutoTableDetector, AutoTableFormatter
+
+                detector = AutoTableDetector()
+                formatter = AutoTableFormatter(self.format_config)
+                if onnx_backend.BACKEND == "onnx":
+                    onnx_backend.attach(detector, formatter)
+                elif onnx_backend.BACKEND != "torch":
+                    raise ValueError(f"Unknown INFERENCE_BACKEND {onnx_backend.BACKEND!r}, expected one of {onnx_backend.BACKENDS}")
+                if quantization.MODE == "int8":
+                    allowed, reason = quantization.gate(detector, formatter)
+                    if allowed:
+                        detector, formatter = quantization.quantized(detector, formatter)
+                        quantization.active = True
+                        logger.info("Using int8-quantized table models")
+                    else:
+                        logger.warning(f"Not quantizing the table models: {reason}")
+                elif quantization.MODE != "none":
+                    raise ValueError(f"Unknown MODEL_QUANTIZATION {quantization.MODE!r}, expected one of {quantization.MODES}")
+                self._detector = detector
+                self._formatter = formatter
+                self._fingerprint = None  # may have been computed before the models (and quantization) were known
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                logger.error(f"Model loading failed: {e}", exc_info=True)
+                raise
+            self.load_seconds = time.perf_counter() - start
+            self.state = "ready"
+            logger.info(f"Table models loaded in {self.load_seconds:.1f}s")
+
+    @property
+    def detector(self):
+        self.load()
+        return self._detector
+
+    @property
+    def formatter(self):
+        self.load()
+        return self._formatter
+
+    async def warm_up(self):
+        """Load the models in a worker thread without blocking the event loop."""
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception:
+            pass  # already logged; the next extraction will retry
+
+    def status(self):
+        return {
+            "state": self.state,
+            "backend": onnx_backend.BACKEND,
+            "quantization": "int8" if quantization.active else "none",
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+registry = ModelRegistry()
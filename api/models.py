@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -30,6 +30,11 @@ class PDF(Base):
     pages_total = Column(Integer, nullable=False)
     pages_processed = Column(Integer, nullable=False)
     uploaded_at = Column(DateTime, default=func.now())
+    # Metadata from the upload-time probe (pdf_utils.probe_pdf)
+    content_hash = Column(String, index=True, nullable=True)
+    is_encrypted = Column(Boolean, default=False)
+    page_sizes = Column(JSON, nullable=True)  # [[width, height], ...] in pdf units
+    text_pages = Column(JSON, nullable=True)  # [bool, ...] page has a text layer
     user = relationship('User', back_populates='pdfs')
 
 class APIKey(Base):
@@ -0,0 +1,242 @@
+"""
+ONNX Runtime backend for the TATR detection and structure-recognition models.
+
+With INFERENCE_BACKEND=onnx, model_registry swaps the PyTorch models inside the gmft
+detector and formatter for OnnxModel wrappers. They take the same inputs
+(pixel_values, pixel_mask) and return the same logits / pred_boxes, so the gmft
+image processors and batch_inference keep working unchanged.
+
+The models are exported on first use to ONNX_MODEL_DIR, or ahead of time with
+
+    python onnx_backend.py export
+
+and the outputs can be checked against PyTorch on real pages with
+
+    python onnx_backend.py parity report.pdf --pages 5
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, concurrent workers may export the same model twice
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx")
+BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+# Relative paths are relative to this directory (api/), like EXTRACTION_CACHE_DIR
+ONNX_MODEL_DIR = os.path.join(os.path.dirname(__file__), os.getenv("ONNX_MODEL_DIR", os.path.join('..', 'models', 'onnx')))
+# 0 lets onnxruntime pick; set it when several extraction workers share the machine
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+# Parity tolerances against the PyTorch model on identical inputs
+LOGITS_ATOL = 1e-3
+BOXES_ATOL = 1e-4
+
+
+def settings():
+    """Part of the extraction cache fingerprint."""
+    return {"inference_backend": BACKEND}
+
+
+def model_path(model, name):
+    source = getattr(model, "name_or_path", "") or name
+    return os.path.join(ONNX_MODEL_DIR, f"{name}-{source.replace('/', '--')}.onnx")
+
+
+@contextmanager
+def build_lock(path):
+    """
+    Held while a model file is built. Extraction workers load the models at the same
+    time; one builds the file and the others wait for it, then find it there.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield  # closing the file releases the lock
+
+
+@contextmanager
+def atomic_output(path):
+    """A unique temporary path next to path, moved onto it once the block succeeds."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def export(model, image_processor, path, sample_image):
+    """Export a HF table transformer to ONNX with dynamic batch and image size."""
+    import torch
+
+    encoding = image_processor(sample_image, return_tensors="pt")
+    input_names = [name for name in ("pixel_values", "pixel_mask") if name in encoding]
+
+    class Exportable(torch.nn.Module):
+        def __init__(self, wrapped):
+            super().__init__()
+            self.wrapped = wrapped
+
+        def forward(self, *inputs):
+            outputs = self.wrapped(**dict(zip(input_names, inputs)))
+            return outputs.logits, outputs.pred_boxes
+
+    dynamic_axes = {"pixel_values": {0: "batch", 2: "height", 3: "width"}}
+    if "pixel_mask" in input_names:
+        dynamic_axes["pixel_mask"] = {0: "batch", 1: "height", 2: "width"}
+    dynamic_axes.update({"logits": {0: "batch"}, "pred_boxes": {0: "batch"}})
+
+    with atomic_output(path) as tmp_path, torch.no_grad():
+        torch.onnx.export(
+            Exportable(model.eval()),
+            tuple(encoding[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["logits", "pred_boxes"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+    logger.info(f"Exported {path}")
+
+
+class OnnxModel:
+    """Callable stand-in for a HF table transformer, backed by an onnxruntime session."""
+
+    def __init__(self, path, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        import torch
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.threads = threads
+        self.name_or_path = os.path.splitext(os.path.basename(path))[0]
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.device = torch.device("cpu")
+
+    def __call__(self, **inputs):
+        import torch
+
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        logits, pred_boxes = self.session.run(["logits", "pred_boxes"], feed)
+        return SimpleNamespace(logits=torch.from_numpy(logits), pred_boxes=torch.from_numpy(pred_boxes))
+
+
+def _sample_image():
+    from PIL import Image
+
+    return Image.new("RGB", (800, 1000), "white")
+
+
+def load_model(model, image_processor, name):
+    path = model_path(model, name)
+    if not os.path.exists(path):
+        with build_lock(path):
+            if not os.path.exists(path):
+                export(model, image_processor, path, _sample_image())
+    return OnnxModel(path)
+
+
+def attach(detector, formatter):
+    """Replace the PyTorch models of a loaded gmft detector/formatter with ONNX sessions."""
+    detector.detector = load_model(detector.detector, detector.image_processor, "detection")
+    formatter.structor = load_model(formatter.structor, formatter.image_processor, "structure")
+
+
+def _compare(torch_model, onnx_model, image_processor, images):
+    """Max abs differences of logits / boxes over images, one image at a time."""
+    import torch
+
+    worst_logits = worst_boxes = 0.0
+    for image in images:
+        inputs = dict(image_processor(image, return_tensors="pt"))
+        with torch.no_grad():
+            expected = torch_model(**inputs)
+        actual = onnx_model(**inputs)
+        worst_logits = max(worst_logits, (expected.logits - actual.logits).abs().max().item())
+        worst_boxes = max(worst_boxes, (expected.pred_boxes - actual.pred_boxes).abs().max().item())
+    return worst_logits, worst_boxes
+
+
+def check_parity(pdf_path, pages=5):
+    """
+    Compare ONNX and PyTorch outputs on real page renders and table crops.
+    Returns a report dict; report["ok"] is False if any difference exceeds the tolerances.
+    """
+    from gmft.pdf_bindings import PyPDFium2Document
+    from gmft.auto import AutoTableDetector, AutoTableFormatter
+
+    detector, formatter = AutoTableDetector(), AutoTableFormatter()
+    onnx_detector = load_model(detector.detector, detector.image_processor, "detection")
+    onnx_structor = load_model(formatter.structor, formatter.image_processor, "structure")
+
+    doc = PyPDFium2Document(pdf_path)
+    try:
+        page_list = [doc.get_page(i) for i in range(min(pages, len(doc)))]
+        page_images = [page.get_image(72) for page in page_list]
+        tables = [table for page in page_list for table in detector.extract(page)]
+        table_images = [table.image(dpi=144, margin='auto') for table in tables]
+        detection = _compare(detector.detector, onnx_detector, detector.image_processor, page_images)
+        structure = _compare(formatter.structor, onnx_structor, formatter.image_processor, table_images)
+    finally:
+        doc.close()
+
+    report = {
+        "pages": len(page_images),
+        "tables": len(table_images),
+        "detection_logits_max_diff": detection[0],
+        "detection_boxes_max_diff": detection[1],
+        "structure_logits_max_diff": structure[0],
+        "structure_boxes_max_diff": structure[1],
+    }
+    report["ok"] = (
+        max(detection[0], structure[0]) <= LOGITS_ATOL and max(detection[1], structure[1]) <= BOXES_ATOL
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export TATR models to ONNX / check parity with PyTorch")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help="Export both models to ONNX_MODEL_DIR")
+    parity = sub.add_parser("parity", help="Compare ONNX and PyTorch outputs on a PDF")
+    parity.add_argument("pdf")
+    parity.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        from gmft.auto import AutoTableDetector, AutoTableFormatter
+
+        detector, formatter = AutoTableDetector(), AutoTableFormatter()
+        for model, processor, name in (
+            (detector.detector, detector.image_processor, "detection"),
+            (formatter.structor, formatter.image_processor, "structure"),
+        ):
+            export(model, processor, model_path(model, name), _sample_image())
+        return
+
+    report = check_parity(args.pdf, args.pages)
+    for key, value in report.items():
+        print(f"{key:>28}: {value}")
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
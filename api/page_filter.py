@@ -0,0 +1,106 @@
+"""
+Cheap "may this page contain a table?" check, run before any model inference.
+
+Long reports are mostly prose; sending those pages through TATR detection is wasted
+time. The score below only uses the text layer and the page's drawn lines:
+
+- rules:           horizontal/vertical ruling lines (beyond a header/footer rule or two)
+- aligned starts:  x positions where text segments (runs of words between wide gaps)
+                   start on 3+ different lines; prose only has its margin and indent
+- numeric columns: right edges shared by stand-alone numbers on 3+ lines
+- gappy lines:     lines split into three or more segments by wide gaps
+
+Pages without a text layer always score 1.0, since only the model can judge them.
+Lowering PAGE_FILTER_THRESHOLD trades skipped pages for recall; bench_page_filter.py
+measures both against the detector on real documents.
+"""
+
+import os
+import re
+
+# Opt-in until bench_page_filter.py has shown the threshold keeps recall on real documents
+PAGE_FILTER = os.getenv("PAGE_FILTER", "false").lower() == "true"
+THRESHOLD = float(os.getenv("PAGE_FILTER_THRESHOLD", "0.25"))
+
+_NUMERIC = re.compile(r"^[(\-+$€£¥]*\d[\d.,]*%?\)?$")
+LINE_TOLERANCE = 3.0  # pdf units between word centres on the same line
+ALIGN_BIN = 3.0  # pdf units; x positions within one bin count as aligned
+MIN_GAP = 12.0  # pdf units; wider gaps than this separate table cells, not words
+
+
+def settings():
+    """Part of the extraction cache fingerprint."""
+    return {"page_filter": PAGE_FILTER, "page_filter_threshold": THRESHOLD}
+
+
+def _lines(words):
+    lines = []
+    for word in sorted(words, key=lambda w: (w[1] + w[3]) / 2):
+        cy = (word[1] + word[3]) / 2
+        if lines and abs(lines[-1][0] - cy) <= LINE_TOLERANCE:
+            lines[-1][1].append(word)
+        else:
+            lines.append([cy, [word]])
+    return [sorted(line, key=lambda w: w[0]) for _, line in lines]
+
+
+def _aligned(positions_by_line, min_lines=3):
+    """Number of x bins used by at least min_lines different lines."""
+    bins = {}
+    for line_no, xs in enumerate(positions_by_line):
+        for x in xs:
+            bins.setdefault(round(x / ALIGN_BIN), set()).add(line_no)
+    return sum(1 for lines in bins.values() if len(lines) >= min_lines)
+
+
+def _segments(line):
+    """Split a line at gaps wider than MIN_GAP: table cells, or the whole line for prose."""
+    segments = [[line[0]]]
+    for prev, word in zip(line, line[1:]):
+        if word[0] - prev[2] > MIN_GAP:
+            segments.append([word])
+        else:
+            segments[-1].append(word)
+    return segments
+
+
+def page_features(pdfium_page, words, page_rules=None):
+    """
+    Text-layer and drawing features of a pypdfium2 page; words use gmft's (x0, y0, x1, y1, text).
+    page_rules is ruled_tables.rules(pdfium_page) if the caller already has it.
+    """
+    from ruled_tables import rules
+
+    words = [w for w in words if w[4].strip()]
+    lines = [_segments(line) for line in _lines(words)]
+    horizontal, vertical = page_rules or rules(pdfium_page)
+    return {
+        "words": len(words),
+        "lines": len(lines),
+        "rules": len(horizontal) + len(vertical),
+        "aligned_starts": _aligned([[seg[0][0] for seg in line] for line in lines]),
+        "numeric_columns": _aligned([
+            [seg[-1][2] for seg in line if len(seg) == 1 and _NUMERIC.match(seg[0][4].strip())]
+            for line in lines
+        ]),
+        "gappy_line_ratio": sum(1 for line in lines if len(line) >= 3) / len(lines) if lines else 0.0,
+    }
+
+
+def table_score(features):
+    """0..1; the strongest single table signal on the page."""
+    if features["words"] == 0:
+        return 1.0
+    return max(
+        min(1.0, max(0, features["rules"] - 2) / 6),
+        min(1.0, features["numeric_columns"] / 2),
+        min(1.0, max(0, features["aligned_starts"] - 2) / 3),
+        min(1.0, features["gappy_line_ratio"] * 3),
+    )
+
+
+def may_contain_table(page, threshold=None, words=None, page_rules=None):
+    """True if a gmft page (PyPDFium2Page) should go to table detection; words and page_rules as in page_features."""
+    threshold = THRESHOLD if threshold is None else threshold
+    words = page.get_positions_and_text() if words is None else words
+    return table_score(page_features(page.page, words, page_rules)) >= threshold
@@ -1,7 +1,86 @@
-import PyPDF2
+from extraction_cache import file_sha256
 
 
-async def get_pdf_page_count(file_path: str) -> int:
-    with open(file_path, 'rb') as f:
-        reader = PyPDF2.PdfReader(f)
-        return len(reader.pages)
+def pdfium_page_count(file_path: str) -> int:
+    """Page count read with pdfium (blocking; call through asyncio.to_thread)."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def parse_page_ranges(spec: str, total_pages: int) -> list[int]:
+    """
+    0-based page indices for a 1-based selection such as "12-15,180", sorted and
+    without duplicates. "5-" runs to the last page. Raises ValueError for malformed
+    or out-of-range selections.
+    """
+    pages = set()
+    for part in spec.split(','):
+        part = part.strip()
+        try:
+            if '-' in part:
+                first, _, last = part.partition('-')
+                first, last = int(first), int(last) if last.strip() else total_pages
+            else:
+                first = last = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page selection '{part}', expected e.g. 12-15,180") from None
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid page range '{part}'")
+        if last > total_pages:
+            raise ValueError(f"Page {last} is out of range, the PDF has {total_pages} pages")
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+
+def format_page_ranges(page_indices) -> str:
+    """Inverse of parse_page_ranges: 0-based indices to a 1-based selection such as "12-15,180"."""
+    parts = []
+    for index in sorted(set(page_indices)):
+        if parts and parts[-1][1] == index:
+            parts[-1][1] = index + 1
+        else:
+            parts.append([index + 1, index + 1])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in parts)
+
+
+def probe_pdf(file_path: str, content_hash: str | None = None) -> dict:
+    """
+    Read everything later stages need to know about a PDF in a single pdfium pass:
+    page count, page sizes (pdf units), whether each page has a text layer
+    (PDFTableProcessor's text_pages), the encryption flag and the content hash. Blocking; call through asyncio.to_thread.
+    """
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        page_sizes = []
+        text_pages = []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                page_sizes.append([round(page.get_width(), 2), round(page.get_height(), 2)])
+                textpage = page.get_textpage()
+                text_pages.append(textpage.count_chars() > 0)
+                textpage.close()
+            finally:
+                page.close()
+        # -1 means the document has no security handler. PDFs that need a user password
+        # don't open at all, so this only marks owner-password restrictions, which
+        # don't stop extraction; informational only.
+        is_encrypted = pdfium_c.FPDF_GetSecurityHandlerRevision(pdf.raw) != -1
+    finally:
+        pdf.close()
+
+    return {
+        "pages_total": len(page_sizes),
+        "page_sizes": page_sizes,
+        "text_pages": text_pages,
+        "is_encrypted": is_encrypted,
+        "content_hash": content_hash or file_sha256(file_path),
+    }
@@ -0,0 +1,246 @@
+"""
+Dynamic int8 quantization of the TATR detection and structure-recognition models.
+
+The linear layers (most of the transformer's weights) are quantized to int8 with
+dynamic activation scaling; the convolutional backbone stays fp32. With the torch
+backend this is torch's quantize_dynamic, with INFERENCE_BACKEND=onnx the exported
+graphs' MatMul/Gemm weights are quantized with onnxruntime.
+
+Quantization changes the model outputs, so it is gated on an evaluation against the
+fp32 models over a local corpus of PDFs:
+
+    python quantization.py evaluate corpus/ --pages 10
+
+compares table counts per page, table bounding boxes (IoU) and cell text, and
+writes QUANTIZATION_REPORT. With MODEL_QUANTIZATION=int8, model_registry only
+switches to the quantized models if that report was made for the current models
+and backend and every agreement score reaches QUANTIZATION_MIN_AGREEMENT;
+otherwise it logs why and keeps fp32.
+"""
+
+import argparse
+import copy
+import glob
+import json
+import logging
+import os
+import sys
+import time
+
+import onnx_backend
+
+logger = logging.getLogger(__name__)
+
+MODES = ("none", "int8")
+MODE = os.getenv("MODEL_QUANTIZATION", "none")
+# Relative paths are relative to this directory (api/), like ONNX_MODEL_DIR
+QUANTIZATION_REPORT = os.path.join(
+    os.path.dirname(__file__), os.getenv("QUANTIZATION_REPORT", os.path.join('..', 'models', 'quantization_report.json'))
+)
+MIN_AGREEMENT = float(os.getenv("QUANTIZATION_MIN_AGREEMENT", "0.98"))
+# Matched tables whose boxes overlap less than this count as a bbox disagreement
+BBOX_MIN_IOU = 0.9
+
+# Set by model_registry once the gate has been checked; part of the cache fingerprint
+active = False
+
+
+def settings():
+    """Part of the extraction cache fingerprint."""
+    return {"quantization": "int8" if active else "none"}
+
+
+def _model_names(detector, formatter):
+    return {
+        "backend": onnx_backend.BACKEND,
+        "detection_model": getattr(detector.detector, "name_or_path", "") or "detection",
+        "structure_model": getattr(formatter.structor, "name_or_path", "") or "structure",
+    }
+
+
+def _device_type(model):
+    device = getattr(model, "device", None)
+    return getattr(device, "type", "cpu")
+
+
+def _quantize_torch(model):
+    import torch
+
+    # quantize_dynamic has only CPU kernels; a model on the GPU would come back unusable
+    if _device_type(model) != "cpu":
+        raise ValueError(f"int8 dynamic quantization needs the model on the CPU, not {model.device}")
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _quantize_onnx(model):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path = model.path[:-len(".onnx")] + "-int8.onnx"
+    if not os.path.exists(path):
+        # Same as the export: one worker quantizes, the others wait for its file
+        with onnx_backend.build_lock(path):
+            if not os.path.exists(path):
+                with onnx_backend.atomic_output(path) as tmp_path:
+                    quantize_dynamic(model.path, tmp_path, weight_type=QuantType.QInt8,
+                                     op_types_to_quantize=["MatMul", "Gemm"])
+                logger.info(f"Quantized {path}")
+    return onnx_backend.OnnxModel(path, model.threads)
+
+
+def quantized(detector, formatter):
+    """Copies of a loaded gmft detector/formatter whose models are int8-quantized."""
+    quantize = _quantize_onnx if onnx_backend.BACKEND == "onnx" else _quantize_torch
+    detector, formatter = copy.copy(detector), copy.copy(formatter)
+    detector.detector = quantize(detector.detector)
+    formatter.structor = quantize(formatter.structor)
+    return detector, formatter
+
+
+def gate(detector, formatter, report_path=QUANTIZATION_REPORT, min_agreement=MIN_AGREEMENT):
+    """(allowed, reason): whether the stored evaluation report permits quantizing these models."""
+    if onnx_backend.BACKEND == "torch":
+        devices = {_device_type(model) for model in (detector.detector, formatter.structor)}
+        if devices != {"cpu"}:
+            return False, f"int8 dynamic quantization only runs on the CPU, the models are on {', '.join(sorted(devices))}"
+    if not os.path.exists(report_path):
+        return False, f"no evaluation report at {report_path}; run 'python quantization.py evaluate <corpus>'"
+    with open(report_path, encoding='utf-8') as f:
+        report = json.load(f)
+    expected = _model_names(detector, formatter)
+    stale = [key for key, value in expected.items() if report.get(key) != value]
+    if stale:
+        return False, f"evaluation report is for different models ({', '.join(stale)}); re-run the evaluation"
+    failing = {key: value for key, value in report["agreement"].items() if value < min_agreement}
+    if failing:
+        return False, f"agreement below {min_agreement}: {failing}"
+    return True, "ok"
+
+
+def _iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _match(reference, candidate):
+    """Greedy one-to-one matching of tables by bbox IoU, best overlaps first."""
+    pairs = sorted(
+        ((_iou(r.rect.bbox, c.rect.bbox), i, j) for i, r in enumerate(reference) for j, c in enumerate(candidate)),
+        reverse=True,
+    )
+    used_r, used_c, matches = set(), set(), []
+    for iou, i, j in pairs:
+        if iou > 0 and i not in used_r and j not in used_c:
+            used_r.add(i)
+            used_c.add(j)
+            matches.append((i, j, iou))
+    return matches
+
+
+def _cells(ft, config):
+    df = ft.df(config_overrides=config).fillna("")
+    return [[str(c) for c in df.columns]] + [[str(v) for v in row] for row in df.values.tolist()]
+
+
+def _cell_agreement(reference, candidate):
+    """Share of reference cells with identical text; a different grid shape scores 0."""
+    if len(reference) != len(candidate) or any(len(r) != len(c) for r, c in zip(reference, candidate)):
+        return 0.0
+    total = sum(len(row) for row in reference)
+    same = sum(1 for r, c in zip(reference, candidate) for a, b in zip(r, c) if a.strip() == b.strip())
+    return same / total if total else 1.0
+
+
+def evaluate(pdf_paths, pages=None):
+    """
+    Run the fp32 and int8 models over the corpus and return a report with
+    agreement scores (table counts, bboxes, cell text) and the time spent per variant.
+    """
+    from gmft.auto import AutoTableDetector, AutoTableFormatter
+    from gmft.pdf_bindings import PyPDFium2Document
+
+    from model_registry import registry
+
+    # Fresh fp32 models: the registry's may already be quantized
+    fp32 = (AutoTableDetector(), AutoTableFormatter(registry.format_config))
+    if onnx_backend.BACKEND == "onnx":
+        onnx_backend.attach(*fp32)
+    int8 = quantized(*fp32)
+    variants = {"fp32": fp32, "int8": int8}
+    seconds = {name: 0.0 for name in variants}
+
+    n_pages = same_count = 0
+    reference_tables = bbox_matched = 0
+    cell_scores = []
+    for pdf_path in pdf_paths:
+        doc = PyPDFium2Document(pdf_path)
+        try:
+            for page_idx in range(len(doc) if pages is None else min(pages, len(doc))):
+                page = doc.get_page(page_idx)
+                outputs = {}
+                for name, (detector, formatter) in variants.items():
+                    start = time.perf_counter()
+                    tables = detector.extract(page)
+                    formatted = [formatter.extract(t, margin='auto', padding=None) for t in tables]
+                    outputs[name] = (tables, [_cells(ft, registry.format_config) for ft in formatted])
+                    seconds[name] += time.perf_counter() - start
+
+                (ref_tables, ref_cells), (q_tables, q_cells) = outputs["fp32"], outputs["int8"]
+                n_pages += 1
+                same_count += len(ref_tables) == len(q_tables)
+                reference_tables += len(ref_tables)
+                matches = _match(ref_tables, q_tables)
+                bbox_matched += sum(1 for _, _, iou in matches if iou >= BBOX_MIN_IOU)
+                by_reference = {i: j for i, j, _ in matches}
+                for i in range(len(ref_tables)):
+                    j = by_reference.get(i)
+                    cell_scores.append(0.0 if j is None else _cell_agreement(ref_cells[i], q_cells[j]))
+        finally:
+            doc.close()
+
+    report = _model_names(*fp32)
+    report.update({
+        "documents": len(pdf_paths),
+        "pages": n_pages,
+        "tables": reference_tables,
+        "agreement": {
+            "table_count": same_count / n_pages if n_pages else 1.0,
+            "bbox": bbox_matched / reference_tables if reference_tables else 1.0,
+            "cell_text": sum(cell_scores) / len(cell_scores) if cell_scores else 1.0,
+        },
+        "seconds": seconds,
+        "min_agreement": MIN_AGREEMENT,
+    })
+    report["passed"] = all(value >= MIN_AGREEMENT for value in report["agreement"].values())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate int8 quantization against the fp32 models")
+    sub = parser.add_subparsers(dest="command", required=True)
+    evaluate_cmd = sub.add_parser("evaluate", help="Compare fp32 and int8 outputs and write the gate report")
+    evaluate_cmd.add_argument("corpus", nargs='+', help="PDF files or directories of PDFs")
+    evaluate_cmd.add_argument("--pages", type=int, default=None, help="Pages per PDF (default: all)")
+    evaluate_cmd.add_argument("--report", default=QUANTIZATION_REPORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pdf_paths = []
+    for path in args.corpus:
+        pdf_paths += sorted(glob.glob(os.path.join(path, "*.pdf"))) if os.path.isdir(path) else [path]
+    if not pdf_paths:
+        parser.error("no PDFs found in the corpus")
+
+    report = evaluate(pdf_paths, args.pages)
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    for key, value in report.items():
+        print(f"{key:>16}: {value}")
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
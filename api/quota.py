@@ -0,0 +1,81 @@
+"""
+Page quota helpers shared by the extraction endpoints.
+
+Pages are reserved when an extraction is accepted and the ones it didn't get to are
+refunded when it ends, so only processed pages count against the monthly quota.
+"""
+
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import case, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from database import AsyncSessionLocal
+from models import User
+
+
+async def has_active_promotion(db: AsyncSession, user_id: int) -> bool:
+    """True if the user has an active, unexpired promotion (unlimited processing)."""
+    result = await db.execute(
+        select(User).options(selectinload(User.user_promotions)).where(User.id == user_id)
+    )
+    user_with_promos = result.scalars().first()
+    if not user_with_promos:
+        return False
+    now = datetime.utcnow()
+    return any(promo.is_active and promo.expires_at > now for promo in user_with_promos.user_promotions)
+
+
+async def reserve_pages(db: AsyncSession, user: User, requested_pages: int | None, total_pages: int):
+    """
+    Work out how many pages the user may process right now and count them as used at once,
+    so extractions submitted together can't overrun the monthly quota between them.
+    Returns (pages_limit, has_active_promo); raises 403 when the monthly quota is used up.
+    Pages that end up not being processed are given back with refund_pages().
+    """
+    if await has_active_promotion(db, user.id):
+        return total_pages, True
+
+    wanted = min(requested_pages or total_pages, total_pages)
+    async with AsyncSessionLocal() as session:
+        while True:
+            result = await session.execute(
+                select(User.monthly_page_limit, User.pages_processed_this_month).where(User.id == user.id)
+            )
+            monthly_page_limit, pages_processed = result.one()
+            pages_left = monthly_page_limit - pages_processed
+            if pages_left <= 0:
+                raise HTTPException(
+                    status_code=403,
+                    detail=f'Monthly quota exceeded. Monthly limit is {monthly_page_limit} pages, you have processed {pages_processed} pages this month.'
+                )
+            pages_limit = min(wanted, pages_left)
+            # Only applies if nobody reserved or was charged in between; otherwise look again
+            result = await session.execute(
+                update(User)
+                .where(User.id == user.id, User.pages_processed_this_month == pages_processed)
+                .values(pages_processed_this_month=pages_processed + pages_limit)
+            )
+            await session.commit()
+            if result.rowcount == 1:
+                return pages_limit, False
+
+
+async def refund_pages(user_id: int, pages: int):
+    """Give back reserved pages that were not processed, in its own session."""
+    if pages <= 0:
+        return
+    async with AsyncSessionLocal() as db:
+        # The monthly reset may have run since the reservation; never go below zero
+        await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(pages_processed_this_month=case(
+                (User.pages_processed_this_month > pages, User.pages_processed_this_month - pages),
+                else_=0,
+            ))
+        )
+        await db.commit()
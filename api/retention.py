@@ -0,0 +1,314 @@
+"""
+Retention and garbage collection for uploads/ and outputs/.
+
+run_retention() is started from main.py's lifespan and sweeps both directories every
+RETENTION_INTERVAL_SECONDS. An artifact is one upload (a file in uploads/) or one
+extraction (a namespace directory in outputs/, deleted as a whole so a result never
+loses half its files). Each sweep, in this order:
+
+1. deletes artifacts not used for longer than the directory's TTL
+2. evicts the least recently used artifacts of every user above the per-user quota
+3. evicts the least recently used artifacts until the directory is under its quota
+
+"Used" is the latest access time of the artifact's files. Downloads set it
+explicitly (touch()), so it works on noatime mounts too. Uploads belong to the user
+of their latest PDF record. Extractions belong to the user in their OWNER_FILE,
+written by PDFTableProcessor.
+
+Artifacts pinned by a running or queued extraction (pin()/in_use()) and anything
+younger than RETENTION_MIN_AGE_SECONDS are never deleted, even over quota. Outputs are
+swept first; an upload is then kept for as long as a remaining extraction has lazy
+images (table_render sidecars) that still need it to be rendered. Pins only
+cover this process; with several API processes on one disk, the minimum age is what
+protects uploads and extractions that are about to be used.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+from metrics import RETENTION_BYTES, RETENTION_DELETED, RETENTION_DISK_BYTES
+from table_render import SIDECAR_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Same directories as main.UPLOAD_DIR / main.OUTPUT_DIR
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'outputs')
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "900"))
+MIN_AGE_SECONDS = int(os.getenv("RETENTION_MIN_AGE_SECONDS", "900"))
+# 0 disables a limit
+UPLOAD_TTL_SECONDS = float(os.getenv("UPLOAD_RETENTION_HOURS", "168")) * 3600
+OUTPUT_TTL_SECONDS = float(os.getenv("OUTPUT_RETENTION_HOURS", "72")) * 3600
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "10240")) * 1024 * 1024
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_MB", "10240")) * 1024 * 1024
+USER_UPLOAD_MAX_BYTES = int(os.getenv("USER_UPLOAD_MAX_MB", "1024")) * 1024 * 1024
+USER_OUTPUT_MAX_BYTES = int(os.getenv("USER_OUTPUT_MAX_MB", "1024")) * 1024 * 1024
+
+# Written into every extraction directory; not counted as a use of the artifact
+OWNER_FILE = ".owner"
+# Artifacts being deleted are renamed to this prefix first; scans skip them
+TOMBSTONE_PREFIX = ".deleting-"
+
+Artifact = namedtuple("Artifact", "path size last_used owner")
+
+_lock = threading.Lock()
+_pins = defaultdict(int)
+
+
+def _key(path):
+    return os.path.realpath(path)
+
+
+def pin(*paths):
+    """Protect paths from deletion until unpin(); returns the keys to pass to unpin."""
+    keys = [_key(path) for path in paths if path]
+    with _lock:
+        for key in keys:
+            _pins[key] += 1
+    return keys
+
+
+def unpin(*keys):
+    with _lock:
+        for key in keys:
+            _pins[key] -= 1
+            if _pins[key] <= 0:
+                del _pins[key]
+
+
+def is_pinned(path):
+    return _pins.get(_key(path), 0) > 0
+
+
+@contextmanager
+def in_use(*paths):
+    keys = pin(*paths)
+    try:
+        yield
+    finally:
+        unpin(*keys)
+
+
+def claim(output_dir, user_id):
+    """Create an extraction directory and record who it belongs to."""
+    os.makedirs(output_dir, exist_ok=True)
+    if user_id is not None:
+        with open(os.path.join(output_dir, OWNER_FILE), 'w', encoding='utf-8') as f:
+            f.write(str(user_id))
+
+
+def touch(path):
+    """Record a download: bump the access time (not the modification time)."""
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+def _tree_usage(path):
+    """(total bytes, last use) of a directory tree."""
+    size = 0
+    last_used = os.stat(path).st_mtime
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            if name != OWNER_FILE:
+                last_used = max(last_used, st.st_atime, st.st_mtime)
+    return size, last_used
+
+
+def _read_owner(path):
+    try:
+        with open(os.path.join(path, OWNER_FILE), encoding='utf-8') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def scan_outputs(root=OUTPUT_DIR):
+    """One Artifact per extraction directory (and per stray file) in outputs/."""
+    artifacts = []
+    for entry in os.scandir(root):
+        if entry.name.startswith(TOMBSTONE_PREFIX):
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size, last_used = _tree_usage(entry.path)
+                artifacts.append(Artifact(entry.path, size, last_used, _read_owner(entry.path)))
+            elif entry.is_file(follow_symlinks=False):
+                st = entry.stat()
+                artifacts.append(Artifact(entry.path, st.st_size, max(st.st_atime, st.st_mtime), None))
+        except FileNotFoundError:
+            continue  # deleted while scanning
+    return artifacts
+
+
+def scan_uploads(root=UPLOAD_DIR, owners=None):
+    """One Artifact per uploaded file; owners maps file name -> user id."""
+    owners = owners or {}
+    artifacts = []
+    for entry in os.scandir(root):
+        if entry.name.startswith(TOMBSTONE_PREFIX):
+            continue
+        try:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat()
+                artifacts.append(Artifact(entry.path, st.st_size, max(st.st_atime, st.st_mtime), owners.get(entry.name)))
+        except FileNotFoundError:
+            continue
+    return artifacts
+
+
+def referenced_sources(root=OUTPUT_DIR):
+    """Keys of the source PDFs that lazy-image sidecars under root still render from."""
+    sources = set()
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(SIDECAR_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(dirpath, name), encoding='utf-8') as f:
+                    sources.add(_key(json.load(f)["pdf_path"]))
+            except (OSError, ValueError, KeyError):
+                continue  # rendered (and removed) meanwhile, or unreadable
+    return sources
+
+
+def plan(artifacts, now, ttl_seconds, max_bytes, user_max_bytes, min_age=MIN_AGE_SECONDS, pinned=is_pinned):
+    """[(artifact, reason)] to delete: expired ones, then least recently used ones until the quotas hold."""
+    candidates = sorted(artifacts, key=lambda a: a.last_used)
+    doomed = {}
+
+    def removable(a):
+        return a.path not in doomed and now - a.last_used >= min_age and not pinned(a.path)
+
+    if ttl_seconds:
+        for a in candidates:
+            if now - a.last_used > ttl_seconds and removable(a):
+                doomed[a.path] = (a, "ttl")
+
+    if user_max_bytes:
+        usage = defaultdict(int)
+        for a in candidates:
+            if a.owner is not None and a.path not in doomed:
+                usage[a.owner] += a.size
+        for a in candidates:
+            if a.owner is not None and usage[a.owner] > user_max_bytes and removable(a):
+                doomed[a.path] = (a, "user_quota")
+                usage[a.owner] -= a.size
+
+    if max_bytes:
+        total = sum(a.size for a in candidates if a.path not in doomed)
+        for a in candidates:
+            if total <= max_bytes:
+                break
+            if removable(a):
+                doomed[a.path] = (a, "quota")
+                total -= a.size
+
+    return list(doomed.values())
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _delete(path):
+    """
+    Delete a file or directory unless it got pinned since the scan. Only the rename to a
+    tombstone happens under the lock, so pin() on the event loop never waits for an rmtree.
+    """
+    tombstone = os.path.join(os.path.dirname(path), f"{TOMBSTONE_PREFIX}{uuid.uuid4().hex}")
+    with _lock:
+        if _pins.get(_key(path), 0) > 0:
+            return False
+        try:
+            os.rename(path, tombstone)
+        except FileNotFoundError:
+            return True
+    _remove(tombstone)
+    return True
+
+
+def _remove_tombstones(root):
+    """Finish deletions a previous process was interrupted in."""
+    for entry in os.scandir(root):
+        if entry.name.startswith(TOMBSTONE_PREFIX):
+            _remove(entry.path)
+
+
+def _sweep(name, artifacts, ttl_seconds, max_bytes, user_max_bytes, now, pinned=is_pinned):
+    deleted = freed = 0
+    for artifact, reason in plan(artifacts, now, ttl_seconds, max_bytes, user_max_bytes, pinned=pinned):
+        if not _delete(artifact.path):
+            continue
+        deleted += 1
+        freed += artifact.size
+        RETENTION_DELETED.labels(name, reason).inc()
+        RETENTION_BYTES.labels(name, reason).inc(artifact.size)
+        logger.debug(f"Retention: deleted {artifact.path} ({reason}, {artifact.size} bytes)")
+    remaining = sum(a.size for a in artifacts) - freed
+    RETENTION_DISK_BYTES.labels(name).set(remaining)
+    return {"deleted": deleted, "freed_bytes": freed, "bytes": remaining}
+
+
+def collect(upload_owners=None, now=None):
+    """One sweep over outputs/ and uploads/; returns {directory: {"deleted", "freed_bytes", "bytes"}}."""
+    now = time.time() if now is None else now
+    for root in (OUTPUT_DIR, UPLOAD_DIR):
+        _remove_tombstones(root)
+    outputs = _sweep(
+        "outputs", scan_outputs(OUTPUT_DIR), OUTPUT_TTL_SECONDS, OUTPUT_MAX_BYTES, USER_OUTPUT_MAX_BYTES, now
+    )
+    # Only once the outputs are swept: uploads that the kept ones still render images from stay
+    needed = referenced_sources(OUTPUT_DIR)
+    uploads = _sweep(
+        "uploads", scan_uploads(UPLOAD_DIR, upload_owners), UPLOAD_TTL_SECONDS, UPLOAD_MAX_BYTES, USER_UPLOAD_MAX_BYTES,
+        now, pinned=lambda path: is_pinned(path) or _key(path) in needed,
+    )
+    return {"uploads": uploads, "outputs": outputs}
+
+
+async def upload_owners():
+    """File name -> user id of its latest upload record."""
+    from sqlalchemy.future import select
+
+    from database import AsyncSessionLocal
+    from models import PDF
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(PDF.pdf_filename, PDF.user_id).order_by(PDF.uploaded_at, PDF.id))
+        return {filename: user_id for filename, user_id in result.all()}
+
+
+async def run_retention(interval=INTERVAL_SECONDS):
+    """Background task: sweep forever, logging (not raising) failures."""
+    while True:
+        try:
+            owners = await upload_owners()
+            stats = await asyncio.to_thread(collect, owners)
+            if any(s["deleted"] for s in stats.values()):
+                logger.info(f"Retention sweep: {stats}")
+        except Exception as e:
+            logger.error(f"Retention sweep failed: {e}", exc_info=True)
+        await asyncio.sleep(interval)
@@ -0,0 +1,328 @@
+"""
+Text-layer fast path for born-digital tables drawn with ruling lines.
+
+Instead of running TATR detection and structure recognition, the ruling lines are
+read from the page's path objects (pdfium) and the cell text from its text layer.
+Every table gets a confidence score. PDFTableProcessor.detect_pages skips the gmft
+detector only when all tables on the page reach RULED_TABLE_MIN_CONFIDENCE and they
+cover the page (covers_page: nothing outside them looks like another table). Pages
+with confident tables next to borderless ones run the detector as well and keep
+both (merge); anything else falls back to the detector (no text layer, partial
+grids, merged cells, text crossing rules, ...).
+
+Coordinates follow gmft: pdf units, origin at the top left of the page.
+"""
+
+import os
+from types import SimpleNamespace
+
+# Opt-in: the first row is always the header, whatever the formatter config says (see RuledTable.df)
+FAST_PATH = os.getenv("RULED_TABLE_FAST_PATH", "false").lower() == "true"
+MIN_CONFIDENCE = float(os.getenv("RULED_TABLE_MIN_CONFIDENCE", "0.9"))
+
+# Rules closer than this (pdf units) are the same line; shorter segments are ignored
+TOLERANCE = 2.0
+MIN_RULE_LENGTH = 5.0
+# Rows/columns thinner than this are merged (double rules, thick borders drawn as rects)
+MIN_CELL_SIZE = 4.0
+
+
+def settings():
+    """Part of the extraction cache fingerprint."""
+    return {"ruled_fast_path": FAST_PATH, "ruled_min_confidence": MIN_CONFIDENCE}
+
+
+def rules(pdfium_page):
+    """Horizontal (y, x0, x1) and vertical (x, y0, y1) line segments drawn on the page."""
+    import ctypes
+    import pypdfium2.raw as pdfium_c
+
+    height = pdfium_page.get_height()
+    horizontal, vertical = [], []
+
+    def add(p, q):
+        (x0, y0), (x1, y1) = p, q
+        y0, y1 = height - y0, height - y1
+        if abs(y1 - y0) <= TOLERANCE and abs(x1 - x0) >= MIN_RULE_LENGTH:
+            horizontal.append(((y0 + y1) / 2, min(x0, x1), max(x0, x1)))
+        elif abs(x1 - x0) <= TOLERANCE and abs(y1 - y0) >= MIN_RULE_LENGTH:
+            vertical.append(((x0 + x1) / 2, min(y0, y1), max(y0, y1)))
+
+    x, y = ctypes.c_float(), ctypes.c_float()
+    # Top-level objects only; paths inside form XObjects need the form matrix as well
+    for obj in pdfium_page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH], max_depth=0):
+        matrix = obj.get_matrix()
+        start = current = None
+        for i in range(pdfium_c.FPDFPath_CountSegments(obj.raw)):
+            segment = pdfium_c.FPDFPath_GetPathSegment(obj.raw, i)
+            pdfium_c.FPDFPathSegment_GetPoint(segment, x, y)
+            point = matrix.on_point(x.value, y.value)
+            kind = pdfium_c.FPDFPathSegment_GetType(segment)
+            if kind == pdfium_c.FPDF_SEGMENT_MOVETO:
+                start = point
+            elif kind == pdfium_c.FPDF_SEGMENT_LINETO and current is not None:
+                add(current, point)
+            current = point  # curves move the pen but are never rules
+            if pdfium_c.FPDFPathSegment_GetClose(segment) and start is not None:
+                add(current, start)
+                current = start
+    return _merge_collinear(horizontal), _merge_collinear(vertical)
+
+
+def _merge_collinear(segments):
+    """Join segments on the same line whose extents touch or overlap."""
+    merged = []
+    for pos, lo, hi in sorted(segments):
+        for i, (m_pos, m_lo, m_hi) in enumerate(merged):
+            if abs(m_pos - pos) <= TOLERANCE and lo <= m_hi + TOLERANCE and hi >= m_lo - TOLERANCE:
+                merged[i] = ((m_pos + pos) / 2, min(m_lo, lo), max(m_hi, hi))
+                break
+        else:
+            merged.append((pos, lo, hi))
+    return merged
+
+
+def _cluster(positions):
+    """Distinct grid line positions, merging ones closer than MIN_CELL_SIZE."""
+    clusters = []
+    for pos in sorted(positions):
+        if clusters and pos - clusters[-1][-1] < MIN_CELL_SIZE:
+            clusters[-1].append(pos)
+        else:
+            clusters.append([pos])
+    return [sum(c) / len(c) for c in clusters]
+
+
+def _components(horizontal, vertical):
+    """Groups of rules connected through intersections: one group per candidate table."""
+    parent = list(range(len(horizontal) + len(vertical)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for hi, (y, x0, x1) in enumerate(horizontal):
+        for vi, (x, y0, y1) in enumerate(vertical):
+            if x0 - TOLERANCE <= x <= x1 + TOLERANCE and y0 - TOLERANCE <= y <= y1 + TOLERANCE:
+                parent[find(hi)] = find(len(horizontal) + vi)
+
+    groups = {}
+    for i in range(len(parent)):
+        groups.setdefault(find(i), []).append(i)
+    for members in groups.values():
+        yield (
+            [horizontal[i] for i in members if i < len(horizontal)],
+            [vertical[i - len(horizontal)] for i in members if i >= len(horizontal)],
+        )
+
+
+def _covered(rules, pos, at):
+    return any(abs(r_pos - pos) <= TOLERANCE and lo - TOLERANCE <= at <= hi + TOLERANCE for r_pos, lo, hi in rules)
+
+
+def _grid_table(hs, vs, words):
+    ys, xs = _cluster(r[0] for r in hs), _cluster(r[0] for r in vs)
+    if len(ys) < 3 or len(xs) < 3:
+        return None  # need at least 2 rows and 2 columns
+    n_rows, n_cols = len(ys) - 1, len(xs) - 1
+
+    # Share of the cell edges that are actually drawn (merged cells and open grids lower it)
+    edges = [_covered(hs, y, (xs[j] + xs[j + 1]) / 2) for y in ys for j in range(n_cols)]
+    edges += [_covered(vs, x, (ys[i] + ys[i + 1]) / 2) for x in xs for i in range(n_rows)]
+    completeness = sum(edges) / len(edges)
+
+    # Words near the grid: inside it, or under rules that run past the outer columns/rows
+    bbox = (xs[0], ys[0], xs[-1], ys[-1])
+    extent = (
+        min([xs[0]] + [r[1] for r in hs]), min([ys[0]] + [r[1] for r in vs]),
+        max([xs[-1]] + [r[2] for r in hs]), max([ys[-1]] + [r[2] for r in vs]),
+    )
+    cells = [[[] for _ in range(n_cols)] for _ in range(n_rows)]
+    nearby = fitted = 0
+    for x0, y0, x1, y1, text in words:
+        cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+        if not (extent[0] <= cx <= extent[2] and extent[1] <= cy <= extent[3]):
+            continue
+        nearby += 1
+        if not (bbox[0] <= cx <= bbox[2] and bbox[1] <= cy <= bbox[3]):
+            continue  # outside the grid but under its rules: a column or row we can't see
+        crosses = any(x0 + TOLERANCE < x < x1 - TOLERANCE and _covered(vs, x, cy) for x in xs) or \
+            any(y0 + TOLERANCE < y < y1 - TOLERANCE and _covered(hs, y, cx) for y in ys)
+        if crosses:
+            continue
+        fitted += 1
+        row = next(i for i in range(n_rows) if cy <= ys[i + 1])
+        col = next(j for j in range(n_cols) if cx <= xs[j + 1])
+        cells[row][col].append((y0, x0, text))
+    if not nearby:
+        return None  # no text layer here (scanned page, drawing, empty frame)
+
+    cells = [[" ".join(text for _, _, text in sorted(cell)) for cell in row] for row in cells]
+    filled = sum(1 for row in cells for cell in row if cell) / (n_rows * n_cols)
+    confidence = completeness * (fitted / nearby) * (1.0 if filled >= 0.25 else 0.5)
+    return {
+        "bbox": bbox,
+        "rows": ys,
+        "cols": xs,
+        "cells": cells,
+        "confidence_score": round(confidence, 3),
+    }
+
+
+def find_ruled_tables(pdfium_page, words, page_rules=None):
+    """
+    Ruled tables on a pypdfium2 page as dicts (bbox, rows, cols, cells, confidence_score).
+    words are (x0, y0, x1, y1, text) with a top-left origin, e.g. gmft's get_positions_and_text().
+    page_rules is rules(pdfium_page) if the caller already has it.
+    """
+    words = list(words)
+    if not words:
+        return []
+    horizontal, vertical = page_rules or rules(pdfium_page)
+    tables = []
+    for hs, vs in _components(horizontal, vertical):
+        table = _grid_table(hs, vs, words)
+        if table is not None:
+            tables.append(table)
+    tables.sort(key=lambda t: (t["bbox"][1], t["bbox"][0]))
+    return tables
+
+
+class RuledTable:
+    """
+    A table read from ruling lines. Stands in for both the gmft CroppedTable (detection)
+    and the TATRFormattedTable (df(), visualize(), to_dict()) it would have produced.
+    """
+
+    label = 0
+    angle = 0
+
+    def __init__(self, page, bbox, rows, cols, cells, confidence_score):
+        self.page = page
+        self.bbox = tuple(bbox)
+        self.rows = list(rows)
+        self.cols = list(cols)
+        self.cells = cells
+        self.confidence_score = confidence_score
+
+    @property
+    def predictions(self):
+        """TATR-shaped row/column boxes relative to the table, for table_render.render_pil."""
+        x0, y0, x1, y1 = self.bbox
+        boxes = [(0, 0, x1 - x0, y1 - y0)]
+        labels = [0]
+        for top, bottom in zip(self.rows, self.rows[1:]):
+            boxes.append((0, top - y0, x1 - x0, bottom - y0))
+            labels.append(2)  # table row
+        for left, right in zip(self.cols, self.cols[1:]):
+            boxes.append((left - x0, 0, right - x0, y1 - y0))
+            labels.append(1)  # table column
+        return SimpleNamespace(tatr={"boxes": boxes, "labels": labels, "scores": [self.confidence_score] * len(boxes)})
+
+    def image(self, dpi=None, padding=None, margin=None):
+        from gmft.base import Rect
+
+        x0, y0, x1, y1 = self.bbox
+        if margin is not None:
+            x0, y0, x1, y1 = x0 - margin[0], y0 - margin[1], x1 + margin[2], y1 + margin[3]
+        return self.page.get_image(dpi=dpi or 72, rect=Rect((x0, y0, x1, y1)))
+
+    def visualize(self):
+        from table_render import render_pil
+
+        return render_pil(self)
+
+    def df(self, config_overrides=None):
+        """
+        First row as the header, like a single-header TATR table. config_overrides is
+        accepted for interface compatibility only; there are no header predictions to apply it to.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.cells[1:], columns=self.cells[0])
+
+    def to_dict(self):
+        return {
+            "ruled": True,
+            "page_no": self.page.page_number,
+            "bbox": list(self.bbox),
+            "rows": self.rows,
+            "cols": self.cols,
+            "cells": self.cells,
+            "confidence_score": self.confidence_score,
+        }
+
+    @staticmethod
+    def from_dict(d, page):
+        return RuledTable(page, d["bbox"], d["rows"], d["cols"], d["cells"], d["confidence_score"])
+
+
+def detect(page, words=None, page_rules=None):
+    """RuledTables on a gmft page (PyPDFium2Page); empty when there is no text layer."""
+    words = page.get_positions_and_text() if words is None else words
+    return [RuledTable(page, **table) for table in find_ruled_tables(page.page, words, page_rules)]
+
+
+def _bbox(table):
+    """bbox of a RuledTable or a gmft CroppedTable."""
+    return table.bbox if isinstance(table, RuledTable) else table.rect.bbox
+
+
+def _inside(bbox, x0, y0, x1, y1):
+    bx0, by0, bx1, by1 = bbox
+    return (x0 >= bx0 - TOLERANCE and y0 >= by0 - TOLERANCE
+            and x1 <= bx1 + TOLERANCE and y1 <= by1 + TOLERANCE)
+
+
+def covers_page(pdfium_page, tables, words, page_rules=None):
+    """
+    True if the tables account for the page: the words and rules outside all of them
+    show no table signal at all (page_filter.table_score of 0), i.e. at most prose, a
+    heading and a header/footer rule or two.
+    """
+    from page_filter import page_features, table_score
+
+    bboxes = [_bbox(t) for t in tables]
+    horizontal, vertical = page_rules or rules(pdfium_page)
+    loose_words = [
+        w for w in words if w[4].strip()
+        and not any(_inside(b, (w[0] + w[2]) / 2, (w[1] + w[3]) / 2, (w[0] + w[2]) / 2, (w[1] + w[3]) / 2) for b in bboxes)
+    ]
+    loose_rules = (
+        [(y, x0, x1) for y, x0, x1 in horizontal if not any(_inside(b, x0, y, x1, y) for b in bboxes)],
+        [(x, y0, y1) for x, y0, y1 in vertical if not any(_inside(b, x, y0, x, y1) for b in bboxes)],
+    )
+    if not loose_words:
+        return len(loose_rules[0]) + len(loose_rules[1]) <= 2
+    return table_score(page_features(pdfium_page, loose_words, loose_rules)) == 0
+
+
+def merge(ruled, detected, min_overlap=0.5):
+    """
+    The ruled tables plus the detector's tables that are not one of them (overlapping
+    a ruled table by less than min_overlap of the smaller area), in reading order.
+    """
+    def area(b):
+        return max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+
+    def overlap(a, b):
+        inter = area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+        return inter / (min(area(a), area(b)) or 1.0)
+
+    kept = list(ruled) + [
+        t for t in detected
+        if all(overlap(_bbox(t), r.bbox) < min_overlap for r in ruled)
+    ]
+    kept.sort(key=lambda t: (_bbox(t)[1], _bbox(t)[0]))
+    return kept
+
+
+def table_from_dict(d, page):
+    """Inverse of to_dict() for both detection kinds (ruled or gmft CroppedTable)."""
+    if d.get("ruled"):
+        return RuledTable.from_dict(d, page)
+    from gmft.detectors.base import CroppedTable
+
+    return CroppedTable.from_dict(d, page)
@@ -0,0 +1,118 @@
+"""
+Per-stage timers for the extraction pipeline.
+
+PDFTableProcessor wraps each step (pdfium rendering, TATR detection, structure
+recognition, ft.df(), visualize(), JSON/CSV/PNG writing, cache access) in
+`timings.stage(...)`. Totals are kept per document and per table. When a document is
+finished the summary is handed to the registered metrics sinks (see add_sink).
+"""
+
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Sample process RSS after every stage to report the peak (costs a syscall per stage)
+SAMPLE_MEMORY = os.getenv("EXTRACTION_SAMPLE_MEMORY", "false").lower() == "true"
+
+_sinks = []
+
+
+def add_sink(sink):
+    """Register a callable that receives every finished document summary."""
+    _sinks.append(sink)
+
+
+def emit(summary):
+    logger.debug(f"Extraction timings: {summary}")
+    for sink in _sinks:
+        try:
+            sink(summary)
+        except Exception as e:
+            logger.warning(f"Timing sink {sink!r} failed: {e}")
+
+
+def _current_rss():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class StageTimings:
+    def __init__(self, sample_memory: bool = SAMPLE_MEMORY):
+        self.sample_memory = sample_memory
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.tables = defaultdict(lambda: defaultdict(float))
+        self.events = defaultdict(int)
+        self.peak_rss = None
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, table=None):
+        """Time a block; table=(page_index, table_index) also records it against that table."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, table)
+
+    def add(self, name, seconds, table=None):
+        self.totals[name] += seconds
+        self.counts[name] += 1
+        if table is not None:
+            self.tables[f"page_{table[0]}_table_{table[1]}"][name] += seconds
+        if self.sample_memory:
+            rss = _current_rss()
+            if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+                self.peak_rss = rss
+
+    def count(self, name, n=1):
+        """Count an untimed event (pages done, cache hits, ...)."""
+        self.events[name] += n
+
+    def merge(self, other: dict):
+        """Fold in a to_dict() snapshot, e.g. from a worker process."""
+        for name, seconds in other["totals"].items():
+            self.totals[name] += seconds
+        for name, count in other["counts"].items():
+            self.counts[name] += count
+        for key, stages in other["tables"].items():
+            for name, seconds in stages.items():
+                self.tables[key][name] += seconds
+        for name, n in other.get("events", {}).items():
+            self.events[name] += n
+        if other.get("peak_rss") is not None:
+            self.peak_rss = max(self.peak_rss or 0, other["peak_rss"])
+
+    def to_dict(self):
+        return {
+            "totals": dict(self.totals),
+            "counts": dict(self.counts),
+            "tables": {key: dict(stages) for key, stages in self.tables.items()},
+            "events": dict(self.events),
+            "peak_rss": self.peak_rss,
+        }
+
+    def summary(self):
+        """Rounded, JSON-friendly view used in /process?debug=true and by the sinks."""
+        summary = {
+            "wall_seconds": round(time.perf_counter() - self.started, 4),
+            "stages": {
+                name: {"seconds": round(seconds, 4), "count": self.counts[name]}
+                for name, seconds in sorted(self.totals.items(), key=lambda item: -item[1])
+            },
+            "tables": {
+                key: {name: round(seconds, 4) for name, seconds in stages.items()}
+                for key, stages in self.tables.items()
+            },
+            "events": dict(self.events),
+        }
+        if self.peak_rss is not None:
+            summary["peak_rss_mb"] = round(self.peak_rss / (1024 * 1024), 1)
+        return summary
@@ -1,136 +1,423 @@
-import importlib
-import gmft
-import gmft.table_detection
-import gmft.table_visualization
-import gmft.table_function
-import gmft.table_function_algorithm
-import gmft.table_captioning
-import gmft.pdf_bindings.bindings_pdfium
-import gmft.pdf_bindings
-import gmft.common
-import matplotlib.pyplot as plt
 import os
+import io
 import json
-from gmft import AutoTableFormatter
-from gmft.detectors.tatr import TATRDetector
-from gmft.formatters.common import FormattedTable, TableFormatter
-from gmft.table_visualization import display_html_and_image
-from gmft.auto import AutoFormatConfig
-
-from gmft.pdf_bindings import PyPDFium2Document
-from gmft.auto import CroppedTable, AutoTableDetector
+import base64
+import uuid
 from PIL import Image
+import batch_inference
+import page_filter
+import retention
+import ruled_tables
+import table_render
+from extraction_cache import ExtractionCache, file_sha256, get_cache
+from model_registry import registry
+from stage_timings import StageTimings, emit as emit_timings
+from metrics import EXTRACTIONS_IN_FLIGHT
 
-importlib.reload(gmft)
-importlib.reload(gmft.common)
-importlib.reload(gmft.table_captioning)
-importlib.reload(gmft.table_detection)
-importlib.reload(gmft.table_visualization)
-importlib.reload(gmft.table_function)
-importlib.reload(gmft.table_function_algorithm)
-importlib.reload(gmft.pdf_bindings.bindings_pdfium)
-importlib.reload(gmft.pdf_bindings)
+# gmft, torch and the model weights are loaded lazily through model_registry, so
+# importing this module is cheap; see registry.load() / registry.warm_up().
 
+# Pages/tables per TATR forward pass; 1 uses gmft's own detector/formatter.extract
+DEFAULT_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "1"))
 
-detector = AutoTableDetector()
-config_hdr = AutoFormatConfig(enable_multi_header=True) # config may be passed like so
-config_hdr.verbosity = 3
-config_hdr.enable_multi_header = True
-config_hdr.semantic_spanning_cells = True 
-formatter = AutoTableFormatter(config_hdr)
+# Same directory as main.OUTPUT_DIR; every extraction writes into its own subdirectory
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'outputs')
 
 
+def output_name(path):
+    """Path of an output file relative to OUTPUT_DIR, as used by GET /download/{filename}."""
+    return os.path.relpath(path, OUTPUT_DIR).replace(os.sep, '/')
+
 
 class PDFTableProcessor:
-    def __init__(self, pdf_path):
+    def __init__(self, pdf_path, batch_size: int | None = None, content_hash: str | None = None,
+                 output_dir: str | None = None, user_id: int | None = None, text_pages: list[bool] | None = None):
         self.pdf_path = pdf_path
-        self.config_hdr = config_hdr
-        # ingest_pdf now returns per-page tables and the document
-        self.per_page_tables, self.doc = self.ingest_pdf(pdf_path)
-        # total pages and total tables
-        self.total_pages = len(self.per_page_tables)
-        self.total_tables = sum(len(p) for p in self.per_page_tables)
+        # Owner of the output directory, for the per-user retention quota
+        self.user_id = user_id
+        # Own namespace under OUTPUT_DIR so concurrent extractions never overwrite each other
+        self.output_dir = output_dir or os.path.join(OUTPUT_DIR, uuid.uuid4().hex)
+        self.config_hdr = registry.format_config
+        self.batch_size = DEFAULT_BATCH_SIZE if batch_size is None else batch_size
+        # Opening the document only reads metadata; tables are detected per page on demand
+        from gmft.pdf_bindings import PyPDFium2Document
+        self.doc = PyPDFium2Document(pdf_path)
+        self.total_pages = len(self.doc)
+        # page_index -> list of CroppedTable, filled lazily by get_page_tables
+        self.per_page_tables = {}
+        # (page_index, table_index) -> FormattedTable produced ahead of time by format_pages
+        self.formatted_tables = {}
+        self.cache = get_cache()
+        self._content_hash = content_hash
+        # Whether each page has a text layer, from the upload probe (None: not known)
+        self.text_pages = text_pages
+        # Per-stage timings for this document (see stage_timings.py)
+        self.timings = StageTimings()
+
+    @property
+    def content_hash(self):
+        """SHA-256 of the PDF bytes, computed on first use unless it was passed in."""
+        if self._content_hash is None:
+            self._content_hash = file_sha256(self.pdf_path)
+        return self._content_hash
+
+    def _load_cached_detections(self, page_index):
+        if self.cache is None:
+            return None
+        key = ExtractionCache.detections_key(self.content_hash, registry.config_fingerprint, page_index)
+        with self.timings.stage("cache_read"):
+            cached = self.cache.get(key)
+        if cached is None:
+            self.timings.count("cache_miss_detections")
+            return None
+        self.timings.count("cache_hit_detections")
+        page = self.doc.get_page(page_index)
+        return [ruled_tables.table_from_dict(d, page) for d in cached]
+
+    def _store_detections(self, page_index, page_tables):
+        if self.cache is not None:
+            key = ExtractionCache.detections_key(self.content_hash, registry.config_fingerprint, page_index)
+            with self.timings.stage("cache_write"):
+                self.cache.put(key, [t.to_dict() for t in page_tables])
+
+    @property
+    def total_tables(self):
+        """Number of tables found on the pages detected so far."""
+        return sum(len(p) for p in self.per_page_tables.values())
+
+    def get_page_tables(self, page_index):
+        """
+        Detect the tables of a single page, running the detector only the first time
+        the page is requested.
+        """
+        return self.detect_pages([page_index])[0]
+
+    def detect_pages(self, page_indices):
+        """
+        Detect tables on several pages at once, batching pages that are not memoized yet.
+        Pages the pre-filter rules out, and pages whose ruled tables are all read
+        confidently from the text layer and cover the page, skip the model. Confident
+        ruled tables that leave other table-like content run the model too and are merged.
+        """
+        missing = []
+        for page_idx in page_indices:
+            if page_idx in self.per_page_tables:
+                continue
+            cached = self._load_cached_detections(page_idx)
+            if cached is None:
+                missing.append(page_idx)
+            else:
+                self.per_page_tables[page_idx] = cached
+        # Words and ruling lines are read once per page for both the prefilter and the fast path
+        layouts = {}
+        partial = {}  # page index -> confident ruled tables that don't cover the page
+        if missing and page_filter.PAGE_FILTER:
+            missing = [page_idx for page_idx in missing if self._prefilter(page_idx, layouts)]
+        if missing and ruled_tables.FAST_PATH:
+            # The fast path reads cells from the text layer, so scanned pages go straight to the model
+            missing = [
+                page_idx for page_idx in missing
+                if not (self._has_text_layer(page_idx) and self._detect_ruled(page_idx, layouts, partial))
+            ]
+        layouts.clear()
+        if missing:
+            pages = [self.doc.get_page(i) for i in missing]
+            for page_idx, page_tables in zip(missing, batch_inference.detect_pages(registry.detector, pages, self.batch_size, self.timings)):
+                if page_idx in partial:
+                    page_tables = ruled_tables.merge(partial[page_idx], page_tables)
+                self.per_page_tables[page_idx] = page_tables
+                self._store_detections(page_idx, page_tables)
+        return [self.per_page_tables[i] for i in page_indices]
+
+    def _has_text_layer(self, page_index):
+        return self.text_pages is None or page_index >= len(self.text_pages) or self.text_pages[page_index]
 
-    def ingest_pdf(self, pdf_path):
-        doc = PyPDFium2Document(pdf_path)
+    def _page_layout(self, page_index, layouts):
+        """(page, words, ruling lines) of a page, memoized in layouts."""
+        if page_index not in layouts:
+            page = self.doc.get_page(page_index)
+            layouts[page_index] = (page, list(page.get_positions_and_text()), ruled_tables.rules(page.page))
+        return layouts[page_index]
 
-        per_page = []
-        for page in doc:
-            # detector.extract returns a list of tables for the page
-            page_tables = detector.extract(page)
-            per_page.append(page_tables)
+    def _prefilter(self, page_index, layouts):
+        """False (and no tables recorded) if the page cannot contain a table."""
+        with self.timings.stage("prefilter"):
+            # Pages without a text layer always go to detection; no need to read their words and lines
+            inspect = not self._has_text_layer(page_index)
+            if not inspect:
+                page, words, page_rules = self._page_layout(page_index, layouts)
+                inspect = page_filter.may_contain_table(page, words=words, page_rules=page_rules)
+        if inspect:
+            self.timings.count("prefilter_inspected")
+            return True
+        self.timings.count("prefilter_skipped")
+        self.per_page_tables[page_index] = []
+        self._store_detections(page_index, [])
+        return False
+
+    def _detect_ruled(self, page_index, layouts, partial):
+        """
+        Try the text-layer fast path on one page; True if its result was kept. Confident
+        tables that don't cover the page go into partial, to be merged with the model's.
+        """
+        with self.timings.stage("ruled_detection"):
+            page, words, page_rules = self._page_layout(page_index, layouts)
+            page_tables = ruled_tables.detect(page, words, page_rules)
+            confident = page_tables and min(t.confidence_score for t in page_tables) >= ruled_tables.MIN_CONFIDENCE
+            covered = confident and ruled_tables.covers_page(page.page, page_tables, words, page_rules)
+        if not confident:
+            self.timings.count("ruled_fallback_pages")
+            return False
+        if not covered:
+            self.timings.count("ruled_partial_pages")
+            partial[page_index] = page_tables
+            return False
+        self.timings.count("ruled_pages")
+        self.per_page_tables[page_index] = page_tables
+        self._store_detections(page_index, page_tables)
+        return True
+
+    def _format_table(self, table_obj, table=None):
+        """Structure recognition for one table; ruled fast-path tables are already formatted."""
+        if isinstance(table_obj, ruled_tables.RuledTable):
+            return table_obj
+        return batch_inference.format_tables(
+            registry.formatter, [table_obj], 1, margin='auto', padding=None,
+            timings=self.timings, keys=[table] if table is not None else None,
+        )[0]
+
+    def format_pages(self, page_indices):
+        """Run structure recognition for every table on the given pages in batches."""
+        keys = [
+            (page_idx, tbl_idx)
+            for page_idx, tables_on_page in zip(page_indices, self.detect_pages(page_indices))
+            for tbl_idx in range(len(tables_on_page))
+            if (page_idx, tbl_idx) not in self.formatted_tables
+            and not isinstance(tables_on_page[tbl_idx], ruled_tables.RuledTable)
+            and not self._has_cached_table(page_idx, tbl_idx)
+        ]
+        tables = [self.per_page_tables[p][t] for p, t in keys]
+        formatted = batch_inference.format_tables(
+            registry.formatter, tables, self.batch_size, margin='auto', padding=None,
+            timings=self.timings, keys=keys,
+        )
+        for key, ft in zip(keys, formatted):
+            self.formatted_tables[key] = ft
 
-        return per_page, doc
+    def ingest_pdf(self, pages_limit: int | None = None):
+        """Eagerly detect tables on the first pages_limit pages (all pages by default)."""
+        max_pages = self.total_pages if pages_limit is None else min(self.total_pages, pages_limit)
+        return self.detect_pages(list(range(max_pages)))
 
-    def tablo_sayisi(self, input_path):
-        per_page, doc = self.ingest_pdf(input_path)
-        return sum(len(p) for p in per_page)
+    def tablo_sayisi(self, pages_limit: int | None = None):
+        return sum(len(p) for p in self.ingest_pdf(pages_limit))
 
-    def save_as_json(self,df, output_dir, table_index):
+    def save_as_json(self,df, output_dir, table_index, table=None):
         """DataFrame'i JSON formatında kaydeder."""
-        # main.py'deki OUTPUT_DIR değişkenini kullan
-        real_output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs')
-        json_output = df.to_json(orient='records', force_ascii=False)
-        os.makedirs(real_output_dir, exist_ok=True)
-        output_file = os.path.join(real_output_dir, f'output_{table_index}.json')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(json.loads(json_output), f, ensure_ascii=False, indent=4)
+        with self.timings.stage("json_write", table):
+            json_output = df.to_json(orient='records', force_ascii=False)
+            os.makedirs(output_dir, exist_ok=True)
+            output_file = os.path.join(output_dir, f'output_{table_index}.json')
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(json.loads(json_output), f, ensure_ascii=False, indent=4)
         print(f"JSON dosyası {output_file} olarak kaydedildi.")
         return output_file
 
-    def save_as_csv(self,df, output_dir, table_index):
+    def save_as_csv(self,df, output_dir, table_index, table=None):
         """DataFrame'i CSV formatında kaydeder."""
-        # main.py'deki OUTPUT_DIR değişkenini kullan
-        real_output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs')
-        os.makedirs(real_output_dir, exist_ok=True)
-        output_file = os.path.join(real_output_dir, f'output_{table_index}.csv')
-        df.to_csv(output_file, index=False, encoding='utf-8-sig')
+        with self.timings.stage("csv_write", table):
+            os.makedirs(output_dir, exist_ok=True)
+            output_file = os.path.join(output_dir, f'output_{table_index}.csv')
+            df.to_csv(output_file, index=False, encoding='utf-8-sig')
         print(f"CSV dosyası {output_file} olarak kaydedildi.")
         return output_file
 
-    def process_single_table(self, page_index, table_index_in_page, output_format='json'):
+    def _has_cached_table(self, page_index, table_index_in_page):
+        if self.cache is None:
+            return False
+        key = ExtractionCache.table_key(self.content_hash, registry.config_fingerprint, page_index, table_index_in_page)
+        return self.cache.contains(key)
+
+    def table_result(self, page_index, table_index_in_page, render_image=True):
+        """
+        Return (df, image, state) for a table, from the cache when this PDF was already
+        processed with the same configuration, otherwise by running the formatter.
+        image is None unless render_image; state is the serialized formatted table
+        (table_render.table_state) that lets the image be rendered later.
+        """
+        table = (page_index, table_index_in_page)
+        key = None
+        if self.cache is not None:
+            key = ExtractionCache.table_key(self.content_hash, registry.config_fingerprint, page_index, table_index_in_page)
+            with self.timings.stage("cache_read", table):
+                cached = self.cache.get(key)
+                if cached is not None:
+                    import pandas as pd
+                    df = pd.DataFrame(cached["data"], columns=cached["columns"])
+                    image = None
+                    if render_image and cached.get("renderer") == table_render.IMAGE_RENDERER:
+                        image = Image.open(io.BytesIO(base64.b64decode(cached["image"])))
+            if cached is not None:
+                self.timings.count("cache_hit_tables")
+                if render_image and image is None:
+                    ft = table_render.restore_table(cached["table"], self.doc.get_page(page_index))
+                    image = self._render(ft, table)
+                    self._cache_table(key, df, cached["table"], image, table)
+                return df, image, cached["table"]
+            self.timings.count("cache_miss_tables")
+
+        ft = self.formatted_tables.pop(table, None)
+        if ft is None:
+            ft = self._format_table(self.get_page_tables(page_index)[table_index_in_page], table)
+        image = self._render(ft, table) if render_image else None
+
+        with self.timings.stage("dataframe", table):
+            df = ft.df(config_overrides=self.config_hdr).fillna("")
+            df.columns = [
+                f"{col}_{i}" if df.columns.tolist().count(col) > 1 else col 
+                for i, col in enumerate(df.columns)
+            ]
+        state = table_render.table_state(ft)
+
+        if key is not None:
+            self._cache_table(key, df, state, image, table)
+        return df, image, state
+
+    def _render(self, ft, table):
+        with self.timings.stage("visualize", table):
+            return table_render.render(ft)
+
+    def _cache_table(self, key, df, state, image, table):
+        with self.timings.stage("cache_write", table):
+            split = json.loads(df.to_json(orient='split', force_ascii=False))
+            entry = {"columns": split["columns"], "data": split["data"], "table": state}
+            if image is not None:
+                png = io.BytesIO()
+                image.save(png, format='PNG')
+                entry["image"] = base64.b64encode(png.getvalue()).decode('ascii')
+                entry["renderer"] = table_render.IMAGE_RENDERER
+            self.cache.put(key, entry)
+
+    def process_single_table(self, page_index, table_index_in_page, output_format='json', images=None):
         """
         Process a single table identified by its page and index within the page.
+        images is "eager", "lazy" or "none" (default EXTRACTION_IMAGES), see table_render;
+        with "none" the image path in the returned tuple is None.
         """
-        table_obj = self.per_page_tables[page_index][table_index_in_page]
-        ft = formatter.extract(table_obj, margin='auto', padding=None)
-        image = ft.visualize()
-        # main.py'deki OUTPUT_DIR değişkenini kullan
-        output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs')
+        images = images or table_render.IMAGE_MODE
+        if images not in table_render.IMAGE_MODES:
+            raise ValueError(f"Invalid images mode {images!r}. Should be one of {table_render.IMAGE_MODES}.")
+        df, image, state = self.table_result(page_index, table_index_in_page, render_image=images == "eager")
+        output_dir = self.output_dir
         os.makedirs(output_dir, exist_ok=True)
         image_output_path = os.path.join(output_dir, f'page_{page_index}_table_{table_index_in_page}.png')
-        image.save(image_output_path)
-
-        df = ft.df(config_overrides=config_hdr).fillna("")
-        df.columns = [
-            f"{col}_{i}" if df.columns.tolist().count(col) > 1 else col 
-            for i, col in enumerate(df.columns)
-        ]
+        table = (page_index, table_index_in_page)
+        with self.timings.stage("image_write", table):
+            if images == "eager":
+                image.save(image_output_path)
+            elif images == "lazy":
+                table_render.write_sidecar(image_output_path, self.pdf_path, page_index, state, self.content_hash)
+            else:
+                image_output_path = None
 
         if output_format == 'json':
-            json_file = self.save_as_json(df, output_dir, f'page_{page_index}_table_{table_index_in_page}')
+            json_file = self.save_as_json(df, output_dir, f'page_{page_index}_table_{table_index_in_page}', table)
             return json_file, image_output_path
         elif output_format == 'csv':
-            csv_file = self.save_as_csv(df, output_dir, f'page_{page_index}_table_{table_index_in_page}')
+            csv_file = self.save_as_csv(df, output_dir, f'page_{page_index}_table_{table_index_in_page}', table)
             return csv_file, image_output_path
         elif output_format == 'both':
-            json_file = self.save_as_json(df, output_dir, f'page_{page_index}_table_{table_index_in_page}')
-            csv_file = self.save_as_csv(df, output_dir, f'page_{page_index}_table_{table_index_in_page}')
+            json_file = self.save_as_json(df, output_dir, f'page_{page_index}_table_{table_index_in_page}', table)
+            csv_file = self.save_as_csv(df, output_dir, f'page_{page_index}_table_{table_index_in_page}', table)
             return json_file, csv_file, image_output_path
         else:
             raise ValueError("Invalid output_format. Should be 'json', 'csv' or 'both'.")
 
-    def process_tables(self, output_format='json', pages_limit: int | None = None):
+    def format_single_table(self, table_obj):
+        """Format a detected table in memory and return its rows, header row first."""
+        ft = self._format_table(table_obj)
+        with self.timings.stage("dataframe"):
+            df = ft.df(config_overrides=self.config_hdr).fillna("")
+        return [df.columns.tolist()] + df.values.tolist()
+
+    def process_tables(self, output_format='json', pages_limit: int | None = None, pool=None, on_page_done=None,
+                       images=None, page_indices=None, cancel=None):
         """
         Iterate over tables page by page, honoring an optional pages_limit which limits how many pages to process.
+        page_indices (0-based, ascending) selects arbitrary pages instead of the first pages_limit ones.
         Yields the same tuple shapes as before depending on output_format.
+        on_page_done(page_idx, tables_on_page), if given, is called once each page is finished.
+        images selects eager, lazy or no image rendering (see table_render).
+        cancel (a cancellation.CancelToken) is checked before every page and table; once it is
+        cancelled the iteration just stops, so the caller keeps what was yielded so far.
+
+        If an ExtractionPool is given (or EXTRACTION_WORKERS > 1), pages are detected and
+        formatted in worker processes; results still come back in page order.
         """
-        max_pages = self.total_pages if pages_limit is None else min(self.total_pages, pages_limit)
-        for page_idx in range(max_pages):
-            tables_on_page = self.per_page_tables[page_idx]
-            for tbl_idx in range(len(tables_on_page)):
-                yield self.process_single_table(page_idx, tbl_idx, output_format)
+        if page_indices is None:
+            max_pages = self.total_pages if pages_limit is None else min(self.total_pages, pages_limit)
+            page_indices = range(max_pages)
+        else:
+            page_indices = [p for p in page_indices if 0 <= p < self.total_pages]
+        if pool is None:
+            from extraction_pool import get_default_pool
+            pool = get_default_pool()
+
+        def cancelled():
+            return cancel is not None and cancel.cancelled
+
+        retention.claim(self.output_dir, self.user_id)
+        # Neither the PDF nor the outputs may be garbage collected while we work on them
+        pins = retention.pin(self.pdf_path, self.output_dir)
+        EXTRACTIONS_IN_FLIGHT.inc()
+        try:
+            if pool is None:
+                # Work through batch_size pages at a time: batched detection, then batched
+                # structure recognition for all their tables, then per-table output
+                step = max(1, self.batch_size)
+                for start in range(0, len(page_indices), step):
+                    window = list(page_indices[start:start + step])
+                    if cancelled():
+                        return
+                    if self.batch_size > 1:
+                        self.format_pages(window)
+                    for page_idx in window:
+                        if cancelled():
+                            return
+                        tables_on_page = self.get_page_tables(page_idx)
+                        for tbl_idx in range(len(tables_on_page)):
+                            if cancelled():
+                                return
+                            yield self.process_single_table(page_idx, tbl_idx, output_format, images)
+                            self.timings.count("tables")
+                        self.timings.count("pages")
+                        if on_page_done is not None:
+                            on_page_done(page_idx, len(tables_on_page))
+                return
 
+            # Closing iter_pages early cancels the pages the workers haven't started
+            pages = pool.iter_pages(self.pdf_path, page_indices, output_format, images, self.output_dir,
+                                    self.content_hash, self.text_pages)
+            for page_idx, detections, results, timings in pages:
+                if cancelled():
+                    return
+                # Keep the parent's view of the document in sync so total_tables stays correct
+                if page_idx not in self.per_page_tables:
+                    page = self.doc.get_page(page_idx)
+                    self.per_page_tables[page_idx] = [ruled_tables.table_from_dict(d, page) for d in detections]
+                self.timings.merge(timings)
+                for result in results:
+                    if cancelled():
+                        return
+                    yield result
+                    self.timings.count("tables")
+                self.timings.count("pages")
+                if on_page_done is not None:
+                    on_page_done(page_idx, len(detections))
+        finally:
+            EXTRACTIONS_IN_FLIGHT.dec()
+            retention.unpin(*pins)
+            emit_timings(self.timings.summary())
 
 if __name__ == "__main__":
     pdf_path = input("Lütfen PDF dosyasının tam yolunu girin: ")
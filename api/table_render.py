@@ -0,0 +1,146 @@
+"""
+Table overlay images (the page_{p}_table_{t}.png files).
+
+Rendering is optional per request (see PDFTableProcessor.process_single_table):
+
+- "eager": render and save the PNG during extraction (the default)
+- "lazy":  save a small .render.json sidecar instead; the PNG is rendered on the
+           first GET /download of the image and then kept on disk
+- "none":  no image at all
+
+Two renderers are available: gmft's matplotlib `visualize()` and a PIL overlay that
+draws the same structure boxes straight onto the table crop, which is much cheaper.
+"""
+
+import json
+import os
+import tempfile
+
+IMAGE_MODES = ("eager", "lazy", "none")
+# Eager keeps /process and /stream output as it was; lazy is opt-in per server or request
+IMAGE_MODE = os.getenv("EXTRACTION_IMAGES", "eager")
+IMAGE_RENDERER = os.getenv("EXTRACTION_IMAGE_RENDERER", "matplotlib")  # matplotlib or pil
+
+# Same colours as gmft.table_visualization, indexed by TATR structure label
+_COLORS = {-1: "red", 0: "red", 1: "blue", 2: "green", 3: "yellow", 4: "orange", 5: "violet"}
+
+
+def _tatr_results(ft):
+    predictions = getattr(ft, "predictions", None)
+    return predictions.tatr if predictions is not None else ft.fctn_results
+
+
+def render_pil(ft, dpi=144, margin=(10, 10, 10, 10), linewidth=2):
+    """Draw the structure recognition boxes on the table crop with PIL."""
+    from PIL import ImageDraw
+
+    img = ft.image(dpi=dpi, margin=margin).convert("RGB")
+    scale = dpi / 72
+    offset_x, offset_y = margin[0] * scale, margin[1] * scale
+    results = _tatr_results(ft)
+    draw = ImageDraw.Draw(img)
+    for label, (xmin, ymin, xmax, ymax) in zip(results["labels"], results["boxes"]):
+        draw.rectangle(
+            [xmin * scale + offset_x, ymin * scale + offset_y, xmax * scale + offset_x, ymax * scale + offset_y],
+            outline=_COLORS.get(label, "red"),
+            width=linewidth,
+        )
+    return img
+
+
+def render(ft, renderer=None):
+    renderer = renderer or IMAGE_RENDERER
+    if renderer == "pil":
+        return render_pil(ft)
+    return ft.visualize()
+
+
+def _to_builtin(value):
+    # numpy scalars / arrays left in gmft's dicts
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def table_state(ft):
+    """JSON-safe dict of a formatted table, enough to rebuild it against its page later."""
+    state = ft.to_dict()
+    state.pop("predictions.indices", None)
+    return json.loads(json.dumps(state, default=_to_builtin))
+
+
+def restore_table(state, page):
+    if state.get("ruled"):
+        from ruled_tables import RuledTable
+
+        return RuledTable.from_dict(state, page)
+    from gmft.formatters.tatr import TATRFormattedTable
+
+    return TATRFormattedTable.from_dict(state, page)
+
+
+SIDECAR_SUFFIX = ".render.json"
+
+
+def sidecar_path(image_path):
+    return os.path.splitext(image_path)[0] + SIDECAR_SUFFIX
+
+
+def write_sidecar(image_path, pdf_path, page_index, state, content_hash, renderer=None):
+    """Record what is needed to render image_path on demand, dropping any stale PNG."""
+    if os.path.exists(image_path):
+        os.remove(image_path)
+    with open(sidecar_path(image_path), "w", encoding="utf-8") as f:
+        json.dump({
+            "pdf_path": os.path.abspath(pdf_path),
+            # uploads/<name> can be replaced by another upload of the same name
+            "content_hash": content_hash,
+            "page": page_index,
+            "renderer": renderer or IMAGE_RENDERER,
+            "table": state,
+        }, f)
+
+
+def render_pending_image(image_path):
+    """
+    Render a lazily deferred image from its sidecar. Returns False if there is nothing
+    to render (no sidecar, or the source PDF is gone or is no longer the file the table
+    came from). Blocking; use asyncio.to_thread.
+    """
+    from extraction_cache import file_sha256
+
+    sidecar = sidecar_path(image_path)
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+    except FileNotFoundError:
+        return os.path.exists(image_path)  # another request rendered it meanwhile
+    try:
+        if file_sha256(pending["pdf_path"]) != pending.get("content_hash"):
+            return False
+    except FileNotFoundError:
+        return False
+
+    from gmft.pdf_bindings import PyPDFium2Document
+
+    doc = PyPDFium2Document(pending["pdf_path"])
+    try:
+        ft = restore_table(pending["table"], doc.get_page(pending["page"]))
+        image = render(ft, pending["renderer"])
+        # Concurrent downloads of the same image each render into their own file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(image_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, format="PNG")
+            os.replace(tmp_path, image_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    finally:
+        doc.close()
+
+    try:
+        os.remove(sidecar)
+    except FileNotFoundError:
+        pass
+    return True
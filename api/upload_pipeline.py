@@ -0,0 +1,118 @@
+"""
+Streaming upload handling shared by every endpoint that accepts a PDF.
+
+The upload is copied to disk chunk by chunk with aiofiles, so memory use per upload
+stays constant whatever the file size. While copying we hash the bytes (the SHA-256 is
+the key of the extraction cache), check the %PDF magic on the first chunk and abort
+as soon as the size limit is exceeded.
+
+Starlette spools a multipart body completely before the endpoint runs, so that check
+alone can't stop an oversized upload from being received. BodySizeLimitMiddleware
+enforces the limit while the body is still arriving.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import NamedTuple
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+# Room for the multipart boundaries and the form fields around the file
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware that answers 413 when a request body is over the limit: before
+    reading anything if Content-Length says so, otherwise (chunked bodies) as soon as
+    the received bytes pass it. limits maps path prefixes to their own limit.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES, limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+
+    def _limit(self, path):
+        for prefix, max_bytes in self.limits.items():
+            if path.startswith(prefix):
+                return max_bytes
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self._limit(scope["path"])
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            response = JSONResponse({"detail": "Request body is too large"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class SavedUpload(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+
+async def save_upload(file: UploadFile, dest_path: str, max_bytes: int = MAX_UPLOAD_BYTES) -> SavedUpload:
+    """
+    Stream an UploadFile to dest_path. The file only appears at dest_path once it is
+    complete and valid; on any error the partial file is removed.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    header = b''
+    # Unique in the same directory, so concurrent uploads of one name don't share it and os.replace stays atomic
+    fd, part_path = tempfile.mkstemp(
+        dir=os.path.dirname(dest_path), prefix=os.path.basename(dest_path) + '.', suffix='.part'
+    )
+    os.close(fd)
+    try:
+        async with aiofiles.open(part_path, 'wb') as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(header) < 4:
+                    header += chunk[:4 - len(header)]
+                    if len(header) == 4 and header != b'%PDF':
+                        raise HTTPException(status_code=400, detail="File is not a valid PDF")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than {max_bytes // (1024 * 1024)}MB"
+                    )
+                digest.update(chunk)
+                await out.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="File is empty")
+        if header != b'%PDF':
+            raise HTTPException(status_code=400, detail="File is not a valid PDF")
+        os.replace(part_path, dest_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return SavedUpload(dest_path, size, digest.hexdigest())
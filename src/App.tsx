@@ -1664,7 +1664,8 @@ const ResultsPage = () => {
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
       link.href = url;
-      link.setAttribute('download', filename);
+      // Outputs are namespaced per extraction (<id>/output_page_0_table_0.json)
+      link.setAttribute('download', filename.split('/').pop() || filename);
       document.body.appendChild(link);
       link.click();
       link.remove();
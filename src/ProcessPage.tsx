@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { Upload, Download, Send, FileUp, Coffee } from 'lucide-react';
 import axios from 'axios';
@@ -29,6 +29,10 @@ const ProcessPage = () => {
   const [uploadInfo, setUploadInfo] = useState<{ pdf_id?: number; pages_total?: number; pages_processed?: number; limit_left?: number; has_active_promo?: boolean } | null>(null);
   const [showUploadPopup, setShowUploadPopup] = useState(false);
   const [dragActive, setDragActive] = useState(false);
+  // Aborting the request on unmount lets the server stop extracting pages nobody will see
+  const processController = useRef<AbortController | null>(null);
+
+  useEffect(() => () => processController.current?.abort(), []);
 
   const handleDrag = (e: React.DragEvent) => {
     e.preventDefault();
@@ -111,6 +115,7 @@ const ProcessPage = () => {
     if (!file || !uploadInfo) return;
     setProcessing(true);
     setShowUploadPopup(false);
+    processController.current = new AbortController();
     try {
       // Aktif promosyon varsa tüm sayfaları işle, yoksa kota limiti uygula
       const pagesToProcess = uploadInfo.has_active_promo 
@@ -119,7 +124,7 @@ const ProcessPage = () => {
       
       const processResponse = await axios.get<ProcessResponse>(
         `${API_URL}/process/${file.name}?output_format=both&pages_limit=${pagesToProcess || 30}`,
-        { withCredentials: true }
+        { withCredentials: true, signal: processController.current.signal }
       );
       const newTableData: { [key: number]: any } = {};
       for (let i = 0; i < processResponse.data.tables.length; i++) {
@@ -133,6 +138,7 @@ const ProcessPage = () => {
       // Navigate to results page with data
       navigate('/results', { state: { results: processResponse.data, tableData: newTableData } });
     } catch (err) {
+      if (axios.isCancel(err)) return;
       console.error('Processing error:', err);
       if (axios.isAxiosError(err)) {
         // Backend'den gelen özel hata mesajı
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The api modules import each other by their flat names (from table_format import ...)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import extraction_pool
+import table_format
+from extraction_cache import file_sha256
+
+
+class FakeDoc:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcessor:
+    """Reads the file once when built, like PDFTableProcessor's open pdfium document and page memo."""
+
+    def __init__(self, pdf_path, content_hash=None, text_pages=None):
+        with open(pdf_path, 'rb') as f:
+            self.tables = f.read()
+        self.content_hash = content_hash
+        self.text_pages = text_pages
+        self.doc = FakeDoc()
+
+
+@pytest.fixture(autouse=True)
+def fake_processor(monkeypatch):
+    monkeypatch.setattr(table_format, "PDFTableProcessor", FakeProcessor)
+    extraction_pool._worker_processors.clear()
+    yield
+    extraction_pool._worker_processors.clear()
+
+
+def upload(path, data):
+    """Replace the file the way upload_pipeline.save_upload does."""
+    with open(path + '.part', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.part', path)
+    return file_sha256(path)
+
+
+@pytest.mark.parametrize("pass_hash", [True, False])
+def test_reupload_under_same_name_is_not_served_from_the_old_processor(tmp_path, pass_hash):
+    path = str(tmp_path / "report.pdf")
+
+    first_hash = upload(path, b"%PDF first")
+    first = extraction_pool._get_worker_processor(path, first_hash if pass_hash else None)
+    assert first.tables == b"%PDF first"
+
+    second_hash = upload(path, b"%PDF second upload")
+    second = extraction_pool._get_worker_processor(path, second_hash if pass_hash else None)
+
+    assert second is not first
+    assert second.tables == b"%PDF second upload"
+    assert first.doc.closed
+    if pass_hash:
+        assert second.content_hash == second_hash
+
+
+def test_same_file_reuses_the_processor(tmp_path):
+    path = str(tmp_path / "report.pdf")
+    content_hash = upload(path, b"%PDF same")
+
+    first = extraction_pool._get_worker_processor(path, content_hash, [True])
+    assert extraction_pool._get_worker_processor(path, content_hash, [True]) is first
+    assert first.text_pages == [True]
+    assert not first.doc.closed
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("torch")
+pytest.importorskip("gmft")
+pytest.importorskip("reportlab")
+
+import bench_pipeline
+import onnx_backend
+
+
+def test_onnx_matches_torch_within_tolerance(tmp_path, monkeypatch):
+    # Fresh exports, so the check covers the current export code and not a stale model file
+    monkeypatch.setattr(onnx_backend, "ONNX_MODEL_DIR", str(tmp_path / "onnx"))
+    pdf_path = str(tmp_path / "dense.pdf")
+    bench_pipeline.generate_document(pdf_path, "dense", 2, seed=0)
+
+    report = onnx_backend.check_parity(pdf_path, pages=2)
+
+    assert report["tables"] > 0
+    assert report["detection_logits_max_diff"] <= onnx_backend.LOGITS_ATOL
+    assert report["structure_logits_max_diff"] <= onnx_backend.LOGITS_ATOL
+    assert report["detection_boxes_max_diff"] <= onnx_backend.BOXES_ATOL
+    assert report["structure_boxes_max_diff"] <= onnx_backend.BOXES_ATOL
+    assert report["ok"]